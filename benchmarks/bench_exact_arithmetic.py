@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+精确分数模式基准测试
+
+在同一个问题上比较compact引擎的浮点模式和精确分数模式，
+并报告浮点结果相对精确结果的最大误差。
+
+用法: python benchmarks/bench_exact_arithmetic.py [配置文件.json]
+"""
+
+import json
+import os
+import sys
+import time
+from fractions import Fraction
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'modules'))
+
+from calculation.core import ProbabilityCalculator, BallDrawOperation
+
+
+def _silent(*args):
+    pass
+
+
+def main():
+    default_config = os.path.join(os.path.dirname(__file__), '..', 'config.json')
+    config_file = sys.argv[1] if len(sys.argv) > 1 else default_config
+    with open(config_file, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    operations = [BallDrawOperation(**op) for op in config["operations"]]
+
+    calculator = ProbabilityCalculator()
+    timings = {}
+    results = {}
+    for label, exact_arithmetic in (("浮点", False), ("精确分数", True)):
+        start = time.perf_counter()
+        results[label] = calculator.calculate_exact(
+            config["bags_config"], operations, progress_callback=_silent,
+            engine="compact", exact_arithmetic=exact_arithmetic)
+        timings[label] = time.perf_counter() - start
+
+    print(f"📊 精确分数模式基准测试: {config.get('description', config_file)}")
+    print(f"  最终状态数: {results['浮点']['total_states']:,}")
+    for label, seconds in timings.items():
+        print(f"  {label:8s}: {seconds:8.3f} s, 总概率 {results[label]['total_probability']!r}")
+    print(f"  精确分数/浮点 耗时比: {timings['精确分数'] / timings['浮点']:.2f}x")
+
+    exact = {hand: Fraction(value) for hand, value in results["精确分数"]["exact_hand_distribution"].items()}
+    max_error = max(abs(Fraction(results["浮点"]["hand_distribution"][hand]) - value)
+                    for hand, value in exact.items())
+    print(f"  浮点结果最大绝对误差: {float(max_error):.3e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+超几何概率内核基准测试
+
+在1000个球以上的大袋子上比较两种内核：
+- exact: 大整数 ∏C(n_j, k_j) / C(N, K)
+- log:   log阶乘表在对数空间求和后取exp
+
+分别测量单张结果表的构造耗时和compact引擎的端到端耗时，
+并报告log内核相对exact内核的最大相对误差。
+
+用法: python benchmarks/bench_log_kernel.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'modules'))
+
+from calculation.core import ProbabilityCalculator, BallDrawOperation
+from calculation.outcomes import OutcomeTable, OUTCOME_CACHE, SEGMENT_CACHE
+
+# (袋子组成, 摸球数)
+TABLE_CASES = [
+    ((400, 300, 300), 10),
+    ((400, 300, 300), 40),
+    ((2000, 1500, 1000, 500), 20),
+    ((5000, 3000, 2000), 60),
+]
+
+# 放回之后每个状态的袋子组成都不同，第二次摸球需要为约一千种组成各构造一张结果表
+BIG_PROBLEM = {
+    "bags_config": {
+        1: {"R": 3000, "Y": 2000, "B": 1000},
+        2: {"P": 700, "K": 500},
+    },
+    "operations": [
+        {"bag_id": 1, "draw_count": 25, "operation_type": "draw"},
+        {"bag_id": 2, "draw_count": 1, "operation_type": "draw"},
+        {"bag_id": 1, "draw_count": 1, "operation_type": "return"},
+        {"bag_id": 1, "draw_count": 25, "operation_type": "draw"},
+    ],
+}
+
+
+def _silent(*args):
+    pass
+
+
+def _max_relative_error(approx, exact):
+    return max(abs(a - e) / e for a, e in zip(approx, exact) if e > 0)
+
+
+def bench_tables():
+    print("📊 单张结果表构造")
+    for counts, draw_count in TABLE_CASES:
+        timings = {}
+        tables = {}
+        for kernel in ("exact", "log"):
+            start = time.perf_counter()
+            tables[kernel] = OutcomeTable(counts, draw_count, kernel)
+            timings[kernel] = time.perf_counter() - start
+        error = _max_relative_error(tables["log"].probabilities, tables["exact"].probabilities)
+        print(f"  {str(counts):28s} 摸{draw_count:3d}个  结果数 {len(tables['log']):7,}  "
+              f"exact {timings['exact']:.4f}s  log {timings['log']:.4f}s  "
+              f"加速 {timings['exact'] / timings['log']:.2f}x  最大相对误差 {error:.1e}")
+
+
+def bench_engine():
+    print("📊 compact引擎端到端（6000球和1200球的袋子）")
+    operations = [BallDrawOperation(**op) for op in BIG_PROBLEM["operations"]]
+    calculator = ProbabilityCalculator()
+    results = {}
+    for kernel in ("exact", "log"):
+        # 清空缓存，两种内核都从头构造结果表
+        OUTCOME_CACHE.clear()
+        SEGMENT_CACHE.clear()
+        start = time.perf_counter()
+        results[kernel] = calculator.calculate_exact(BIG_PROBLEM["bags_config"], operations,
+                                                     progress_callback=_silent, engine="compact", kernel=kernel)
+        print(f"  {kernel:5s}: {time.perf_counter() - start:8.3f} s, 最终状态数 {results[kernel]['total_states']:,}, "
+              f"结果表 {OUTCOME_CACHE.stats()['misses']:,} 张")
+    exact = results["exact"]["hand_distribution"]
+    hands = list(exact)
+    error = _max_relative_error([results["log"]["hand_distribution"][hand] for hand in hands],
+                                [exact[hand] for hand in hands])
+    print(f"  手牌分布最大相对误差: {error:.1e}")
+
+
+def main():
+    bench_tables()
+    bench_engine()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+状态合并基准测试
+
+比较旧的有损合并键（手状态 + 各袋子球总数）与
+新的完整组成合并键（手状态 + 驻留袋子ID）的速度。
+
+用法: python benchmarks/bench_merge.py [重复次数]
+"""
+
+import gc
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'modules'))
+
+from calculation.core import ProbabilityCalculator, BagState, BagInterner
+
+
+def build_states(calculator):
+    """
+    按config.json生成一个未合并的前沿：
+    先摸袋1三个、袋2两个并合并，再对每个状态摸袋1三个球
+    """
+    bags = {"1": BagState({"R": 80, "Y": 60, "B": 100}),
+            "2": BagState({"P": 80, "Pk": 30}),
+            "3": BagState({"G": 30, "K": 80, "W": 160})}
+    frontier = []
+    for balls1, p1 in bags["1"].draw_balls(3):
+        for balls2, p2 in bags["2"].draw_balls(2):
+            new_bags = {bag_id: bag.copy() for bag_id, bag in bags.items()}
+            new_bags["1"].remove_balls(balls1)
+            new_bags["2"].remove_balls(balls2)
+            frontier.append({"hand": Counter(balls1 + balls2), "bags": new_bags,
+                             "prob": p1 * p2, "path": []})
+    # 与引擎中一样，父状态在上一步合并时已经驻留过
+    calculator.bag_interner = BagInterner()
+    frontier = calculator._merge_states(frontier)
+
+    states = []
+    for state in frontier:
+        for balls, prob in state["bags"]["1"].draw_balls(3):
+            new_bags = {bag_id: bag.copy() for bag_id, bag in state["bags"].items()}
+            new_bags["1"].remove_balls(balls)
+            hand = Counter(state["hand"])
+            hand.update(balls)
+            states.append({"hand": hand, "bags": new_bags,
+                           "prob": state["prob"] * prob, "path": []})
+    return states
+
+
+def lossy_merge(states):
+    """旧实现：只按袋子球总数区分袋子状态"""
+    merged_dict = {}
+    for state in states:
+        hand_key = tuple(sorted(state["hand"].items()))
+        bag_summaries = []
+        for bag_id, bag in sorted(state["bags"].items()):
+            bag_summaries.append((bag_id, sum(bag.color_counts.values())))
+        full_key = (hand_key, tuple(bag_summaries))
+        if full_key in merged_dict:
+            merged_dict[full_key]["prob"] += state["prob"]
+        else:
+            merged_dict[full_key] = state.copy()
+    return list(merged_dict.values())
+
+
+def bench(label, func, calculator, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        # 每次重新生成状态，避免驻留ID缓存在重复测量之间复用
+        states = build_states(calculator)
+        gc.collect()
+        gc.disable()
+        start = time.perf_counter()
+        merged = func(states)
+        best = min(best, time.perf_counter() - start)
+        gc.enable()
+    print(f"  {label:24s}: {best * 1000:8.2f} ms, {len(states):,} -> {len(merged):,} 个状态")
+    return best
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"📊 状态合并基准测试，取 {repeats} 次最好成绩")
+
+    calculator = ProbabilityCalculator()
+    lossy = bench("有损键(旧)", lossy_merge, calculator, repeats)
+    full = bench("完整组成+驻留ID(新)", calculator._merge_states, calculator, repeats)
+    print(f"  速度比: {lossy / full:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,7 @@ def show_main_menu():
     print("5. 📁 保存当前配置")
     print("6. 📖 加载配置文件")
     print("7. 🗑️  清理结果文件")
+    print("8. 🤖 自动选择计算方法")
     print("Q. 🚪 退出")
     print("=" * 60)
 
@@ -46,7 +47,7 @@ def main():
     
     while True:
         show_main_menu()
-        choice = input("\n请选择操作 (1-7, q退出): ").strip().lower()
+        choice = input("\n请选择操作 (1-8, q退出): ").strip().lower()
         
         if choice == 'q':
             print("\n👋 感谢使用，再见！")
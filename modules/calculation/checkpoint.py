@@ -0,0 +1,130 @@
+"""
+精确计算的检查点
+
+compact引擎每完成一个操作就把前沿写入检查点文件，文件名是问题的哈希
+（袋子配置、操作序列和影响前沿的计算选项），中断后用相同的问题重新
+计算时可以从最近的检查点继续。
+
+文件格式：先是一个pickle的头部（已完成的操作编号、状态宽度、状态数、
+引擎的累计量），之后是若干个pickle的数据块，每块包含一个int32状态数组
+和对应的概率（float64数组，精确分数模式下为整数分子列表）。写入先写
+临时文件再原子替换，中断时不会留下损坏的检查点。
+"""
+import hashlib
+import json
+import os
+import pickle
+from array import array
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+CHECKPOINT_VERSION = 1
+# 每个数据块的状态数
+_CHUNK_STATES = 65536
+
+
+def problem_key(bags_config: Dict[Any, Dict[str, int]], operations: List[Any], **options) -> str:
+    """
+    问题的规范哈希
+
+    袋子按配置中的顺序（决定状态元组的布局），袋子ID统一转换为字符串，
+    options中放所有影响前沿内容的计算选项。
+    """
+    canonical = {
+        "bags": [[str(bag_id), sorted(color_counts.items())] for bag_id, color_counts in bags_config.items()],
+        "operations": [[str(op.bag_id), op.draw_count, op.operation_type] for op in operations],
+        "options": sorted(options.items()),
+    }
+    encoded = json.dumps(canonical, ensure_ascii=False, sort_keys=True, default=repr)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:32]
+
+
+class StoredFrontier:
+    """检查点文件中的前沿，按块流式读出，不一次性载入内存"""
+
+    def __init__(self, path: str, width: int, count: int, offset: int):
+        self.path = path
+        self.width = width
+        self.count = count
+        self._offset = offset
+
+    def __len__(self):
+        return self.count
+
+    def items(self) -> Iterator[Tuple[Tuple[int, ...], Any]]:
+        width = self.width
+        remaining = self.count
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            while remaining > 0:
+                states, weights = pickle.load(f)
+                for row, weight in enumerate(weights):
+                    yield tuple(states[row * width:(row + 1) * width]), weight
+                remaining -= len(weights)
+
+
+class Checkpointer:
+    """
+    一个问题的检查点文件
+
+    参数:
+        directory: 检查点目录，不存在时自动创建
+        key: problem_key()得到的问题哈希
+    """
+
+    def __init__(self, directory: str, key: str):
+        self.directory = directory
+        self.key = key
+        self.path = os.path.join(directory, f"{key}.ckpt")
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def save(self, completed: int, frontier, width: int, exact_arithmetic: bool, engine_state: Dict[str, Any]):
+        """写入完成第completed个操作（从0开始）之后的前沿"""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        header = {
+            "version": CHECKPOINT_VERSION,
+            "key": self.key,
+            "completed": completed,
+            "width": width,
+            "count": len(frontier),
+            "exact_arithmetic": exact_arithmetic,
+            "engine_state": engine_state,
+        }
+        with open(tmp_path, "wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            items = iter(frontier.items())
+            while True:
+                chunk = list(islice(items, _CHUNK_STATES))
+                if not chunk:
+                    break
+                states = array("i")
+                for state, _ in chunk:
+                    states.extend(state)
+                if exact_arithmetic:
+                    weights = [weight for _, weight in chunk]
+                else:
+                    weights = array("d", (weight for _, weight in chunk))
+                pickle.dump((states, weights), f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> Optional[Tuple[int, Dict[str, Any], StoredFrontier]]:
+        """读出(已完成的操作编号, 引擎累计量, 前沿)，没有可用的检查点时返回None"""
+        if not self.exists():
+            return None
+        with open(self.path, "rb") as f:
+            header = pickle.load(f)
+            offset = f.tell()
+        if header.get("version") != CHECKPOINT_VERSION or header.get("key") != self.key:
+            return None
+        frontier = StoredFrontier(self.path, header["width"], header["count"], offset)
+        return header["completed"], header["engine_state"], frontier
+
+    def remove(self):
+        for path in (self.path, f"{self.path}.tmp"):
+            if os.path.exists(path):
+                os.remove(path)
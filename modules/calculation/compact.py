@@ -0,0 +1,717 @@
+"""
+紧凑状态精确计算引擎
+
+颜色被驻留为全局整数索引，每个状态存储为一个定长整数元组：
+前C个元素是手中各颜色的球数，之后每C个元素依次对应一个袋子。
+状态合并只需要一次字典查找，不再复制Counter和BagState对象。
+
+在最后一次使用之后，袋子会被移出状态（对应计数清零），其最终组成的
+边缘分布单独累计，这样不再变化的袋子不会继续放大前沿。
+
+并行模式下，每一步把前沿按状态哈希分片交给工作进程展开并局部合并，
+子状态再按哈希分区做第二次交换，由工作进程完成全局合并。
+
+内存预算模式下，超出预算的前沿按哈希分区溢出到磁盘（见spill.py），
+逐个分区展开和合并，不需要有损的剪枝。
+
+指定检查点目录时，每个操作完成后前沿写入检查点（见checkpoint.py），
+中断后可以从最近的检查点继续；指定前缀缓存时，每个操作后的前沿进入
+缓存（见prefix_cache.py），修改后面的操作后从最长的已缓存前缀继续。
+
+精确分数模式下，概率以整数分子存储，所有状态共享一个公共分母。
+同一步中所有状态的袋子球数和手中球数都相同，因此每步的分母
+（C(N, K)或手中球数）对所有状态一致，只需乘到公共分母上。
+"""
+import math
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from typing import Dict, List, Tuple, Optional, Any, Callable, Iterable, Union
+from collections import defaultdict
+from operator import itemgetter
+from .outcomes import KERNELS, LOG_FACTORIAL, OUTCOME_CACHE, SEGMENT_CACHE
+from .pruning import PruningPolicy
+from .spill import FrontierSpiller, SpilledFrontier
+from .checkpoint import Checkpointer, StoredFrontier, problem_key
+from .prefix_cache import PrefixCache, prefix_keys
+from .segments import DrawSegment, find_draw_segments
+
+EMPTY_HAND = "空手"
+EMPTY_BAG = "空袋"
+
+
+class ColorIndex:
+    """颜色驻留表，在颜色名和全局整数索引之间转换"""
+
+    def __init__(self, colors: Iterable[str] = ()):
+        self.colors: List[str] = []
+        self._index: Dict[str, int] = {}
+        for color in colors:
+            self.intern(color)
+
+    @classmethod
+    def from_config(cls, bags_config: Dict[Any, Dict[str, int]]) -> "ColorIndex":
+        """按配置中出现的顺序驻留所有颜色"""
+        index = cls()
+        for color_counts in bags_config.values():
+            for color in color_counts:
+                index.intern(color)
+        return index
+
+    def intern(self, color: str) -> int:
+        """返回颜色的索引，新颜色会被追加到表尾"""
+        idx = self._index.get(color)
+        if idx is None:
+            idx = len(self.colors)
+            self._index[color] = idx
+            self.colors.append(color)
+        return idx
+
+    def index(self, color: str) -> int:
+        return self._index[color]
+
+    def __len__(self):
+        return len(self.colors)
+
+    def __contains__(self, color):
+        return color in self._index
+
+    def __repr__(self):
+        return f"ColorIndex({self.colors})"
+
+
+class StateLayout:
+    """
+    定长状态元组的布局
+
+    状态 = 手(C个计数) + 袋子1(C个计数) + 袋子2(C个计数) + ...
+    """
+
+    def __init__(self, bags_config: Dict[Any, Dict[str, int]]):
+        self.color_index = ColorIndex.from_config(bags_config)
+        self.colors = self.color_index.colors
+        self.num_colors = len(self.color_index)
+        self.bag_ids = list(bags_config.keys())
+        self.width = self.num_colors * (1 + len(self.bag_ids))
+        self._positions = {bag_id: pos for pos, bag_id in enumerate(self.bag_ids)}
+        # 描述字符串按颜色名排序，与BagState.to_string保持一致
+        self._sorted_colors = sorted(range(self.num_colors), key=lambda i: self.colors[i])
+
+    def bag_position(self, bag_id) -> Optional[int]:
+        """袋子在布局中的位置（兼容字符串和整数类型的键），不存在时返回None"""
+        pos = self._positions.get(bag_id)
+        if pos is None:
+            pos = self._positions.get(str(bag_id))
+        return pos
+
+    def bag_offset(self, pos: int) -> int:
+        """袋子计数在状态元组中的起始下标"""
+        return self.num_colors * (pos + 1)
+
+    def initial_state(self, bags_config: Dict[Any, Dict[str, int]]) -> Tuple[int, ...]:
+        """空手、袋子为初始配置的状态"""
+        state = [0] * self.width
+        for pos, bag_id in enumerate(self.bag_ids):
+            offset = self.bag_offset(pos)
+            for color, count in bags_config[bag_id].items():
+                state[offset + self.color_index.index(color)] += count
+        return tuple(state)
+
+    def describe_counts(self, counts, empty_label: str) -> str:
+        """把计数向量格式化为"2R+1Y"形式"""
+        parts = [f"{counts[i]}{self.colors[i]}" for i in self._sorted_colors if counts[i] > 0]
+        return "+".join(parts) if parts else empty_label
+
+    def describe_hand(self, state: Tuple[int, ...]) -> str:
+        return self.describe_counts(state[:self.num_colors], EMPTY_HAND)
+
+    def describe_bag(self, state: Tuple[int, ...], pos: int) -> str:
+        offset = self.bag_offset(pos)
+        return self.describe_counts(state[offset:offset + self.num_colors], EMPTY_BAG)
+
+
+# 浮点模式下为float概率，精确分数模式下为公共分母上的整数分子
+Weight = Union[float, int]
+
+
+def bag_last_use(operations: List[Any], layout: StateLayout) -> Dict[int, int]:
+    """
+    活跃性分析：每个袋子（按布局位置）最后一次被操作使用的下标
+
+    摸球、丢球和放回都算使用；从未被使用的袋子为-1。
+    """
+    last_use = {pos: -1 for pos in range(len(layout.bag_ids))}
+    for op_idx, operation in enumerate(operations):
+        pos = layout.bag_position(operation.bag_id)
+        if pos is not None and operation.operation_type in ("draw", "discard", "return"):
+            last_use[pos] = op_idx
+    return last_use
+
+
+class CompactExactEngine:
+    """基于定长整数元组状态的精确计算引擎"""
+
+    # 前沿小于该规模时并行的进程通信开销大于收益，直接串行展开
+    PARALLEL_MIN_STATES = 2000
+
+    def __init__(self, bags_config: Dict[Any, Dict[str, int]], exact_arithmetic: bool = False,
+                 output_bags: Optional[Iterable[Any]] = None, workers: int = 1,
+                 pruning: Optional[PruningPolicy] = None, memory_budget: Optional[int] = None,
+                 spill_dir: Optional[str] = None, checkpoint_dir: Optional[str] = None, resume: bool = False,
+                 prefix_cache: Optional[PrefixCache] = None, fuse_segments: bool = True, kernel: str = "auto"):
+        if workers < 1:
+            raise ValueError(f"工作进程数必须为正数: {workers}")
+        if kernel not in KERNELS:
+            raise ValueError(f"未知的概率计算内核: {kernel}，可用内核: {KERNELS}")
+        if exact_arithmetic and kernel == "log":
+            raise ValueError("精确分数模式只能使用exact内核")
+        if memory_budget is not None and (exact_arithmetic or workers != 1):
+            raise ValueError("内存预算模式不支持精确分数模式和并行展开")
+        self.bags_config = bags_config
+        self.workers = workers
+        # 内存预算模式下超出预算的前沿溢出到磁盘，默认不再按状态数剪枝
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.spiller: Optional[FrontierSpiller] = None
+        if pruning is None:
+            pruning = PruningPolicy.disabled() if memory_budget is not None else PruningPolicy()
+        self.pruning = pruning
+        # 每个操作完成后写检查点，resume时从最近的检查点继续
+        self.checkpoint_dir = checkpoint_dir
+        self.resume = resume
+        self.checkpointer: Optional[Checkpointer] = None
+        self.resumed_from: Optional[int] = None
+        # 跨多次计算共享的前缀缓存，命中时从最长的已缓存前缀继续
+        self.prefix_cache = prefix_cache
+        self._prefix_keys: Optional[List[str]] = None
+        self.prefix_reused = 0
+        # 同一袋子上连续的摸球/丢球作为一次多元超几何分布整体展开
+        self.fuse_segments = fuse_segments
+        self._segments: Dict[int, DrawSegment] = {}
+        self.layout = StateLayout(bags_config)
+        self.exact_arithmetic = exact_arithmetic
+        # 超几何概率的计算内核，精确分数模式下始终使用整数权重
+        self.kernel = "exact" if exact_arithmetic else kernel
+        self.denominator = 1  # 精确分数模式下所有分子共享的分母
+        if output_bags is None:
+            self.output_positions = set(range(len(self.layout.bag_ids)))
+        else:
+            self.output_positions = set()
+            for bag_id in output_bags:
+                pos = self.layout.bag_position(bag_id)
+                if pos is None:
+                    raise KeyError(f"袋子ID {bag_id} 不存在于配置中")
+                self.output_positions.add(pos)
+        # 已移出状态的袋子: {布局位置: {计数元组: 概率}}，概率为float或Fraction
+        self.bag_marginals: Dict[int, Dict[Tuple[int, ...], Any]] = {}
+        # 剪枝丢弃的概率质量（精确分数模式下为Fraction）和状态数
+        self.pruned_mass: Any = 0.0
+        self.pruned_states = 0
+
+    def run(self, operations: List[Any],
+            progress_callback: Optional[Callable[[int, int, str], None]] = None) -> Dict[Tuple[int, ...], Weight]:
+        """执行全部操作，返回最终的 {状态元组: 概率或分子}"""
+        if progress_callback:
+            progress_callback(0, len(operations), "开始精确计算...")
+        else:
+            print("开始精确计算...")
+
+        self.denominator = 1
+        self.bag_marginals = {}
+        self.pruned_mass = Fraction(0) if self.exact_arithmetic else 0.0
+        self.pruned_states = 0
+        if self.memory_budget is not None:
+            self.close()
+            self.spiller = FrontierSpiller(self.layout.width, self.memory_budget, self.spill_dir)
+            self._color_bounds = self._bag_color_bounds(operations)
+        frontier = self._initial_frontier()
+        self._size_log_factorials(operations)
+
+        # 按最后使用位置分组，-1表示从未使用的袋子，在开始前就移出
+        retire_after = defaultdict(list)
+        for pos, last_op in bag_last_use(operations, self.layout).items():
+            retire_after[last_op].append(pos)
+
+        start = 0
+        self.checkpointer = None
+        self.resumed_from = None
+        if self.checkpoint_dir is not None:
+            self.checkpointer = Checkpointer(self.checkpoint_dir, self._problem_key(operations))
+            restored = self.checkpointer.load() if self.resume else None
+            if restored is not None:
+                completed, engine_state, stored = restored
+                self._restore_checkpoint_state(engine_state)
+                frontier = self._load_stored(stored)
+                start = completed + 1
+                self.resumed_from = start
+                message = f"从检查点恢复: 已完成 {start}/{len(operations)} 个操作"
+                if progress_callback:
+                    progress_callback(start, len(operations), message)
+                else:
+                    print(message)
+        self._prefix_keys = None
+        self.prefix_reused = 0
+        if self.prefix_cache is not None:
+            self._prefix_keys = self._cache_keys(operations, retire_after)
+            cached = self.prefix_cache.longest_prefix(self._prefix_keys) if start == 0 else None
+            if cached is not None:
+                completed, cached_frontier, engine_state = cached
+                self._restore_checkpoint_state(engine_state)
+                frontier = (self._load_stored(cached_frontier) if isinstance(cached_frontier, StoredFrontier)
+                            else cached_frontier)
+                start = completed + 1
+                self.prefix_reused = start
+                message = f"前缀缓存命中: 复用前 {start}/{len(operations)} 个操作的结果"
+                if progress_callback:
+                    progress_callback(start, len(operations), message)
+                else:
+                    print(message)
+        if start == 0:
+            frontier = self._retire_bags(frontier, retire_after.get(-1, []))
+        self._segments = self._find_segments(operations, start)
+
+        pool = None
+        if self.workers > 1:
+            pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                       initargs=(self.bags_config, self.exact_arithmetic, self.kernel))
+        try:
+            frontier = self._run_operations(operations, frontier, retire_after, pool, progress_callback, start)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        if self.checkpointer is not None:
+            self.checkpointer.remove()
+
+        if progress_callback:
+            progress_callback(len(operations), len(operations), "计算完成")
+        else:
+            print(f"计算完成，最终状态数: {len(frontier)}")
+
+        return frontier
+
+    def _frontier_options(self) -> Dict[str, Any]:
+        """所有影响前沿内容的计算选项"""
+        return {
+            "exact_arithmetic": self.exact_arithmetic,
+            "output_positions": sorted(self.output_positions),
+            "pruning": [self.pruning.max_states, self.pruning.keep, self.pruning.min_probability],
+            "kernel": self.kernel,
+        }
+
+    def _problem_key(self, operations: List[Any]) -> str:
+        """检查点的键：问题本身和所有影响前沿内容的选项"""
+        return problem_key(self.bags_config, operations, **self._frontier_options())
+
+    def _cache_keys(self, operations: List[Any], retire_after: Dict[int, List[int]]) -> List[str]:
+        """每个前缀的缓存键，包含完成该操作时已经移出的袋子"""
+        retired = list(retire_after.get(-1, []))
+        retired_after = []
+        for op_idx in range(len(operations)):
+            retired.extend(retire_after.get(op_idx, []))
+            retired_after.append(list(retired))
+        return prefix_keys(self.bags_config, operations, retired_after, **self._frontier_options())
+
+    def _checkpoint_state(self) -> Dict[str, Any]:
+        return {
+            "denominator": self.denominator,
+            "bag_marginals": dict(self.bag_marginals),
+            "pruned_mass": self.pruned_mass,
+            "pruned_states": self.pruned_states,
+        }
+
+    def _restore_checkpoint_state(self, state: Dict[str, Any]):
+        self.denominator = state["denominator"]
+        self.bag_marginals = dict(state["bag_marginals"])
+        self.pruned_mass = state["pruned_mass"]
+        self.pruned_states = state["pruned_states"]
+
+    def _load_stored(self, stored: StoredFrontier):
+        """载入检查点中的前沿，超出内存预算时直接分区溢出到磁盘"""
+        if self.spiller is not None and not self.spiller.fits(len(stored)):
+            return self.spiller.map(stored, lambda part: part, 1)
+        return dict(stored.items())
+
+    def _bag_color_bounds(self, operations: List[Any]) -> Dict[int, int]:
+        """每个袋子中最多可能出现的颜色数：有放回进入的袋子可能出现任何颜色"""
+        bounds = {}
+        for pos, bag_id in enumerate(self.layout.bag_ids):
+            bounds[pos] = sum(1 for count in self.bags_config[bag_id].values() if count > 0)
+        for operation in operations:
+            pos = self.layout.bag_position(operation.bag_id)
+            if operation.operation_type == "return" and pos is not None:
+                bounds[pos] = self.layout.num_colors
+        return bounds
+
+    def _fanout_bound(self, operation) -> int:
+        """一个状态执行该操作最多产生的子状态数"""
+        if operation.operation_type in ("draw", "discard"):
+            pos = self.layout.bag_position(operation.bag_id)
+            colors = max(1, self._color_bounds.get(pos, 1))
+            return math.comb(operation.draw_count + colors - 1, colors - 1)
+        if operation.operation_type == "return":
+            return max(1, self.layout.num_colors)
+        if operation.operation_type == "segment":
+            pos = self.layout.bag_position(operation.bag_id)
+            colors = max(1, self._color_bounds.get(pos, 1))
+            return (math.comb(operation.draw_count + colors - 1, colors - 1)
+                    * math.comb(operation.discard_count + colors - 1, colors - 1))
+        return 1
+
+    def close(self):
+        """删除内存预算模式下的溢出文件"""
+        if self.spiller is not None:
+            self.spiller.cleanup()
+            self.spiller = None
+
+    def _initial_frontier(self):
+        """只包含初始状态、概率为1的前沿"""
+        return {self.layout.initial_state(self.bags_config): 1 if self.exact_arithmetic else 1.0}
+
+    def _size_log_factorials(self, operations: List[Any]):
+        """log阶乘表按最大可能的袋子预先扩展：最大的袋子加上所有放回的球"""
+        if self.kernel == "exact":
+            return
+        returns = sum(1 for operation in operations if operation.operation_type == "return")
+        largest = max((sum(color_counts.values()) for color_counts in self.bags_config.values()), default=0)
+        LOG_FACTORIAL.ensure(largest + returns)
+
+    def _find_segments(self, operations: List[Any], start: int = 0) -> Dict[int, DrawSegment]:
+        if not self.fuse_segments:
+            return {}
+        return find_draw_segments(self.bags_config, operations, self.layout, start)
+
+    def _run_operations(self, operations, frontier, retire_after, pool, progress_callback, start: int = 0):
+        total_states_processed = 0
+        op_idx = start
+        while op_idx < len(operations):
+            operation = self._segments.get(op_idx, operations[op_idx])
+            last_idx = operation.end if isinstance(operation, DrawSegment) else op_idx
+            if progress_callback:
+                progress_callback(op_idx, len(operations), f"处理操作: {operation}")
+            elif last_idx > op_idx:
+                print(f"  处理操作 {op_idx+1}-{last_idx+1}/{len(operations)}（合并为一次超几何分布）: {operation}")
+            else:
+                print(f"  处理操作 {op_idx+1}/{len(operations)}: {operation}")
+
+            if self.spiller is not None:
+                frontier = self.spiller.map(frontier, lambda part: self.expand(part, operation),
+                                            self._fanout_bound(operation))
+                if isinstance(frontier, SpilledFrontier) and not progress_callback:
+                    print(f"    前沿超出内存预算，溢出到磁盘: {len(frontier.partitions)}个分区")
+            elif pool is not None and len(frontier) >= self.PARALLEL_MIN_STATES:
+                frontier = self._expand_parallel(pool, frontier, operation)
+            else:
+                frontier = self.expand(frontier, operation)
+            retiring = [pos for idx in range(op_idx, last_idx + 1) for pos in retire_after.get(idx, [])]
+            if retiring:
+                frontier = self._retire_bags(frontier, retiring)
+                if not progress_callback:
+                    retired = ", ".join(str(self.layout.bag_ids[pos]) for pos in retiring)
+                    print(f"    袋子{retired}不再使用，移出状态空间")
+
+            total_states_processed += len(frontier)
+            if not progress_callback:
+                print(f"    生成状态: {len(frontier)}个, 累计状态: {total_states_processed}")
+
+            if not isinstance(frontier, SpilledFrontier) and self.pruning.triggers(len(frontier)):
+                if self.pruning.exceeds(len(frontier)) and not progress_callback:
+                    print(f"⚠️  状态过多 ({len(frontier)})，进行剪枝...")
+                frontier = self._prune(frontier)
+
+            if self.checkpointer is not None:
+                self.checkpointer.save(last_idx, frontier, self.layout.width, self.exact_arithmetic,
+                                       self._checkpoint_state())
+            if self.prefix_cache is not None:
+                self.prefix_cache.put(self._prefix_keys[last_idx], frontier, self.layout.width,
+                                      self.exact_arithmetic, self._checkpoint_state())
+            op_idx = last_idx + 1
+        return frontier
+
+    def expand(self, frontier: Dict[Tuple[int, ...], Weight], operation) -> Dict[Tuple[int, ...], Weight]:
+        """对整个前沿执行一个操作，并在生成时合并相同状态"""
+        new_frontier, step_denominator = self._expand_step(frontier, operation)
+        if self.exact_arithmetic:
+            self._apply_denominator(new_frontier, step_denominator or 1)
+        return new_frontier
+
+    def _expand_step(self, frontier, operation):
+        """展开一步，返回(新前沿, 本步分母)，分母只在精确分数模式下有意义"""
+        if operation.operation_type in ("draw", "discard"):
+            return self._expand_removal(frontier, operation, to_hand=operation.operation_type == "draw")
+        if operation.operation_type == "return":
+            return self._expand_return(frontier, operation)
+        if operation.operation_type == "segment":
+            return self._expand_segment(frontier, operation)
+        return frontier, None
+
+    def _expand_parallel(self, pool: ProcessPoolExecutor, frontier, operation):
+        """按状态哈希分片并行展开，再按子状态哈希分区并行合并"""
+        partitions = self.workers
+        shards = [[] for _ in range(partitions)]
+        for item in frontier.items():
+            shards[hash(item[0]) % partitions].append(item)
+
+        futures = [pool.submit(_expand_shard, shard, operation, partitions) for shard in shards if shard]
+        exchanged = [[] for _ in range(partitions)]
+        step_denominator = None
+        # 按提交顺序收集结果，保证相同进程数下合并顺序固定
+        for future in futures:
+            parts, shard_denominator = future.result()
+            if self.exact_arithmetic and shard_denominator is not None:
+                step_denominator = self._shared_denominator(step_denominator, shard_denominator)
+            for partition, part in zip(exchanged, parts):
+                partition.append(part)
+
+        new_frontier: Dict[Tuple[int, ...], Weight] = {}
+        for merged in pool.map(_merge_partition, exchanged):
+            new_frontier.update(merged)
+        if self.exact_arithmetic:
+            self._apply_denominator(new_frontier, step_denominator or 1)
+        return new_frontier
+
+    def _retire_bags(self, frontier: Dict[Tuple[int, ...], Weight], positions: List[int]):
+        """把不再使用的袋子移出状态：需要输出的袋子先累计边缘分布，再把计数清零并合并"""
+        if not positions:
+            return frontier
+        num_colors = self.layout.num_colors
+        spans = [(self.layout.bag_offset(pos), self.layout.bag_offset(pos) + num_colors) for pos in positions]
+
+        for pos, (offset, end) in zip(positions, spans):
+            if pos not in self.output_positions:
+                continue
+            totals = defaultdict(int)
+            for state, prob in frontier.items():
+                totals[state[offset:end]] += prob
+            self.bag_marginals[pos] = {counts: self._to_marginal(total) for counts, total in totals.items()}
+
+        if self.spiller is not None:
+            return self.spiller.map(frontier, lambda part: self._zero_bags(part, spans), 1)
+        return self._zero_bags(frontier, spans)
+
+    def _zero_bags(self, frontier: Dict[Tuple[int, ...], Weight], spans: List[Tuple[int, int]]):
+        """把指定区间的计数清零并合并相同状态"""
+        zeros = (0,) * self.layout.num_colors
+        new_frontier: Dict[Tuple[int, ...], Weight] = {}
+        get = new_frontier.get
+        for state, prob in frontier.items():
+            child = list(state)
+            for offset, end in spans:
+                child[offset:end] = zeros
+            child_key = tuple(child)
+            new_frontier[child_key] = get(child_key, 0) + prob
+        return new_frontier
+
+    def _to_marginal(self, weight: Weight):
+        """边缘分布在记录时就固定为概率，精确分数模式下用Fraction避免受后续分母变化影响"""
+        if self.exact_arithmetic:
+            return Fraction(weight, self.denominator)
+        return weight
+
+    def _apply_denominator(self, frontier: Dict[Tuple[int, ...], int], step_denominator: int):
+        """把本步分母乘到公共分母上，并约去分子与分母的最大公约数"""
+        self.denominator *= step_denominator
+        divisor = math.gcd(self.denominator, *frontier.values())
+        if divisor > 1:
+            self.denominator //= divisor
+            for state in frontier:
+                frontier[state] //= divisor
+
+    @staticmethod
+    def _shared_denominator(current: Optional[int], denominator: int) -> int:
+        if current is not None and current != denominator:
+            raise RuntimeError(f"精确分数模式要求同一步的所有状态共享分母: {current} != {denominator}")
+        return denominator
+
+    def _expand_removal(self, frontier, operation, to_hand: bool):
+        pos = self.layout.bag_position(operation.bag_id)
+        if pos is None:
+            raise KeyError(f"袋子ID {operation.bag_id} 不存在于配置中")
+        offset = self.layout.bag_offset(pos)
+        end = offset + self.layout.num_colors
+
+        exact_arithmetic = self.exact_arithmetic
+        step_denominator = None
+        new_frontier: Dict[Tuple[int, ...], Weight] = {}
+        get = new_frontier.get
+        for state, prob in frontier.items():
+            table = OUTCOME_CACHE.get(state[offset:end], operation.draw_count, self.kernel)
+            if exact_arithmetic:
+                step_denominator = self._shared_denominator(step_denominator, table.denominator)
+                draw_weights = table.weights
+            else:
+                draw_weights = table.probabilities
+            for taken, draw_prob in zip(table.sparse, draw_weights):
+                child = list(state)
+                for color_idx, take in taken:
+                    child[offset + color_idx] -= take
+                    if to_hand:
+                        child[color_idx] += take
+                child_key = tuple(child)
+                new_frontier[child_key] = get(child_key, 0) + prob * draw_prob
+        return new_frontier, step_denominator
+
+    def _expand_segment(self, frontier, segment: DrawSegment):
+        """一次展开整个连续摸球/丢球段：每个状态直接得到段结束后的所有结果"""
+        pos = self.layout.bag_position(segment.bag_id)
+        offset = self.layout.bag_offset(pos)
+        end = offset + self.layout.num_colors
+
+        exact_arithmetic = self.exact_arithmetic
+        step_denominator = None
+        new_frontier: Dict[Tuple[int, ...], Weight] = {}
+        get = new_frontier.get
+        for state, prob in frontier.items():
+            table = SEGMENT_CACHE.get(state[offset:end], segment.draw_count, segment.discard_count, self.kernel)
+            if exact_arithmetic:
+                step_denominator = self._shared_denominator(step_denominator, table.denominator)
+                segment_weights = table.weights
+            else:
+                segment_weights = table.probabilities
+            for moved, segment_prob in zip(table.sparse, segment_weights):
+                child = list(state)
+                for color_idx, removed, drawn in moved:
+                    child[offset + color_idx] -= removed
+                    child[color_idx] += drawn
+                child_key = tuple(child)
+                new_frontier[child_key] = get(child_key, 0) + prob * segment_prob
+        return new_frontier, step_denominator
+
+    def _expand_return(self, frontier, operation):
+        num_colors = self.layout.num_colors
+        pos = self.layout.bag_position(operation.bag_id)
+        # 袋子不存在时球离开手后不进入任何袋子，与字典引擎行为一致
+        offset = self.layout.bag_offset(pos) if pos is not None else None
+
+        exact_arithmetic = self.exact_arithmetic
+        step_denominator = None
+        new_frontier: Dict[Tuple[int, ...], Weight] = {}
+        get = new_frontier.get
+        for state, prob in frontier.items():
+            hand_size = sum(state[:num_colors])
+            if exact_arithmetic:
+                # 选中每个球的概率为 1/手中球数，手空时分母为1
+                step_denominator = self._shared_denominator(step_denominator, hand_size or 1)
+            if hand_size == 0:
+                # 手中没球，直接传递状态
+                new_frontier[state] = get(state, 0) + prob
+                continue
+            for color_idx in range(num_colors):
+                held = state[color_idx]
+                if held == 0:
+                    continue
+                child = list(state)
+                child[color_idx] -= 1
+                if offset is not None:
+                    child[offset + color_idx] += 1
+                child_key = tuple(child)
+                if exact_arithmetic:
+                    new_frontier[child_key] = get(child_key, 0) + prob * held
+                else:
+                    new_frontier[child_key] = get(child_key, 0.0) + prob * (held / hand_size)
+        return new_frontier, step_denominator
+
+    def _prune(self, frontier):
+        """按剪枝策略丢弃状态，不重新归一化，丢弃的概率质量计入误差上界"""
+        scale = self.denominator if self.exact_arithmetic else 1
+        kept, dropped, count = self.pruning.select(list(frontier.items()), itemgetter(1), scale)
+        if not count:
+            return frontier
+        self._record_pruned(dropped, count)
+        print(f"  剪枝后保留 {len(kept)} 个状态 (原 {len(frontier)} 个)，丢弃概率 {float(self.pruned_mass):.3e}")
+        return dict(kept)
+
+    def _record_pruned(self, dropped: Weight, count: int):
+        if self.exact_arithmetic:
+            self.pruned_mass += Fraction(dropped, self.denominator)
+        else:
+            self.pruned_mass += dropped
+        self.pruned_states += count
+
+    def aggregate(self, frontier: Dict[Tuple[int, ...], Weight]) -> Dict[str, Any]:
+        """汇总为与ProbabilityCalculator._aggregate_results相同格式的结果"""
+        hand_totals = defaultdict(int)
+        live_positions = [pos for pos in sorted(self.output_positions) if pos not in self.bag_marginals]
+        bag_totals = {pos: defaultdict(int) for pos in live_positions}
+
+        for state, prob in frontier.items():
+            hand_totals[self.layout.describe_hand(state)] += prob
+            for pos in live_positions:
+                bag_totals[pos][self.layout.describe_bag(state, pos)] += prob
+
+        # 已移出的袋子使用单独累计的边缘分布
+        for pos, marginal in self.bag_marginals.items():
+            bag_totals[pos] = defaultdict(int)
+            for counts, prob in marginal.items():
+                bag_totals[pos][self.layout.describe_counts(counts, EMPTY_BAG)] += prob
+
+        to_probability = self._to_probability
+        bag_distributions_dict = {}
+        for pos, bag_id in enumerate(self.layout.bag_ids):
+            if pos not in bag_totals:
+                continue
+            filtered_dist = {k: to_probability(v) for k, v in bag_totals[pos].items() if v > 0}
+            if filtered_dist:
+                bag_distributions_dict[bag_id] = filtered_dist
+
+        hand_distribution = {hand: to_probability(total) for hand, total in hand_totals.items()}
+        results = {
+            "total_states": len(frontier),
+            "total_probability": sum(hand_distribution.values()),
+            "hand_distribution": hand_distribution,
+            "bag_distributions": bag_distributions_dict,
+            "calculation_method": "exact",
+            "engine": "compact",
+            # 剪枝丢弃的概率：每个概率都偏低，且偏差不超过该值
+            "error_bound": float(self.pruned_mass),
+            "pruned_states": self.pruned_states
+        }
+        if self.spiller is not None:
+            results["spilled_steps"] = self.spiller.spilled_steps
+            results["peak_spilled_states"] = self.spiller.peak_spilled_states
+        if self.prefix_cache is not None:
+            results["prefix_cache"] = dict(self.prefix_cache.stats(), reused_operations=self.prefix_reused)
+        if self.exact_arithmetic:
+            total = Fraction(sum(hand_totals.values()), self.denominator)
+            results["arithmetic"] = "exact"
+            results["total_probability"] = float(total)
+            results["exact_total_probability"] = str(total)
+            results["exact_error_bound"] = str(self.pruned_mass)
+            results["exact_hand_distribution"] = {
+                hand: str(Fraction(numerator, self.denominator)) for hand, numerator in hand_totals.items()
+            }
+        return results
+
+    def _to_probability(self, weight: Any) -> float:
+        """把浮点概率、公共分母上的分子或边缘分布中的Fraction转换为float概率（分数模式下正确舍入）"""
+        if isinstance(weight, Fraction):
+            return float(weight)
+        if self.exact_arithmetic:
+            return float(Fraction(weight, self.denominator))
+        return weight
+
+
+# 工作进程内的引擎，由ProcessPoolExecutor的initializer创建
+_WORKER_ENGINE: Optional[CompactExactEngine] = None
+
+
+def _init_worker(bags_config: Dict[Any, Dict[str, int]], exact_arithmetic: bool, kernel: str):
+    global _WORKER_ENGINE
+    _WORKER_ENGINE = CompactExactEngine(bags_config, exact_arithmetic=exact_arithmetic, kernel=kernel)
+
+
+def _expand_shard(shard: List[Tuple[Tuple[int, ...], Weight]], operation, partitions: int):
+    """工作进程：展开一个分片并局部合并，再按子状态哈希分区"""
+    new_frontier, step_denominator = _WORKER_ENGINE._expand_step(dict(shard), operation)
+    parts = [[] for _ in range(partitions)]
+    for item in new_frontier.items():
+        parts[hash(item[0]) % partitions].append(item)
+    return parts, step_denominator
+
+
+def _merge_partition(parts: List[List[Tuple[Tuple[int, ...], Weight]]]) -> Dict[Tuple[int, ...], Weight]:
+    """工作进程：合并所有分片发往同一分区的子状态"""
+    merged: Dict[Tuple[int, ...], Weight] = {}
+    get = merged.get
+    for part in parts:
+        for state, prob in part:
+            merged[state] = get(state, 0) + prob
+    return merged
@@ -2,32 +2,36 @@
 多袋摸球概率计算器核心模块
 提供精确计算和蒙特卡洛模拟两种方法
 """
-import math
 import random
-import itertools
-from typing import Dict, List, Tuple, Set, Optional, Any, Callable
+from typing import Dict, List, Tuple, Optional, Any, Callable
 from dataclasses import dataclass
+from statistics import NormalDist
 from collections import defaultdict, Counter
+from operator import itemgetter
+from .outcomes import OutcomeTable, OUTCOME_CACHE, KERNELS
+from .pruning import PruningPolicy
+from .sampler import CountSampler
 
 # numpy是可选的，只用于某些高级功能
-if numpy = input("你是否安装了numpy（安装了输入y，没安装输入n）"） == y
-    try:
-        import numpy as np
-        NUMPY_AVAILABLE = True
-    except ImportError:
-        NUMPY_AVAILABLE = False
-        # 创建一个简单的替代
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    # 创建一个简单的替代
     class np:
         @staticmethod
-         def random():
-        return random
-    elif numpy == n
-        NUMPY_AVAILABLE = False
-        # 创建一个简单的替代
-        class np:
-             @staticmethod
-             def random():
+        def random():
             return random
+
+# 精确计算可用的引擎
+EXACT_ENGINES = ("dict", "compact", "numpy")
+# 蒙特卡洛模拟可用的引擎
+SIMULATION_ENGINES = ("python", "numpy")
+
+# 颜色归并时，不关心的颜色合并成的类别名
+OTHER_COLOR = "其他"
+
 @dataclass
 class BallDrawOperation:
     """摸球操作定义"""
@@ -48,79 +52,94 @@ class BagState:
     def __init__(self, color_counts: Dict[str, int]):
         self.color_counts = color_counts.copy()
         self.total_balls = sum(color_counts.values())
+        self._key = None        # 组成键缓存，修改袋子时失效
+        self._intern_id = None  # (驻留表, ID) 缓存，修改袋子时失效
         
     def copy(self):
-        """创建副本"""
-        return BagState(self.color_counts)
+        """创建副本（未修改的副本沿用组成键和驻留ID缓存）"""
+        bag = BagState(self.color_counts)
+        bag._key = self._key
+        bag._intern_id = self._intern_id
+        return bag
+    
+    def composition_key(self) -> Tuple[Tuple[str, int], ...]:
+        """袋子完整组成的规范键：按颜色排序的(颜色, 数量)，忽略数量为0的颜色"""
+        if self._key is None:
+            key = tuple(sorted(self.color_counts.items()))
+            if 0 in self.color_counts.values():
+                key = tuple(item for item in key if item[1] > 0)
+            self._key = key
+        return self._key
+    
+    def _invalidate(self):
+        self._key = None
+        self._intern_id = None
     
     def has_enough_balls(self, count: int) -> bool:
         """检查是否有足够数量的球"""
         return self.total_balls >= count
     
-    def draw_balls(self, count: int) -> List[Tuple[List[str], float]]:
+    def draw_balls(self, count: int, kernel: str = "auto") -> List[Tuple[List[str], float]]:
         """
         从袋子中摸count个球的所有可能结果及概率
         
+        结果表按(袋子组成, 摸球数量, 内核)缓存在OUTCOME_CACHE中，
+        kernel见outcomes.KERNELS
+        
         返回: [(球的颜色列表, 概率), ...]
         """
         if count > self.total_balls:
             return [([], 1.0)]  # 无法摸球
-            
-        results = []
         
-        # 生成所有可能的颜色组合
-        colors = list(self.color_counts.keys())
+        colors = self.composition_colors()
+        table = self.outcome_table(count, kernel)
         
-        def generate_combinations(remaining_colors_idx, remaining_count, current_combination, current_counts):
-            if remaining_count == 0:
-                # 计算这种组合的概率
-                prob = 1.0
-                total_choose = self.total_balls
-                remaining_choose = count
-                
-                # 计算多项组合概率：∏ C(n_i, k_i) / C(N, K)
-                numerator = 1
-                for color_idx, take in enumerate(current_counts):
-                    if take > 0:
-                        color = colors[color_idx]
-                        numerator *= math.comb(self.color_counts[color], take)
-                
-                denominator = math.comb(self.total_balls, count)
-                prob = numerator / denominator if denominator > 0 else 0
-                
-                if prob > 0:
-                    # 生成球的颜色列表
-                    balls = []
-                    for color_idx, take in enumerate(current_counts):
-                        balls.extend([colors[color_idx]] * take)
-                    results.append((balls, prob))
-                return
-            
-            if remaining_colors_idx >= len(colors):
-                return
-                
-            color = colors[remaining_colors_idx]
-            max_take = min(self.color_counts[color], remaining_count)
-            
-            for take in range(max_take + 1):
-                new_counts = current_counts[:]
-                new_counts.append(take)
-                generate_combinations(
-                    remaining_colors_idx + 1, 
-                    remaining_count - take, 
-                    current_combination, 
-                    new_counts
-                )
-        
-        generate_combinations(0, count, [], [])
+        results = []
+        for taken, prob in zip(table.sparse, table.probabilities):
+            balls = []
+            for color_idx, take in taken:
+                balls.extend([colors[color_idx]] * take)
+            results.append((balls, prob))
         return results
     
+    def outcome_table(self, count: int, kernel: str = "auto") -> OutcomeTable:
+        """摸count个球的结果表，计数向量与composition_key()中的颜色顺序对齐"""
+        counts = tuple(count for _, count in self.composition_key())
+        return OUTCOME_CACHE.get(counts, count, kernel)
+    
     def remove_balls(self, colors: List[str]):
         """从袋子中移除指定颜色的球"""
         for color in colors:
             if color in self.color_counts and self.color_counts[color] > 0:
                 self.color_counts[color] -= 1
                 self.total_balls -= 1
+                self._invalidate()
+    
+    def remove_counts(self, counts: Dict[str, int]):
+        """按颜色批量移除球，counts为 {颜色: 数量}"""
+        color_counts = self.color_counts
+        removed = 0
+        for color, count in counts.items():
+            color_counts[color] -= count
+            removed += count
+        if removed:
+            self.total_balls -= removed
+            self._invalidate()
+    
+    def add_counts(self, counts: Dict[str, int]):
+        """按颜色批量加入球，counts为 {颜色: 数量}"""
+        color_counts = self.color_counts
+        added = 0
+        for color, count in counts.items():
+            color_counts[color] = color_counts.get(color, 0) + count
+            added += count
+        if added:
+            self.total_balls += added
+            self._invalidate()
+    
+    def composition_colors(self) -> List[str]:
+        """与outcome_table()计数向量对齐的颜色列表"""
+        return [color for color, _ in self.composition_key()]
     
     def add_ball(self, color: str):
         """向袋子中添加一个球"""
@@ -128,6 +147,7 @@ class BagState:
             self.color_counts[color] = 0
         self.color_counts[color] += 1
         self.total_balls += 1
+        self._invalidate()
     def __repr__(self):
         return f"BagState({self.color_counts})"
     
@@ -142,14 +162,166 @@ class BagState:
                 parts.append(f"{count}{color}")
         return "+".join(parts) if parts else "空袋"
 
+class BagCollection:
+    """
+    写时复制的袋子集合（精确计算的dict引擎使用）
+    
+    集合中的BagState视为不可变：子状态通过with_changed()只复制被操作的袋子，
+    其余袋子与父状态共享同一个对象（连同其组成键和驻留ID缓存），
+    每次展开的时间和内存只与被修改的袋子有关，而不是袋子总数。
+    """
+    __slots__ = ("_bags",)
+    
+    def __init__(self, bags: Dict[Any, BagState]):
+        self._bags = bags
+    
+    def resolve(self, bag_id) -> Optional[Any]:
+        """兼容字符串和整数类型的键，袋子不存在时返回None"""
+        if bag_id in self._bags:
+            return bag_id
+        if str(bag_id) in self._bags:
+            return str(bag_id)
+        return None
+    
+    def get(self, bag_id) -> Optional[BagState]:
+        key = self.resolve(bag_id)
+        return self._bags[key] if key is not None else None
+    
+    def with_changed(self, bag_id, change: Callable[[BagState], None]) -> "BagCollection":
+        """返回新集合：bag_id对应袋子的副本经change修改，其余袋子共享；袋子不存在时原样共享"""
+        key = self.resolve(bag_id)
+        if key is None:
+            return self
+        bag = self._bags[key].copy()
+        change(bag)
+        bags = dict(self._bags)
+        bags[key] = bag
+        return BagCollection(bags)
+    
+    def items(self):
+        return self._bags.items()
+    
+    def values(self):
+        return self._bags.values()
+    
+    def __getitem__(self, bag_id) -> BagState:
+        return self._bags[bag_id]
+    
+    def __iter__(self):
+        return iter(self._bags)
+    
+    def __len__(self):
+        return len(self._bags)
+    
+    def __repr__(self):
+        return f"BagCollection({self._bags})"
+
+class PathNode:
+    """
+    路径记录节点（仅trace模式使用）
+    
+    每个节点只保存一步操作和指向父节点的指针，子状态共享父路径前缀，
+    步骤描述只在to_list()时才格式化。
+    """
+    __slots__ = ("parent", "action", "bag_id", "balls")
+    
+    def __init__(self, parent: Optional["PathNode"], action: str, bag_id: Any, balls: Any):
+        self.parent = parent
+        self.action = action
+        self.bag_id = bag_id
+        self.balls = balls
+    
+    def to_list(self) -> List[str]:
+        """从根到当前节点的步骤描述列表"""
+        steps = []
+        node = self
+        while node is not None:
+            steps.append(f"{node.action}{node.bag_id}:{node.balls}")
+            node = node.parent
+        steps.reverse()
+        return steps
+    
+    def __repr__(self):
+        return f"PathNode({self.to_list()})"
+
+class BagInterner:
+    """
+    袋子状态驻留表（hash-consing）
+    
+    组成相同的袋子得到同一个整数ID，ID缓存在BagState上，
+    未被修改的袋子副本不需要重新计算组成键。
+    """
+    def __init__(self):
+        self._ids: Dict[Tuple[Tuple[str, int], ...], int] = {}
+        # 按插入顺序的(颜色, 数量)元组 -> ID，命中时无需排序出规范键
+        self._aliases: Dict[Tuple[Tuple[str, int], ...], int] = {}
+    
+    def intern(self, bag: BagState) -> int:
+        """返回袋子组成对应的ID"""
+        cached = bag._intern_id
+        if cached is not None and cached[0] is self:
+            return cached[1]
+        raw_key = tuple(bag.color_counts.items())
+        bag_state_id = self._aliases.get(raw_key)
+        if bag_state_id is None:
+            key = bag.composition_key()
+            bag_state_id = self._ids.get(key)
+            if bag_state_id is None:
+                bag_state_id = len(self._ids)
+                self._ids[key] = bag_state_id
+            self._aliases[raw_key] = bag_state_id
+        bag._intern_id = (self, bag_state_id)
+        return bag_state_id
+    
+    def __len__(self):
+        return len(self._ids)
+
+def lump_colors(bags_config: Dict[Any, Dict[str, int]], focus_colors: List[str],
+                other_label: str = OTHER_COLOR) -> Dict[Any, Dict[str, int]]:
+    """
+    颜色归并：把不在focus_colors中的颜色合并为一个"其他"类别
+    
+    同一袋子中的球在摸、丢、放回时都是可交换的，合并后各关心颜色
+    （以及"其他"类别）的计数分布与原问题完全相同。
+    
+    返回: 新的袋子配置，原配置不会被修改
+    """
+    focus = set(focus_colors)
+    if other_label in focus:
+        raise ValueError(f"归并类别名 '{other_label}' 与关心的颜色冲突")
+    
+    lumped_config = {}
+    for bag_id, color_counts in bags_config.items():
+        lumped = {}
+        for color, count in color_counts.items():
+            key = color if color in focus else other_label
+            lumped[key] = lumped.get(key, 0) + count
+        lumped_config[bag_id] = {color: count for color, count in lumped.items() if count > 0}
+    return lumped_config
+
 class ProbabilityCalculator:
     """概率计算器主类"""
     
     def __init__(self):
         self.states_cache = {}  # 状态缓存，避免重复计算
+        self.bag_interner = BagInterner()  # 合并状态时使用的袋子驻留表
     def calculate_exact(self, bags_config: Dict[int, Dict[str, int]], 
                        operations: List[BallDrawOperation],
-                       progress_callback: Optional[Callable[[int, int, str], None]] = None) -> Dict[str, Any]:
+                       progress_callback: Optional[Callable[[int, int, str], None]] = None,
+                       engine: str = "dict",
+                       trace: bool = False,
+                       exact_arithmetic: bool = False,
+                       output_bags: Optional[List[Any]] = None,
+                       focus_colors: Optional[List[str]] = None,
+                       workers: int = 1,
+                       pruning: Optional[PruningPolicy] = None,
+                       memory_budget: Optional[int] = None,
+                       spill_dir: Optional[str] = None,
+                       checkpoint_dir: Optional[str] = None,
+                       resume: bool = False,
+                       prefix_cache: Optional[Any] = None,
+                       decompose: bool = True,
+                       kernel: str = "auto") -> Dict[str, Any]:
         """
         精确计算（状态空间遍历）
         
@@ -157,30 +329,116 @@ class ProbabilityCalculator:
             bags_config: 袋子配置 {袋子ID: {颜色: 数量}}
             operations: 操作序列
             progress_callback: 进度回调函数，接收(current, total, message)参数
+            engine: 计算引擎，"dict"为字典状态引擎，"compact"为定长整数元组状态引擎，
+                "numpy"为NumPy数组前沿引擎（未安装numpy时退回compact引擎）
+            trace: 调试用，记录每个最终状态的操作路径（仅dict引擎），关闭时不产生任何开销
+            exact_arithmetic: 精确分数模式（仅compact引擎），概率以公共分母上的整数分子累加，
+                结果额外包含分数形式的 exact_hand_distribution
+            output_bags: 需要输出最终状态分布的袋子ID列表，默认全部袋子。compact引擎会把
+                最后一次使用之后的袋子移出状态空间，需要输出的袋子单独累计边缘分布
+            focus_colors: 只关心的颜色列表，其余颜色在计算前归并为"其他"类别，
+                关心颜色的结果仍然精确
+            workers: 并行展开前沿的工作进程数（仅compact引擎），默认1为串行
+            pruning: 剪枝策略，默认前沿超过100000个状态时保留概率最高的50000个。
+                剪枝不重新归一化，丢弃的概率质量作为误差上界记入结果的 error_bound
+            memory_budget: 前沿的内存预算（字节，仅compact引擎），超出时按哈希分区溢出到磁盘上的
+                内存映射文件逐个分区计算，结果仍然精确；此模式下默认不剪枝
+            spill_dir: 溢出文件所在的目录，默认使用系统临时目录
+            checkpoint_dir: 检查点目录（仅compact引擎），每个操作完成后把前沿写入以问题哈希
+                命名的检查点文件，计算完成后删除
+            resume: 存在相同问题的检查点时从中继续计算
+            prefix_cache: 前缀缓存PrefixCache（仅compact引擎），每个操作完成后缓存前沿，
+                只修改了后面几个操作的问题从最长的已缓存前缀继续计算
+            decompose: compact引擎按独立分量分别展开前沿，最后卷积各分量的手牌分布，
+                放回操作连接的分量在放回时才合并（内存预算、检查点和前缀缓存模式下不分解）
+            kernel: 超几何概率的计算内核（dict和compact引擎）："exact"用大整数精确计算，
+                "log"查log阶乘表在对数空间计算，"auto"对500个球以上的袋子用"log"
             
         返回:
             结果字典
         """
+        if focus_colors:
+            results = self.calculate_exact(lump_colors(bags_config, focus_colors), operations,
+                                           progress_callback=progress_callback, engine=engine, trace=trace,
+                                           exact_arithmetic=exact_arithmetic, output_bags=output_bags,
+                                           workers=workers, pruning=pruning, memory_budget=memory_budget,
+                                           spill_dir=spill_dir, checkpoint_dir=checkpoint_dir, resume=resume,
+                                           prefix_cache=prefix_cache, decompose=decompose, kernel=kernel)
+            results["focus_colors"] = list(focus_colors)
+            return results
+        
+        if engine not in EXACT_ENGINES:
+            raise ValueError(f"未知的精确计算引擎: {engine}，可用引擎: {EXACT_ENGINES}")
+        if kernel not in KERNELS:
+            raise ValueError(f"未知的概率计算内核: {kernel}，可用内核: {KERNELS}")
+        if memory_budget is not None and engine != "compact":
+            raise ValueError("内存预算模式仅支持compact引擎")
+        if checkpoint_dir is not None and engine != "compact":
+            raise ValueError("检查点仅支持compact引擎")
+        if prefix_cache is not None and engine != "compact":
+            raise ValueError("前缀缓存仅支持compact引擎")
+        if engine == "numpy" and not NUMPY_AVAILABLE:
+            print("⚠️  未安装numpy，改用compact引擎")
+            engine = "compact"
+        if engine == "numpy":
+            if trace or exact_arithmetic or workers != 1:
+                raise ValueError("numpy引擎不支持路径追踪、精确分数模式和并行展开")
+            from .numpy_engine import NumpyExactEngine
+            numpy_engine = NumpyExactEngine(bags_config, output_bags=output_bags, pruning=pruning)
+            frontier = numpy_engine.run(operations, progress_callback)
+            return numpy_engine.aggregate(frontier)
+        if engine == "compact":
+            if trace:
+                raise ValueError("路径追踪仅支持dict引擎")
+            if decompose and memory_budget is None and checkpoint_dir is None and prefix_cache is None:
+                from .decompose import DecomposedExactEngine
+                decomposed_engine = DecomposedExactEngine(bags_config, exact_arithmetic=exact_arithmetic,
+                                                          output_bags=output_bags, workers=workers,
+                                                          pruning=pruning, kernel=kernel)
+                frontier = decomposed_engine.run(operations, progress_callback)
+                return decomposed_engine.aggregate(frontier)
+            from .compact import CompactExactEngine
+            compact_engine = CompactExactEngine(bags_config, exact_arithmetic=exact_arithmetic,
+                                                output_bags=output_bags, workers=workers, pruning=pruning,
+                                                memory_budget=memory_budget, spill_dir=spill_dir,
+                                                checkpoint_dir=checkpoint_dir, resume=resume,
+                                                prefix_cache=prefix_cache, kernel=kernel)
+            try:
+                frontier = compact_engine.run(operations, progress_callback)
+                return compact_engine.aggregate(frontier)
+            finally:
+                compact_engine.close()
+        
+        if exact_arithmetic:
+            raise ValueError("精确分数模式仅支持compact引擎")
+        if workers != 1:
+            raise ValueError("并行展开仅支持compact引擎")
+        if pruning is None:
+            pruning = PruningPolicy()
+        
         if progress_callback:
             progress_callback(0, len(operations), "开始精确计算...")
         else:
             print("开始精确计算...")
         
         # 初始化袋子状态
-        bags = {bag_id: BagState(color_counts) for bag_id, color_counts in bags_config.items()}
+        bags = BagCollection({bag_id: BagState(color_counts) for bag_id, color_counts in bags_config.items()})
+        self.bag_interner = BagInterner()
         
         # 初始状态：空手，概率1.0
         initial_state = {
             "hand": Counter(),  # 手中的球 Counter对象
             "bags": bags,      # 袋子状态字典
             "prob": 1.0,       # 当前状态概率
-            "path": []         # 路径记录（用于调试）
+            "path": None       # 路径记录（仅trace模式，PathNode链表）
         }
         
         # 状态列表，每个元素是(hand_counter, bags_dict, probability)
         states = [initial_state]
         
         total_states_processed = 0
+        pruned_mass = 0.0
+        pruned_states = 0
         
         for op_idx, operation in enumerate(operations):
             if progress_callback:
@@ -190,34 +448,32 @@ class ProbabilityCalculator:
             new_states = []
             
             for state in states:
-                bags = {bag_id: bag.copy() for bag_id, bag in state["bags"].items()}
-                hand_counter = Counter(state["hand"])
+                # 袋子集合写时复制：子状态只复制被操作的袋子
+                bags = state["bags"]
+                hand_counter = state["hand"]
                 current_prob = state["prob"]
                 if operation.operation_type == "draw":
                     # 摸球操作
                     bag_id = operation.bag_id
                     # 兼容字符串和整数类型的键
-                    bag = bags.get(bag_id) or bags.get(str(bag_id))
+                    bag = bags.get(bag_id)
                     if not bag:
                         raise KeyError(f"袋子ID {bag_id} 不存在于配置中")
                     
-                    possible_draws = bag.draw_balls(operation.draw_count)
+                    table = bag.outcome_table(operation.draw_count, kernel)
+                    colors = bag.composition_colors()
                     
-                    for balls_drawn, draw_prob in possible_draws:
+                    for taken, draw_prob in zip(table.sparse, table.probabilities):
                         if draw_prob <= 0:
                             continue
-                            
-                        new_bags = {bag_id: bag.copy() for bag_id, bag in bags.items()}
-                        new_hand = Counter(hand_counter)
+                        balls_drawn = {colors[color_idx]: take for color_idx, take in taken}
                         
-                        # 从袋子中移除摸到的球（兼容字符串/整数键）
-                        target_bag = new_bags.get(bag_id) or new_bags.get(str(bag_id))
-                        if target_bag:
-                            target_bag.remove_balls(balls_drawn)
+                        # 从袋子中批量移除摸到的球（只复制这一个袋子）
+                        new_bags = bags.with_changed(bag_id, lambda target: target.remove_counts(balls_drawn))
+                        new_hand = Counter(hand_counter)
                         
-                        # 将球加入手中
-                        for ball in balls_drawn:
-                            new_hand[ball] += 1
+                        # 将球批量加入手中
+                        new_hand.update(balls_drawn)
                         
                         new_prob = current_prob * draw_prob
                         
@@ -225,37 +481,35 @@ class ProbabilityCalculator:
                             "hand": new_hand,
                             "bags": new_bags,
                             "prob": new_prob,
-                            "path": state["path"] + [f"draw{bag_id}:{balls_drawn}"]
+                            "path": PathNode(state["path"], "draw", bag_id, balls_drawn) if trace else None
                         })
                         
                 elif operation.operation_type == "discard":
                     # 丢球操作（从袋子中丢）
                     bag_id = operation.bag_id
                     # 兼容字符串和整数类型的键
-                    bag = bags.get(bag_id) or bags.get(str(bag_id))
+                    bag = bags.get(bag_id)
                     if not bag:
                         raise KeyError(f"袋子ID {bag_id} 不存在于配置中")
                     
-                    possible_discards = bag.draw_balls(operation.draw_count)
+                    table = bag.outcome_table(operation.draw_count, kernel)
+                    colors = bag.composition_colors()
                     
-                    for balls_discarded, discard_prob in possible_discards:
+                    for taken, discard_prob in zip(table.sparse, table.probabilities):
                         if discard_prob <= 0:
                             continue
-                            
-                        new_bags = {bag_id: bag.copy() for bag_id, bag in bags.items()}
+                        balls_discarded = {colors[color_idx]: take for color_idx, take in taken}
                         
-                        # 从袋子中移除丢弃的球（兼容字符串/整数键）
-                        target_bag = new_bags.get(bag_id) or new_bags.get(str(bag_id))
-                        if target_bag:
-                            target_bag.remove_balls(balls_discarded)
+                        # 从袋子中批量移除丢弃的球（只复制这一个袋子）
+                        new_bags = bags.with_changed(bag_id, lambda target: target.remove_counts(balls_discarded))
                         
                         new_prob = current_prob * discard_prob
                         
                         new_states.append({
-                            "hand": Counter(hand_counter),  # 手不变
+                            "hand": hand_counter,  # 手不变，与父状态共享
                             "bags": new_bags,
                             "prob": new_prob,
-                            "path": state["path"] + [f"discard{bag_id}:{balls_discarded}"]
+                            "path": PathNode(state["path"], "discard", bag_id, balls_discarded) if trace else None
                         })
                 elif operation.operation_type == "return":
                     # 放回操作（从手中放回到袋子）
@@ -278,12 +532,8 @@ class ProbabilityCalculator:
                         if new_hand[color_to_return] == 0:
                             del new_hand[color_to_return]
                         
-                        new_bags = {bag_id: bag.copy() for bag_id, bag in bags.items()}
-                        
-                        # 放回球到袋子（兼容字符串/整数键）
-                        target_bag = new_bags.get(bag_id) or new_bags.get(str(bag_id))
-                        if target_bag:
-                            target_bag.add_ball(color_to_return)
+                        # 放回球到袋子（只复制这一个袋子，袋子不存在时球不进入任何袋子）
+                        new_bags = bags.with_changed(bag_id, lambda target: target.add_ball(color_to_return))
                         
                         new_prob = current_prob * return_prob
                         
@@ -291,7 +541,7 @@ class ProbabilityCalculator:
                             "hand": new_hand,
                             "bags": new_bags,
                             "prob": new_prob,
-                            "path": state["path"] + [f"return{bag_id}:{color_to_return}"]
+                            "path": PathNode(state["path"], "return", bag_id, color_to_return) if trace else None
                         })
             
             # 合并相同手状态（优化状态空间）
@@ -302,11 +552,13 @@ class ProbabilityCalculator:
             if not progress_callback:
                 print(f"    生成状态: {len(states)}个, 累计状态: {total_states_processed}")
             
-            # 防止状态爆炸，进行剪枝
-            if len(states) > 100000:
-                if not progress_callback:
+            # 防止状态爆炸，按策略剪枝（不重新归一化）
+            if pruning.triggers(len(states)):
+                if pruning.exceeds(len(states)) and not progress_callback:
                     print(f"⚠️  状态过多 ({len(states)})，进行剪枝...")
-                states = self._prune_states(states, max_states=50000)
+                states, dropped_mass, dropped_count = self._prune_states(states, pruning)
+                pruned_mass += dropped_mass
+                pruned_states += dropped_count
         
         if progress_callback:
             progress_callback(len(operations), len(operations), "计算完成")
@@ -314,49 +566,107 @@ class ProbabilityCalculator:
             print(f"计算完成，最终状态数: {len(states)}")
         
         # 汇总结果
-        return self._aggregate_results(states)
+        results = self._aggregate_results(states)
+        # 剪枝丢弃的概率：每个概率都偏低，且偏差不超过该值
+        results["error_bound"] = pruned_mass
+        results["pruned_states"] = pruned_states
+        if output_bags is not None:
+            wanted = {str(bag_id) for bag_id in output_bags}
+            results["bag_distributions"] = {
+                bag_id: distribution for bag_id, distribution in results["bag_distributions"].items()
+                if str(bag_id) in wanted
+            }
+        if trace:
+            results["paths"] = [
+                {
+                    "hand": self._describe_hand(state["hand"]),
+                    "prob": state["prob"],
+                    "path": state["path"].to_list() if state["path"] else []
+                }
+                for state in sorted(states, key=lambda x: x["prob"], reverse=True)
+            ]
+        return results
+    
+    def calculate_auto(self, bags_config: Dict[int, Dict[str, int]],
+                       operations: List[BallDrawOperation],
+                       time_budget: Optional[float] = None,
+                       memory_budget: Optional[int] = None,
+                       progress_callback: Optional[Callable[[int, int, str], None]] = None,
+                       simulation_progress_callback: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+        """
+        按预估的状态空间规模自动选择精确计算、剪枝精确计算或蒙特卡洛模拟
+        
+        参数:
+            bags_config: 袋子配置
+            operations: 操作序列
+            time_budget: 时间预算（秒），默认60秒
+            memory_budget: 内存预算（字节），默认1GB
+            progress_callback: 精确计算的进度回调函数
+            simulation_progress_callback: 蒙特卡洛模拟的进度回调函数
+            
+        返回:
+            所选方法的结果字典，auto_choice 中记录选择的方法、原因和预估规模
+        """
+        from .estimator import choose_method
+        choice = choose_method(bags_config, operations, time_budget=time_budget, memory_budget=memory_budget)
+        print(f"🤖 自动选择: {choice.reason}")
+        
+        if choice.method == "monte_carlo":
+            results = self.monte_carlo_simulation(bags_config, operations, choice.num_simulations,
+                                                  progress_callback=simulation_progress_callback)
+        else:
+            pruning = choice.pruning if choice.method == "pruned" else PruningPolicy.disabled()
+            results = self.calculate_exact(bags_config, operations, progress_callback=progress_callback,
+                                           engine="compact", pruning=pruning)
+        results["auto_choice"] = choice.to_dict()
+        return results
+    
+    def outcome_cache_stats(self) -> Dict[str, Any]:
+        """摸球结果表缓存的命中/未命中/淘汰统计"""
+        return OUTCOME_CACHE.stats()
     
     def _merge_states(self, states: List[Dict]) -> List[Dict]:
-        """合并相同手状态的状态"""
+        """合并手状态和所有袋子完整组成都相同的状态"""
         merged_dict = {}
+        interner = self.bag_interner
+        intern = interner.intern
         
         for state in states:
-            # 以手状态和袋子状态的字符串表示为键
             hand_key = tuple(sorted(state["hand"].items()))
             
-            # 袋子状态键（简化，只考虑球总数）
-            bag_summaries = []
-            for bag_id, bag in sorted(state["bags"].items()):
-                bag_summaries.append((bag_id, sum(bag.color_counts.values())))
-            bag_key = tuple(bag_summaries)
+            # 袋子状态键：每个袋子完整组成的驻留ID（袋子顺序在所有状态中一致），
+            # 未修改的袋子直接读取缓存的ID
+            bag_key = tuple([
+                cached[1] if (cached := bag._intern_id) is not None and cached[0] is interner else intern(bag)
+                for bag in state["bags"].values()
+            ])
             
             full_key = (hand_key, bag_key)
             
-            if full_key in merged_dict:
+            merged = merged_dict.get(full_key)
+            if merged is not None:
                 # 合并概率
-                merged_dict[full_key]["prob"] += state["prob"]
+                merged["prob"] += state["prob"]
             else:
                 merged_dict[full_key] = state.copy()
         
         return list(merged_dict.values())
     
-    def _prune_states(self, states: List[Dict], max_states: int = 50000) -> List[Dict]:
-        """剪枝：保留概率最高的状态"""
-        if len(states) <= max_states:
-            return states
-            
-        # 按概率排序，保留概率最高的状态
-        sorted_states = sorted(states, key=lambda x: x["prob"], reverse=True)
-        pruned_states = sorted_states[:max_states]
-        
-        # 重新归一化概率
-        total_prob = sum(s["prob"] for s in pruned_states)
-        if total_prob > 0:
-            for state in pruned_states:
-                state["prob"] /= total_prob
-        
-        print(f"  剪枝后保留 {len(pruned_states)} 个状态 (原 {len(states)} 个)")
-        return pruned_states
+    def _prune_states(self, states: List[Dict], pruning: PruningPolicy) -> Tuple[List[Dict], float, int]:
+        """剪枝：按策略丢弃状态，返回(保留的状态, 丢弃的概率质量, 丢弃的状态数)"""
+        pruned_states, dropped_mass, dropped_count = pruning.select(states, itemgetter("prob"))
+        if dropped_count:
+            print(f"  剪枝后保留 {len(pruned_states)} 个状态 (原 {len(states)} 个)，丢弃概率 {dropped_mass:.3e}")
+        return pruned_states, dropped_mass, dropped_count
+    
+    def _describe_hand(self, hand: Counter) -> str:
+        """手状态的字符串表示，如 "2R+1Y" """
+        hand_desc_parts = []
+        for color, count in sorted(hand.items()):
+            if count > 0:
+                hand_desc_parts.append(f"{count}{color}")
+        return "+".join(hand_desc_parts) if hand_desc_parts else "空手"
+    
     def _aggregate_results(self, states: List[Dict]) -> Dict[str, Any]:
         """汇总计算结果"""
         hand_distribution = defaultdict(float)
@@ -364,12 +674,7 @@ class ProbabilityCalculator:
         
         for state in states:
             # 将手状态转换为字符串表示
-            hand_desc_parts = []
-            for color, count in sorted(state["hand"].items()):
-                if count > 0:
-                    hand_desc_parts.append(f"{count}{color}")
-            
-            hand_desc = "+".join(hand_desc_parts) if hand_desc_parts else "空手"
+            hand_desc = self._describe_hand(state["hand"])
             hand_distribution[hand_desc] += state["prob"]
             
             # 记录每个袋子的状态
@@ -401,7 +706,18 @@ class ProbabilityCalculator:
     def monte_carlo_simulation(self, bags_config: Dict[int, Dict[str, int]], 
                               operations: List[BallDrawOperation], 
                               num_simulations: int = 100000,
-                              progress_callback: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+                              progress_callback: Optional[Callable[[int, int], None]] = None,
+                              focus_colors: Optional[List[str]] = None,
+                              rng: Optional[Any] = None,
+                              engine: str = "python",
+                              batch_size: Optional[int] = None,
+                              workers: int = 1,
+                              seed: Optional[int] = None,
+                              target_half_width: Optional[float] = None,
+                              confidence: float = 0.95,
+                              target_hands: Optional[List[str]] = None,
+                              probability_floor: float = 0.01,
+                              rao_blackwell: bool = False) -> Dict[str, Any]:
         """
         蒙特卡洛模拟
         
@@ -410,185 +726,106 @@ class ProbabilityCalculator:
             operations: 操作序列
             num_simulations: 模拟次数
             progress_callback: 进度回调函数，接收(current, total)参数
+            focus_colors: 只关心的颜色列表，其余颜色在模拟前归并为"其他"类别
+            rng: 随机数生成器，默认使用全局random模块（numpy引擎为numpy.random.Generator，
+                传入random.Random时由它派生一个Generator）
+            engine: "python"逐次模拟，"numpy"按块向量化模拟（未安装numpy时退回python引擎）
+            batch_size: numpy引擎每块同时进行的模拟数
+            workers: 并行模拟的工作进程数，模拟次数平均分给各进程，默认1为串行
+            seed: 随机种子，各工作进程的随机流由它派生；相同的种子和进程数得到逐位相同的结果
+            target_half_width: 精度目标模式：按块模拟，直到关心的手牌结果的置信区间半宽
+                都不超过该值，此时num_simulations为模拟次数上限
+            confidence: 置信区间的置信水平，结果的confidence_intervals中为每种手牌结果的Wilson区间
+            target_hands: 精度目标模式下关心的手牌结果，默认为估计概率不低于probability_floor的所有结果
+            probability_floor: 见target_hands
+            rao_blackwell: 只模拟到最后一次放回为止的前缀，之后只有摸球/丢球的后缀精确计算，
+                每次模拟按后缀的精确分布贡献小数权重（不支持精度目标模式）
             
         返回:
             结果字典
         """
+        if focus_colors:
+            results = self.monte_carlo_simulation(lump_colors(bags_config, focus_colors), operations,
+                                                  num_simulations, progress_callback=progress_callback, rng=rng,
+                                                  engine=engine, batch_size=batch_size, workers=workers, seed=seed,
+                                                  target_half_width=target_half_width, confidence=confidence,
+                                                  target_hands=target_hands, probability_floor=probability_floor,
+                                                  rao_blackwell=rao_blackwell)
+            results["focus_colors"] = list(focus_colors)
+            return results
+        
+        if engine not in SIMULATION_ENGINES:
+            raise ValueError(f"未知的模拟引擎: {engine}，可用引擎: {SIMULATION_ENGINES}")
+        if workers < 1:
+            raise ValueError(f"工作进程数必须为正数: {workers}")
+        if rng is not None and (workers > 1 or seed is not None):
+            raise ValueError("指定随机数生成器时不能同时指定种子或并行模拟")
+        if not 0 < confidence < 1:
+            raise ValueError(f"置信水平必须在0和1之间: {confidence}")
+        if rao_blackwell and target_half_width is not None:
+            raise ValueError("Rao-Blackwell化估计不支持精度目标模式")
+        if engine == "numpy" and not NUMPY_AVAILABLE:
+            print("⚠️  未安装numpy，改用python模拟引擎")
+            engine = "python"
+        
         if progress_callback:
             progress_callback(0, num_simulations)
         else:
             print(f"开始蒙特卡洛模拟，次数: {num_simulations:,}")
         
-        results = defaultdict(int)
-        
-        # 进度显示
-        progress_step = max(1, num_simulations // 20)
-        
-        for sim in range(num_simulations):
-            # 进度显示
-            if progress_callback:
-                if sim % progress_step == 0:
-                    progress_callback(sim, num_simulations)
-            else:
-                if sim % progress_step == 0:
-                    progress = (sim / num_simulations) * 100
-                    print(f"  进度: {progress:.1f}%", end='\r')
-            
-            # 初始化模拟
-            bags = {bag_id: BagState(color_counts) for bag_id, color_counts in bags_config.items()}
-            hand_counter = Counter()
-            # 执行所有操作
-            for operation in operations:
-                bag_id = operation.bag_id
-                
-                if operation.operation_type == "draw":
-                    # 摸球
-                    # 兼容字符串和整数类型的键
-                    bag = bags.get(bag_id) or bags.get(str(bag_id)) if bag_id is not None else None
-                    if not bag:
-                        continue  # 如果找不到袋子，跳过这个操作
-                    
-                    # 从袋子中所有球中随机摸
-                    all_balls = []
-                    for color, count in bag.color_counts.items():
-                        all_balls.extend([color] * count)
-                    
-                    if len(all_balls) < operation.draw_count:
-                        # 球不够，跳过
-                        continue
-                    
-                    # 随机摸球
-                    drawn_balls = random.sample(all_balls, operation.draw_count)
-                    
-                    # 从袋子中移除
-                    for ball in drawn_balls:
-                        bag.color_counts[ball] -= 1
-                        bag.total_balls -= 1
-                        if bag.color_counts[ball] == 0:
-                            del bag.color_counts[ball]
-                    
-                    # 加入手中
-                    for ball in drawn_balls:
-                        hand_counter[ball] += 1
-                        
-                elif operation.operation_type == "discard":
-                    # 丢球
-                    # 兼容字符串和整数类型的键
-                    bag = bags.get(bag_id) or bags.get(str(bag_id)) if bag_id is not None else None
-                    if not bag:
-                        continue  # 如果找不到袋子，跳过这个操作
-                    
-                    all_balls = []
-                    for color, count in bag.color_counts.items():
-                        all_balls.extend([color] * count)
-                    
-                    if len(all_balls) < operation.draw_count:
-                        # 球不够，跳过
-                        continue
-                    
-                    # 随机丢球
-                    discarded_balls = random.sample(all_balls, operation.draw_count)
-                    
-                    # 从袋子中移除
-                    for ball in discarded_balls:
-                        bag.color_counts[ball] -= 1
-                        bag.total_balls -= 1
-                        if bag.color_counts[ball] == 0:
-                            del bag.color_counts[ball]
-                            
-                elif operation.operation_type == "return":
-                    # 放回球
-                    if not hand_counter:
-                        continue
-                    
-                    # 从手中随机选择一个球
-                    hand_balls = []
-                    for color, count in hand_counter.items():
-                        hand_balls.extend([color] * count)
-                    if not hand_balls:
-                        continue
-                    
-                    ball_to_return = random.choice(hand_balls)
-                    
-                    # 从手中移除
-                    hand_counter[ball_to_return] -= 1
-                    if hand_counter[ball_to_return] == 0:
-                        del hand_counter[ball_to_return]
-                    
-                    # 放回袋子（兼容字符串和整数类型的键）
-                    if bag_id is not None:
-                        target_bag = bags.get(bag_id) or bags.get(str(bag_id))
-                        if target_bag:
-                            target_bag.add_ball(ball_to_return)
-            # 记录结果
-            hand_desc_parts = []
-            for color, count in sorted(hand_counter.items()):
-                if count > 0:
-                    hand_desc_parts.append(f"{count}{color}")
-            
-            hand_desc = "+".join(hand_desc_parts) if hand_desc_parts else "空手"
-            
-            # 记录手状态
-            if hand_desc not in results:
-                results[hand_desc] = {"count": 0, "bag_states": {}}
-            results[hand_desc]["count"] += 1
-            
-            # 记录袋子状态（为每种手状态记录袋子状态分布）
-            bag_state_key = tuple()
-            for bag_id, bag in sorted(bags.items()):
-                bag_state_str = bag.to_string()
-                bag_state_key += (f"{bag_id}:{bag_state_str}",)
-            
-            # 如果这是新的手-袋子组合，初始化袋子状态计数
-            if bag_state_key not in results[hand_desc]["bag_states"]:
-                results[hand_desc]["bag_states"][bag_state_key] = 0
-            results[hand_desc]["bag_states"][bag_state_key] += 1
-        
-        if progress_callback:
-            progress_callback(num_simulations, num_simulations)
+        if engine == "numpy":
+            from .numpy_sampler import NumpyBatchSampler, DEFAULT_BATCH_SIZE
+            sampler_class, sampler_options = NumpyBatchSampler, {"batch_size": batch_size or DEFAULT_BATCH_SIZE}
+            if rng is not None and not isinstance(rng, np.random.Generator):
+                rng = np.random.default_rng(rng.getrandbits(64))
         else:
-            print(f"\n模拟完成，生成 {len(results)} 种不同结果")
-        
-        # 转换为概率并计算袋子分布
-        total_simulations = sum(data["count"] for data in results.values())
-        hand_distribution = {}
-        bag_distributions = {}
-        
-        for hand_desc, data in results.items():
-            hand_prob = data["count"] / total_simulations
-            hand_distribution[hand_desc] = hand_prob
-            
-            # 为这个手状态计算袋子状态分布
-            for bag_state_key, count in data["bag_states"].items():
-                for bag_state_part in bag_state_key:
-                    bag_id, bag_state_str = bag_state_part.split(":", 1)
-                    bag_id = int(bag_id)
-                    
-                    if bag_id not in bag_distributions:
-                        bag_distributions[bag_id] = {}
-                    
-                    if bag_state_str not in bag_distributions[bag_id]:
-                        bag_distributions[bag_id][bag_state_str] = 0
-                    
-                    # 计算这个袋子状态的概率贡献
-                    contribution = (count / data["count"]) * hand_prob
-                    bag_distributions[bag_id][bag_state_str] += contribution
-        
-        # 清理并格式化袋子分布
-        bag_distributions_dict = {}
-        for bag_id, distribution in bag_distributions.items():
-            filtered_dist = {k: v for k, v in distribution.items() if v > 0}
-            if filtered_dist:
-                bag_distributions_dict[bag_id] = filtered_dist
-        
-        return {
-            "total_states": len(hand_distribution),
-            "total_probability": sum(hand_distribution.values()),
-            "hand_distribution": hand_distribution,
-            "bag_distributions": bag_distributions_dict,
-            "simulations": num_simulations,
-            "calculation_method": "monte_carlo"
-        }
+            # 在颜色计数上采样，不再把袋子展开成球的列表
+            sampler_class, sampler_options = CountSampler, {}
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        converged = None
+        if rao_blackwell:
+            # 前缀随机模拟、后缀精确计算，每次模拟贡献小数权重
+            from .rao_blackwell import RaoBlackwellSampler
+            sampler = RaoBlackwellSampler(bags_config, operations, prefix_sampler=sampler_class, **sampler_options)
+            prefix_tally, tally = sampler.run(num_simulations, rng=rng, workers=workers, seed=seed,
+                                              progress_callback=progress_callback)
+            intervals = sampler.hand_intervals(prefix_tally, num_simulations, z)
+        elif target_half_width is not None:
+            sampler = sampler_class(bags_config, operations, **sampler_options)
+            tally, converged = sampler.run_adaptive(target_half_width, confidence=confidence, hands=target_hands,
+                                                    probability_floor=probability_floor,
+                                                    max_simulations=num_simulations, rng=rng, workers=workers,
+                                                    seed=seed, progress_callback=progress_callback)
+            num_simulations = sum(tally.values())
+        elif workers > 1 or seed is not None:
+            sampler = sampler_class(bags_config, operations, **sampler_options)
+            tally = sampler.run_parallel(num_simulations, workers=workers, seed=seed,
+                                         progress_callback=progress_callback)
+        else:
+            sampler = sampler_class(bags_config, operations, **sampler_options)
+            tally = sampler.run(num_simulations, rng=rng, progress_callback=progress_callback)
+        
+        if not progress_callback:
+            print(f"\n模拟完成，生成 {len(tally)} 种不同结果")
+        
+        results = sampler.aggregate(tally, num_simulations)
+        results["engine"] = engine
+        if workers > 1 or seed is not None:
+            results["workers"] = workers
+            results["seed"] = seed
+        results["confidence"] = confidence
+        results["confidence_intervals"] = intervals if rao_blackwell else sampler.hand_intervals(tally, num_simulations, z)
+        if rao_blackwell:
+            results["rao_blackwell"] = {
+                "sampled_operations": sampler.split,
+                "exact_operations": len(operations) - sampler.split,
+            }
+        if target_half_width is not None:
+            results["target_half_width"] = target_half_width
+            results["converged"] = converged
+            if not converged:
+                print(f"⚠️  达到模拟次数上限 {num_simulations:,}，部分结果的置信区间仍宽于目标")
+        return results
     
     def validate_configuration(self, bags_config: Dict[int, Dict[str, int]], 
                               operations: List[BallDrawOperation]) -> List[str]:
@@ -0,0 +1,210 @@
+"""
+独立袋子分解
+
+没有放回操作时，每个袋子对最终手牌的贡献相互独立，联合前沿只是
+各袋子前沿的笛卡尔积。这里把袋子分成若干个分量，每个分量单独维护
+自己的前沿（状态元组中只有本分量的袋子和本分量摸到手中的球），
+最后把各分量的手牌分布做稀疏卷积，状态数从各分量之积变为之和。
+
+放回操作会把手中的一个球放回目标袋子，被放回的是哪个球取决于整只手，
+因此放回前手中已有球的分量和目标袋子所在的分量在放回时合并为一个分量
+（两个前沿逐对相加），之后一起展开。合并只在真正需要时发生。
+
+各分量占用状态元组中互不相交的袋子区间，手的部分相加就是合并后的手，
+所以合并和卷积都是状态元组逐元素相加、概率相乘。
+"""
+from collections import defaultdict
+from fractions import Fraction
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .compact import CompactExactEngine, Weight, bag_last_use
+from .segments import DrawSegment
+
+
+class _Component:
+    """一个独立分量：包含的袋子位置、前沿和精确分数模式下的公共分母"""
+    __slots__ = ("positions", "frontier", "denominator", "holds_balls")
+
+    def __init__(self, positions: List[int], frontier: Dict[Tuple[int, ...], Weight], denominator: int = 1):
+        self.positions = positions
+        self.frontier = frontier
+        self.denominator = denominator
+        # 是否摸过球到手中（保守判断），放回时只合并手中可能有球的分量
+        self.holds_balls = False
+
+
+def convolve(left: Dict[Tuple[int, ...], Weight], right: Dict[Tuple[int, ...], Weight]) -> Dict[Tuple[int, ...], Weight]:
+    """两个独立前沿的稀疏卷积：状态逐元素相加，概率相乘，相同状态合并"""
+    if len(left) < len(right):
+        left, right = right, left
+    combined: Dict[Tuple[int, ...], Weight] = {}
+    get = combined.get
+    for right_state, right_prob in right.items():
+        for left_state, left_prob in left.items():
+            child = tuple(a + b for a, b in zip(left_state, right_state))
+            combined[child] = get(child, 0) + left_prob * right_prob
+    return combined
+
+
+class DecomposedExactEngine(CompactExactEngine):
+    """
+    按独立分量分别展开前沿的compact引擎
+
+    每个分量复用CompactExactEngine的展开、袋子移出和剪枝，最后卷积得到的
+    整个前沿再按同一剪枝策略检查一次；
+    精确分数模式下每个分量有自己的公共分母，展开某个分量时
+    临时把引擎的分母切换为该分量的分母。
+    """
+
+    def __init__(self, bags_config: Dict[Any, Dict[str, int]], exact_arithmetic: bool = False,
+                 output_bags=None, workers: int = 1, pruning=None, fuse_segments: bool = True,
+                 kernel: str = "auto"):
+        super().__init__(bags_config, exact_arithmetic=exact_arithmetic, output_bags=output_bags,
+                         workers=workers, pruning=pruning, fuse_segments=fuse_segments, kernel=kernel)
+        self.components: List[_Component] = []
+        self.peak_component_states = 0
+
+    def run(self, operations: List[Any],
+            progress_callback: Optional[Callable[[int, int, str], None]] = None) -> Dict[Tuple[int, ...], Weight]:
+        """按分量执行全部操作，最后卷积各分量的手牌分布"""
+        if progress_callback:
+            progress_callback(0, len(operations), "开始精确计算（独立分量分解）...")
+        else:
+            print("开始精确计算（独立分量分解）...")
+
+        self.denominator = 1
+        self.bag_marginals = {}
+        self.pruned_mass = Fraction(0) if self.exact_arithmetic else 0.0
+        self.pruned_states = 0
+        self.peak_component_states = 0
+
+        retire_after = defaultdict(list)
+        for pos, last_op in bag_last_use(operations, self.layout).items():
+            retire_after[last_op].append(pos)
+
+        self._size_log_factorials(operations)
+        self.components = [self._single_bag_component(pos) for pos in range(len(self.layout.bag_ids))]
+        for pos in retire_after.get(-1, []):
+            self._retire_in_component(pos)
+
+        pool = None
+        if self.workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            from .compact import _init_worker
+            pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                       initargs=(self.bags_config, self.exact_arithmetic, self.kernel))
+        try:
+            segments = self._find_segments(operations)
+            op_idx = 0
+            while op_idx < len(operations):
+                operation = segments.get(op_idx, operations[op_idx])
+                last_idx = operation.end if isinstance(operation, DrawSegment) else op_idx
+                if progress_callback:
+                    progress_callback(op_idx, len(operations), f"处理操作: {operation}")
+                else:
+                    print(f"  处理操作 {op_idx+1}/{len(operations)}: {operation}")
+                touched = self._apply(operation, pool)
+                touched += [self._retire_in_component(pos)
+                            for idx in range(op_idx, last_idx + 1) for pos in retire_after.get(idx, [])]
+                for component in {id(c): c for c in touched if c in self.components}.values():
+                    if self.pruning.triggers(len(component.frontier)):
+                        self.denominator = component.denominator
+                        component.frontier = self._prune(component.frontier)
+
+                sizes = [len(component.frontier) for component in self.components]
+                self.peak_component_states = max(self.peak_component_states, sum(sizes))
+                if not progress_callback:
+                    print(f"    生成状态: {sum(sizes)}个, 分量数: {len(sizes)}")
+                op_idx = last_idx + 1
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        frontier = self._combine(self.components)
+        # 剪枝策略限制的是整个前沿：各分量分别剪枝后，卷积的结果可能超过上限，需要再剪枝一次
+        if self.pruning.triggers(len(frontier)):
+            frontier = self._prune(frontier)
+        if progress_callback:
+            progress_callback(len(operations), len(operations), "计算完成")
+        else:
+            print(f"计算完成，最终状态数: {len(frontier)}")
+        return frontier
+
+    def _single_bag_component(self, pos: int) -> _Component:
+        """只包含一个袋子初始内容的分量"""
+        state = [0] * self.layout.width
+        offset = self.layout.bag_offset(pos)
+        for color, count in self.bags_config[self.layout.bag_ids[pos]].items():
+            state[offset + self.layout.color_index.index(color)] += count
+        return _Component([pos], {tuple(state): 1 if self.exact_arithmetic else 1.0})
+
+    def _component_of(self, pos: int) -> _Component:
+        for component in self.components:
+            if pos in component.positions:
+                return component
+        raise KeyError(f"袋子位置 {pos} 不属于任何分量")
+
+    def _apply(self, operation, pool) -> List[_Component]:
+        """在操作涉及的分量上执行操作，放回操作先合并相关分量；返回被修改的分量"""
+        pos = self.layout.bag_position(operation.bag_id)
+        if operation.operation_type in ("draw", "discard", "segment"):
+            if pos is None:
+                raise KeyError(f"袋子ID {operation.bag_id} 不存在于配置中")
+            component = self._component_of(pos)
+            component.holds_balls |= (operation.operation_type == "draw"
+                                      or (operation.operation_type == "segment" and operation.draw_count > 0))
+        elif operation.operation_type == "return":
+            linked = [c for c in self.components
+                      if c.holds_balls or (pos is not None and pos in c.positions)]
+            if not linked:
+                return []
+            component = self._merge(linked)
+        else:
+            return []
+
+        self.denominator = component.denominator
+        frontier = component.frontier
+        if pool is not None and len(frontier) >= self.PARALLEL_MIN_STATES:
+            frontier = self._expand_parallel(pool, frontier, operation)
+        else:
+            frontier = self.expand(frontier, operation)
+        component.frontier = frontier
+        component.denominator = self.denominator
+        return [component]
+
+    def _retire_in_component(self, pos: int) -> _Component:
+        component = self._component_of(pos)
+        self.denominator = component.denominator
+        component.frontier = self._retire_bags(component.frontier, [pos])
+        return component
+
+    def _merge(self, linked: List[_Component]) -> _Component:
+        """把多个分量合并为一个（前沿卷积）"""
+        merged = self._combine(linked)
+        component = _Component(sorted(pos for c in linked for pos in c.positions), merged, self.denominator)
+        component.holds_balls = any(c.holds_balls for c in linked)
+        self.components = [c for c in self.components if c not in linked] + [component]
+        return component
+
+    def _combine(self, components: List[_Component]) -> Dict[Tuple[int, ...], Weight]:
+        """卷积多个分量的前沿，结果的分母留在self.denominator中"""
+        # 小前沿先卷积，中间结果最小
+        ordered = sorted(components, key=lambda c: len(c.frontier))
+        frontier = ordered[0].frontier
+        denominator = ordered[0].denominator
+        for component in ordered[1:]:
+            frontier = convolve(frontier, component.frontier)
+            denominator *= component.denominator
+        self.denominator = denominator
+        if self.exact_arithmetic and len(ordered) > 1:
+            self._apply_denominator(frontier, 1)
+        return frontier
+
+    def aggregate(self, frontier: Dict[Tuple[int, ...], Weight]) -> Dict[str, Any]:
+        results = super().aggregate(frontier)
+        results["decomposition"] = {
+            "components": [[self.layout.bag_ids[pos] for pos in component.positions]
+                           for component in self.components],
+            "peak_component_states": self.peak_component_states,
+        }
+        return results
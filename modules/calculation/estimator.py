@@ -0,0 +1,275 @@
+"""
+状态空间规模预估与自动选择计算方法
+
+在不枚举状态的情况下，从袋子配置和操作序列估计每一步的：
+- 每个状态最多产生的子状态数（结果数）
+- 前沿状态数的上界
+- compact引擎的峰值内存
+
+前沿上界取几种上界中最小的一个：上一步前沿乘以本步结果数；
+手和每个仍在使用的袋子各自可能组成数的乘积；以及每个袋子
+"摸到手中的计数向量"、"丢掉的计数向量"和"放回的计数向量"
+可能取值数的乘积（这些向量唯一确定状态）。每一项都是带上限的
+计数向量个数，可以精确计算。
+
+auto方法在此基础上按时间和内存预算选择精确计算、剪枝精确计算
+或蒙特卡洛模拟（并给出模拟次数）。时间按compact引擎每生成一个
+子状态、蒙特卡洛每摸一个球的平均耗时粗略换算。
+"""
+import sys
+from typing import Dict, List, Optional, Any
+
+from .compact import StateLayout, bag_last_use
+from .pruning import PruningPolicy
+
+# compact引擎每个预估子状态的平均耗时（秒），在普通开发机上测得，只用于粗略预估
+SECONDS_PER_CHILD = 5e-7
+# 蒙特卡洛每次模拟中每摸/丢/放回一个球的平均耗时（秒）
+SECONDS_PER_SIMULATED_BALL = 5e-6
+# 字典前沿中每个状态除状态元组外的估计开销（字节）
+STATE_OVERHEAD_BYTES = 100
+
+DEFAULT_TIME_BUDGET = 60.0
+DEFAULT_MEMORY_BUDGET = 1 << 30
+# 剪枝精确计算至少要保留估计峰值状态数的这一比例，否则改用蒙特卡洛
+MIN_PRUNED_FRACTION = 0.1
+MIN_SIMULATIONS = 1000
+MAX_SIMULATIONS = 1000000
+
+
+def count_vectors(limits: List[int], total: int) -> int:
+    """满足 0 <= v[j] <= limits[j] 且 sum(v) == total 的计数向量个数（前缀和动态规划）"""
+    if total < 0 or total > sum(limits):
+        return 0
+    ways = [1] + [0] * total
+    for limit in limits:
+        prefix = 0
+        new_ways = [0] * (total + 1)
+        for s in range(total + 1):
+            prefix += ways[s]
+            if s - limit - 1 >= 0:
+                prefix -= ways[s - limit - 1]
+            new_ways[s] = prefix
+        ways = new_ways
+    return ways[total]
+
+
+class StepEstimate:
+    """一个操作的预估：结果数、执行后前沿状态数上界、峰值内存"""
+    __slots__ = ("operation", "outcomes", "states", "children", "memory_bytes")
+
+    def __init__(self, operation, outcomes: int, states: int, children: int, memory_bytes: int):
+        self.operation = operation
+        self.outcomes = outcomes
+        self.states = states
+        self.children = children
+        self.memory_bytes = memory_bytes
+
+    def __repr__(self):
+        return (f"StepEstimate({self.operation!r}, outcomes={self.outcomes}, "
+                f"states={self.states}, memory_bytes={self.memory_bytes})")
+
+
+class StateSpaceEstimate:
+    """整个操作序列的预估"""
+
+    def __init__(self, steps: List[StepEstimate], state_bytes: int, balls_moved: int):
+        self.steps = steps
+        self.state_bytes = state_bytes
+        self.balls_moved = balls_moved
+
+    @property
+    def peak_states(self) -> int:
+        return max((step.states for step in self.steps), default=1)
+
+    @property
+    def peak_memory_bytes(self) -> int:
+        return max((step.memory_bytes for step in self.steps), default=self.state_bytes)
+
+    @property
+    def total_children(self) -> int:
+        return sum(step.children for step in self.steps)
+
+    def exact_seconds(self) -> float:
+        """精确计算的预估耗时"""
+        return self.total_children * SECONDS_PER_CHILD
+
+    def pruned_seconds(self, keep: int) -> float:
+        """前沿最多保留keep个状态时的预估耗时"""
+        previous = 1
+        children = 0
+        for step in self.steps:
+            children += min(previous, keep) * step.outcomes
+            previous = min(step.states, keep)
+        return children * SECONDS_PER_CHILD
+
+    def pruned_memory_bytes(self, keep: int) -> int:
+        """前沿最多保留keep个状态时的预估峰值内存（剪枝前的子状态也在内存中）"""
+        previous = 1
+        peak = self.state_bytes
+        for step in self.steps:
+            children = min(step.states, min(previous, keep) * step.outcomes)
+            peak = max(peak, (min(previous, keep) + children) * self.state_bytes)
+            previous = min(step.states, keep)
+        return peak
+
+    def simulation_seconds(self, num_simulations: int) -> float:
+        """蒙特卡洛模拟的预估耗时"""
+        return num_simulations * max(1, self.balls_moved) * SECONDS_PER_SIMULATED_BALL
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "peak_states": self.peak_states,
+            "peak_memory_bytes": self.peak_memory_bytes,
+            "exact_seconds": self.exact_seconds(),
+            "steps": [
+                {"operation": repr(step.operation), "outcomes": step.outcomes, "states": step.states,
+                 "memory_bytes": step.memory_bytes}
+                for step in self.steps
+            ]
+        }
+
+
+def estimate_state_space(bags_config: Dict[Any, Dict[str, int]], operations: List[Any]) -> StateSpaceEstimate:
+    """
+    预估compact引擎执行操作序列时每一步的规模
+
+    参数:
+        bags_config: 袋子配置
+        operations: 操作序列
+
+    返回:
+        StateSpaceEstimate，其中每一步的状态数都是上界
+    """
+    layout = StateLayout(bags_config)
+    num_colors = layout.num_colors
+    state_bytes = sys.getsizeof((0,) * layout.width) + STATE_OVERHEAD_BYTES
+
+    initial = [[0] * num_colors for _ in layout.bag_ids]
+    for pos, bag_id in enumerate(layout.bag_ids):
+        for color, count in bags_config[bag_id].items():
+            initial[pos][layout.color_index.index(color)] += count
+    color_totals = [sum(counts[c] for counts in initial) for c in range(num_colors)]
+
+    bag_totals = [sum(counts) for counts in initial]
+    drawn = [0] * len(initial)      # 每个袋子累计摸到手中的球数
+    discarded = [0] * len(initial)  # 每个袋子累计丢掉的球数
+    returned = [0] * len(initial)   # 每个袋子累计放回的球数
+    hand_colors = [0] * num_colors  # 手中每种颜色最多可能有的球数
+    hand_size = 0
+    last_use = bag_last_use(operations, layout)
+
+    def color_limits(pos: int) -> List[int]:
+        return [min(color_totals[c], initial[pos][c] + returned[pos]) for c in range(num_colors)]
+
+    def state_cap(live) -> int:
+        """前沿状态数上界"""
+        # 方法一：手的组成 × 每个仍在状态中的袋子的组成
+        hand = count_vectors(hand_colors, hand_size)
+        by_composition = max(1, hand)
+        # 方法二：状态由每个袋子摸走和丢掉的计数向量、以及放回的计数向量唯一确定
+        by_history = 1
+        for pos in range(len(initial)):
+            by_history *= max(1, count_vectors(initial[pos], drawn[pos]))
+            by_history *= max(1, count_vectors([returned[pos]] * num_colors, returned[pos]))
+            if pos in live:
+                by_composition *= max(1, count_vectors(initial[pos], drawn[pos] + discarded[pos])
+                                      * count_vectors([returned[pos]] * num_colors, returned[pos]))
+                by_history *= max(1, count_vectors(initial[pos], discarded[pos]))
+        return min(by_composition, by_history)
+
+    steps: List[StepEstimate] = []
+    balls_moved = 0
+    states = 1
+    for op_idx, operation in enumerate(operations):
+        pos = layout.bag_position(operation.bag_id)
+        outcomes = 1
+        if operation.operation_type in ("draw", "discard") and pos is not None:
+            if operation.draw_count <= bag_totals[pos]:
+                limits = color_limits(pos)
+                outcomes = max(1, count_vectors(limits, operation.draw_count))
+                bag_totals[pos] -= operation.draw_count
+                balls_moved += operation.draw_count
+                if operation.operation_type == "draw":
+                    drawn[pos] += operation.draw_count
+                    hand_size += operation.draw_count
+                    for c in range(num_colors):
+                        hand_colors[c] = min(color_totals[c], hand_colors[c] + min(limits[c], operation.draw_count))
+                else:
+                    discarded[pos] += operation.draw_count
+        elif operation.operation_type == "return" and hand_size > 0:
+            outcomes = min(hand_size, sum(1 for count in hand_colors if count))
+            hand_size -= 1
+            balls_moved += 1
+            if pos is not None:
+                bag_totals[pos] += 1
+                returned[pos] += 1
+
+        children = states * outcomes
+        # 本步结束时袋子才被移出，峰值按仍包含本步使用的袋子计算
+        during = min(children, state_cap({p for p, last in last_use.items() if last >= op_idx}))
+        memory = (states + during) * state_bytes
+        new_states = min(during, state_cap({p for p, last in last_use.items() if last > op_idx}))
+        steps.append(StepEstimate(operation, outcomes, during, children, memory))
+        states = new_states
+
+    return StateSpaceEstimate(steps, state_bytes, balls_moved)
+
+
+class MethodChoice:
+    """auto方法的选择结果"""
+
+    def __init__(self, method: str, reason: str, estimate: StateSpaceEstimate,
+                 pruning: Optional[PruningPolicy] = None, num_simulations: int = 0):
+        self.method = method  # "exact"、"pruned" 或 "monte_carlo"
+        self.reason = reason
+        self.estimate = estimate
+        self.pruning = pruning
+        self.num_simulations = num_simulations
+
+    def to_dict(self) -> Dict[str, Any]:
+        choice = {"method": self.method, "reason": self.reason,
+                  "peak_states": self.estimate.peak_states,
+                  "peak_memory_bytes": self.estimate.peak_memory_bytes,
+                  "exact_seconds": self.estimate.exact_seconds()}
+        if self.pruning is not None:
+            choice["keep"] = self.pruning.keep
+        if self.num_simulations:
+            choice["num_simulations"] = self.num_simulations
+        return choice
+
+
+def choose_method(bags_config: Dict[Any, Dict[str, int]], operations: List[Any],
+                  time_budget: Optional[float] = None, memory_budget: Optional[int] = None,
+                  estimate: Optional[StateSpaceEstimate] = None) -> MethodChoice:
+    """
+    按时间（秒）和内存（字节）预算选择计算方法
+
+    精确计算放得进两个预算时选精确计算；否则在保留足够多状态的前提下
+    选剪枝精确计算（结果带误差上界）；再否则选蒙特卡洛，模拟次数按时间预算确定。
+    """
+    time_budget = DEFAULT_TIME_BUDGET if time_budget is None else time_budget
+    memory_budget = DEFAULT_MEMORY_BUDGET if memory_budget is None else memory_budget
+    if estimate is None:
+        estimate = estimate_state_space(bags_config, operations)
+
+    exact_seconds = estimate.exact_seconds()
+    if estimate.peak_memory_bytes <= memory_budget and exact_seconds <= time_budget:
+        return MethodChoice("exact", f"预计峰值 {estimate.peak_states:,} 个状态、{exact_seconds:.1f} 秒，"
+                                     f"在预算之内", estimate)
+
+    keep = estimate.peak_states
+    while keep > 1 and (estimate.pruned_memory_bytes(keep) > memory_budget
+                        or estimate.pruned_seconds(keep) > time_budget):
+        keep //= 2
+    if keep >= MIN_PRUNED_FRACTION * estimate.peak_states:
+        pruning = PruningPolicy(max_states=keep, keep=keep)
+        return MethodChoice("pruned", f"精确计算预计峰值 {estimate.peak_states:,} 个状态，超出预算；"
+                                      f"剪枝保留 {keep:,} 个状态", estimate, pruning=pruning)
+
+    per_simulation = estimate.simulation_seconds(1)
+    num_simulations = int(time_budget / per_simulation) if per_simulation > 0 else MAX_SIMULATIONS
+    num_simulations = max(MIN_SIMULATIONS, min(MAX_SIMULATIONS, num_simulations))
+    return MethodChoice("monte_carlo", f"精确计算预计峰值 {estimate.peak_states:,} 个状态，剪枝后保留比例过低；"
+                                       f"改用 {num_simulations:,} 次蒙特卡洛模拟", estimate,
+                        num_simulations=num_simulations)
@@ -7,6 +7,14 @@ import sys
 import os
 from typing import Dict, List
 from .core import ProbabilityCalculator, BallDrawOperation
+from .optimizer import optimize_operations
+from .prefix_cache import PrefixCache
+from .pruning import format_error_bound
+
+# 精确计算检查点目录
+CHECKPOINT_DIR = "checkpoints"
+# 前缀缓存目录，修改配置中后面的操作后重新计算时复用未改动的前缀
+PREFIX_CACHE_DIR = "prefix_cache"
 
 def load_configuration(filename: str) -> Dict:
     """加载配置文件"""
@@ -105,13 +113,29 @@ def convert_operations(operations_data: List[Dict]) -> List[BallDrawOperation]:
     
     return operations
 
-def run_exact_calculation(bags_config: Dict, operations: List[BallDrawOperation]) -> Dict:
+def run_exact_calculation(bags_config: Dict, operations: List[BallDrawOperation],
+                          checkpoint: bool = False, prefix_cache: bool = False) -> Dict:
     """运行精确计算"""
     print("\n🔢 开始精确计算...")
     print("这可能需要一些时间，具体取决于问题的复杂性。")
     
     calculator = ProbabilityCalculator()
-    results = calculator.calculate_exact(bags_config, operations)
+    # checkpoint为True时每个操作完成后写检查点，作业被中断后重新运行同一配置会从检查点继续；
+    # prefix_cache为True时缓存操作前缀，修改后面的操作后重新运行可以复用
+    results = calculator.calculate_exact(bags_config, operations, engine="compact",
+                                         checkpoint_dir=CHECKPOINT_DIR if checkpoint else None,
+                                         resume=checkpoint,
+                                         prefix_cache=PrefixCache(directory=PREFIX_CACHE_DIR) if prefix_cache else None)
+    
+    return results
+
+def run_auto_calculation(bags_config: Dict, operations: List[BallDrawOperation],
+                         time_budget: float = None) -> Dict:
+    """按预估的状态空间规模自动选择计算方法"""
+    print("\n🤖 自动选择计算方法...")
+    
+    calculator = ProbabilityCalculator()
+    results = calculator.calculate_auto(bags_config, operations, time_budget=time_budget)
     
     return results
 
@@ -139,6 +163,9 @@ def display_results(results: Dict, method_name: str, config_description: str = "
     
     print(f"📊 总状态数: {total_states:,}")
     print(f"✅ 总概率: {total_prob:.8f}")
+    error_bound = format_error_bound(results)
+    if error_bound:
+        print(error_bound)
     
     if 'simulations' in results:
         print(f"🎲 模拟次数: {results['simulations']:,}")
@@ -197,31 +224,40 @@ def main():
     print("🎲 从文件计算摸球问题的概率")
     print("=" * 60)
     
-    # 检查命令行参数
-    if len(sys.argv) < 2:
+    # 检查命令行参数，以--开头的是选项，其余按位置解析
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = {arg for arg in sys.argv[1:] if arg.startswith("--")}
+    if not args:
         print("使用方法:")
-        print("  python calculate_from_file.py <配置文件.json> [计算方法] [模拟次数]")
+        print("  python calculate_from_file.py <配置文件.json> [计算方法] [模拟次数|时间预算] [选项]")
         print()
         print("参数说明:")
         print("  <配置文件.json> - 配置文件路径（必需）")
-        print("  [计算方法]      - 'exact'（精确计算）或 'monte'（蒙特卡洛模拟），默认为'monte'")
+        print("  [计算方法]      - 'exact'（精确计算）、'monte'（蒙特卡洛模拟）或 'auto'（自动选择），默认为'monte'")
         print("  [模拟次数]      - 蒙特卡洛模拟的次数，默认为100000")
+        print("  [时间预算]      - 'auto' 方法的时间预算（秒），默认为60")
+        print()
+        print("选项:")
+        print(f"  --checkpoint    - 精确计算每个操作完成后写检查点到 {CHECKPOINT_DIR}/，中断后重新运行会继续")
+        print(f"  --prefix-cache  - 精确计算缓存操作前缀到 {PREFIX_CACHE_DIR}/，修改后面的操作后重新运行会复用")
         print()
         print("示例:")
         print("  python calculate_from_file.py user_problem.json exact")
         print("  python calculate_from_file.py user_problem.json monte 500000")
+        print("  python calculate_from_file.py user_problem.json auto 30")
+        print("  python calculate_from_file.py user_problem.json exact --checkpoint --prefix-cache")
         print()
         print("要创建配置文件，请运行:")
         print("  python config_wizard.py")
         return
     
     # 获取参数
-    config_file = sys.argv[1]
-    calculation_method = sys.argv[2] if len(sys.argv) > 2 else "monte"
+    config_file = args[0]
+    calculation_method = args[1] if len(args) > 1 else "monte"
     
-    if calculation_method not in ["exact", "monte"]:
+    if calculation_method not in ["exact", "monte", "auto"]:
         print(f"❌ 未知的计算方法: {calculation_method}")
-        print("可用方法: 'exact' (精确计算) 或 'monte' (蒙特卡洛模拟)")
+        print("可用方法: 'exact' (精确计算)、'monte' (蒙特卡洛模拟) 或 'auto' (自动选择)")
         return
     
     # 加载配置文件
@@ -241,33 +277,57 @@ def main():
         print("❌ 没有有效的操作，无法计算")
         return
     
+    # 等价改写操作序列（合并连续摸球、删除无效丢球、重排独立操作）
+    operations, rewrites = optimize_operations(config["bags_config"], operations)
+    if rewrites:
+        print(f"\n🛠️  操作序列优化:")
+        for rewrite in rewrites:
+            print(f"  - {rewrite}")
+    
     print(f"\n📊 配置摘要:")
     print(f"  袋子数量: {len(config['bags_config'])}")
     print(f"  操作数量: {len(operations)}")
     
     # 运行计算
     if calculation_method == "exact":
-        results = run_exact_calculation(config["bags_config"], operations)
+        results = run_exact_calculation(config["bags_config"], operations,
+                                        checkpoint="--checkpoint" in options,
+                                        prefix_cache="--prefix-cache" in options)
         method_name = "精确计算"
+    elif calculation_method == "auto":
+        time_budget = None
+        if len(args) > 2:
+            try:
+                time_budget = float(args[2])
+            except ValueError:
+                print("⚠️  无效的时间预算，使用默认值")
+        
+        results = run_auto_calculation(config["bags_config"], operations, time_budget)
+        choice = results["auto_choice"]
+        method_name = {"exact": "精确计算", "pruned": "剪枝精确计算"}.get(
+            choice["method"], f"蒙特卡洛模拟 ({choice.get('num_simulations', 0):,}次)")
+        method_name = f"自动选择: {method_name}"
     else:  # monte
         # 获取模拟次数
         num_simulations = 100000
-        if len(sys.argv) > 3:
+        if len(args) > 2:
             try:
-                num_simulations = int(sys.argv[3])
+                num_simulations = int(args[2])
             except ValueError:
                 print(f"⚠️  无效的模拟次数，使用默认值: {num_simulations}")
         
         results = run_monte_carlo(config["bags_config"], operations, num_simulations)
         method_name = f"蒙特卡洛模拟 ({num_simulations:,}次)"
     
+    results["operation_rewrites"] = rewrites
+    
     # 显示结果
     description = config.get("description", "")
     display_results(results, method_name, description)
     
     # 保存结果
     save_results(results, config, calculation_method, 
-                num_simulations if calculation_method == "monte" else 0)
+                num_simulations if calculation_method == "monte" else results.get("simulations", 0))
     
     print(f"\n🎉 计算完成！")
 
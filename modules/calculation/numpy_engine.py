@@ -0,0 +1,219 @@
+"""
+NumPy向量化精确计算引擎（可选，需要numpy）
+
+整个前沿存储为一个二维整数数组（每行一个状态，列布局与compact引擎的
+状态元组相同）和一个float64概率向量。摸球时用预先计算的结果矩阵
+（所有和为K的计数向量）广播计算每个(状态, 结果)对的超几何概率
+（在对数空间中累加组合数，每块只做一次np.exp，大袋子的C(N, K)不会溢出），
+只保留概率非零的对；合并时把每行打包为一个整数键，用np.unique加
+加权bincount累加概率（键空间过大时退回按行np.unique）。
+"""
+from typing import Dict, List, Tuple, Optional, Any, Iterable
+
+import numpy as np
+
+from .compact import CompactExactEngine
+from .outcomes import LOG_FACTORIAL, iter_count_vectors
+from .pruning import PruningPolicy
+
+# 打包行键时允许的最大键空间，超过时退回按行np.unique
+_MAX_PACKED_KEY = 2 ** 62
+# 每块展开产生的(状态, 结果)对数上限，控制中间数组的内存
+_CHUNK_PAIRS = 1 << 20
+
+
+class ArrayFrontier:
+    """数组形式的前沿：states为(状态数 × 宽度)整数数组，probs为概率向量"""
+    __slots__ = ("states", "probs")
+
+    def __init__(self, states: np.ndarray, probs: np.ndarray):
+        self.states = states
+        self.probs = probs
+
+    def __len__(self):
+        return len(self.probs)
+
+    def to_dict(self) -> Dict[Tuple[int, ...], float]:
+        return {tuple(int(v) for v in row): float(prob) for row, prob in zip(self.states, self.probs)}
+
+
+def _packed_row_keys(states: np.ndarray) -> Optional[np.ndarray]:
+    """把每行按混合进制打包为一个int64键（只使用取值会变化的列），键空间过大时返回None"""
+    mins = states.min(axis=0)
+    ranges = states.max(axis=0) - mins + 1
+    varying = np.nonzero(ranges > 1)[0]
+    multipliers = []
+    key_space = 1
+    for column in varying:
+        multipliers.append(key_space)
+        key_space *= int(ranges[column])
+        if key_space >= _MAX_PACKED_KEY:
+            return None
+    if not multipliers:
+        return np.zeros(len(states), dtype=np.int64)
+    return (states[:, varying] - mins[varying]) @ np.array(multipliers, dtype=np.int64)
+
+
+def merge_rows(states: np.ndarray, probs: np.ndarray) -> ArrayFrontier:
+    """合并相同的行，概率用加权bincount累加"""
+    if len(probs) == 0:
+        return ArrayFrontier(states, probs)
+    keys = _packed_row_keys(states)
+    if keys is None:
+        unique_states, inverse = np.unique(states, axis=0, return_inverse=True)
+    else:
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        unique_states = states[first]
+    merged_probs = np.bincount(inverse.ravel(), weights=probs, minlength=len(unique_states))
+    return ArrayFrontier(unique_states, merged_probs)
+
+
+_OUTCOME_MATRICES: Dict[Tuple[int, int], np.ndarray] = {}
+
+
+def _outcome_matrix(num_colors: int, draw_count: int) -> np.ndarray:
+    """所有和为draw_count的num_colors维计数向量（不考虑袋中数量上限）"""
+    key = (num_colors, draw_count)
+    matrix = _OUTCOME_MATRICES.get(key)
+    if matrix is None:
+        vectors = list(iter_count_vectors((draw_count,) * num_colors, draw_count))
+        matrix = np.array(vectors, dtype=np.int64).reshape(len(vectors), num_colors)
+        _OUTCOME_MATRICES[key] = matrix
+    return matrix
+
+
+def _log_comb_table(max_n: int, max_k: int) -> np.ndarray:
+    """table[n, k] = log C(n, k)，k > n 时为-inf"""
+    LOG_FACTORIAL.ensure(max_n)
+    log_factorials = np.array(LOG_FACTORIAL.values[:max_n + 1])
+    n = np.arange(max_n + 1)[:, None]
+    k = np.arange(max_k + 1)[None, :]
+    table = np.full((max_n + 1, max_k + 1), -np.inf)
+    valid = np.broadcast_to(k <= n, table.shape)
+    table[valid] = (log_factorials[n] - log_factorials[k] - log_factorials[np.maximum(n - k, 0)])[valid]
+    return table
+
+
+class NumpyExactEngine(CompactExactEngine):
+    """前沿以NumPy数组存储的精确计算引擎，只支持浮点概率"""
+
+    def __init__(self, bags_config: Dict[Any, Dict[str, int]], output_bags: Optional[Iterable[Any]] = None,
+                 pruning: Optional[PruningPolicy] = None):
+        # 数组前沿逐个操作向量化展开，不使用单袋连续摸球段
+        super().__init__(bags_config, output_bags=output_bags, pruning=pruning, fuse_segments=False)
+
+    def _initial_frontier(self) -> ArrayFrontier:
+        initial = np.array([self.layout.initial_state(self.bags_config)], dtype=np.int64)
+        return ArrayFrontier(initial, np.ones(1))
+
+    def expand(self, frontier: ArrayFrontier, operation) -> ArrayFrontier:
+        if operation.operation_type in ("draw", "discard"):
+            return self._expand_removal(frontier, operation, to_hand=operation.operation_type == "draw")
+        if operation.operation_type == "return":
+            return self._expand_return(frontier, operation)
+        return frontier
+
+    def _expand_removal(self, frontier: ArrayFrontier, operation, to_hand: bool) -> ArrayFrontier:
+        pos = self.layout.bag_position(operation.bag_id)
+        if pos is None:
+            raise KeyError(f"袋子ID {operation.bag_id} 不存在于配置中")
+        num_colors = self.layout.num_colors
+        offset = self.layout.bag_offset(pos)
+        draw_count = operation.draw_count
+
+        bags = frontier.states[:, offset:offset + num_colors]
+        # 同一步所有状态的袋中球数相同
+        bag_total = int(bags[0].sum())
+        if draw_count > bag_total:
+            return frontier  # 无法摸球
+
+        # 只在前沿中出现过的颜色上枚举结果
+        colors = np.nonzero(bags.max(axis=0) > 0)[0]
+        outcomes = _outcome_matrix(len(colors), draw_count)
+        log_comb = _log_comb_table(bag_total, draw_count)
+        log_denominator = log_comb[bag_total, draw_count]
+
+        # 结果矩阵：每个结果对整行状态的增量
+        delta = np.zeros((len(outcomes), self.layout.width), dtype=np.int64)
+        delta[:, offset + colors] = -outcomes
+        if to_hand:
+            delta[:, colors] = outcomes
+
+        child_states: List[np.ndarray] = []
+        child_probs: List[np.ndarray] = []
+        chunk = max(1, _CHUNK_PAIRS // len(outcomes))
+        for start in range(0, len(frontier), chunk):
+            chunk_bags = bags[start:start + chunk][:, colors]
+            # probs[i, j] = p_i * exp(Σ log C(n_ic, k_jc) - log C(N, K))，超出袋中数量的结果为0
+            log_probs = np.full((len(chunk_bags), len(outcomes)), -log_denominator)
+            for c in range(len(colors)):
+                log_probs += log_comb[chunk_bags[:, c][:, None], outcomes[:, c][None, :]]
+            probs = frontier.probs[start:start + chunk, None] * np.exp(log_probs)
+            rows, cols = np.nonzero(probs)
+            child_states.append(frontier.states[start + rows] + delta[cols])
+            child_probs.append(probs[rows, cols])
+
+        return merge_rows(np.concatenate(child_states), np.concatenate(child_probs))
+
+    def _expand_return(self, frontier: ArrayFrontier, operation) -> ArrayFrontier:
+        num_colors = self.layout.num_colors
+        pos = self.layout.bag_position(operation.bag_id)
+        # 袋子不存在时球离开手后不进入任何袋子，与字典引擎行为一致
+        offset = self.layout.bag_offset(pos) if pos is not None else None
+
+        hands = frontier.states[:, :num_colors]
+        hand_sizes = hands.sum(axis=1)
+        # 手中没球，直接传递状态
+        empty = hand_sizes == 0
+        child_states = [frontier.states[empty]]
+        child_probs = [frontier.probs[empty]]
+
+        safe_sizes = np.where(empty, 1, hand_sizes)
+        for color_idx in range(num_colors):
+            rows = hands[:, color_idx] > 0
+            if not rows.any():
+                continue
+            states = frontier.states[rows].copy()
+            states[:, color_idx] -= 1
+            if offset is not None:
+                states[:, offset + color_idx] += 1
+            child_states.append(states)
+            child_probs.append(frontier.probs[rows] * (hands[rows, color_idx] / safe_sizes[rows]))
+
+        return merge_rows(np.concatenate(child_states), np.concatenate(child_probs))
+
+    def _retire_bags(self, frontier: ArrayFrontier, positions: List[int]) -> ArrayFrontier:
+        """把不再使用的袋子移出状态：需要输出的袋子先累计边缘分布，再把对应列清零并合并"""
+        if not positions:
+            return frontier
+        num_colors = self.layout.num_colors
+        states = frontier.states.copy()
+        for pos in positions:
+            offset = self.layout.bag_offset(pos)
+            end = offset + num_colors
+            if pos in self.output_positions:
+                marginal = merge_rows(states[:, offset:end], frontier.probs)
+                self.bag_marginals[pos] = marginal.to_dict()
+            states[:, offset:end] = 0
+        return merge_rows(states, frontier.probs)
+
+    def _prune(self, frontier: ArrayFrontier) -> ArrayFrontier:
+        """按剪枝策略丢弃状态（前k个用argpartition选择），不重新归一化"""
+        probs = frontier.probs
+        keep = np.arange(len(probs))
+        if self.pruning.min_probability > 0:
+            keep = keep[probs >= self.pruning.min_probability]
+        if self.pruning.exceeds(len(keep)):
+            keep = keep[np.argpartition(-probs[keep], self.pruning.keep - 1)[:self.pruning.keep]]
+        if len(keep) == len(probs):
+            return frontier
+        dropped = np.ones(len(probs), dtype=bool)
+        dropped[keep] = False
+        self._record_pruned(float(probs[dropped].sum()), len(probs) - len(keep))
+        print(f"  剪枝后保留 {len(keep)} 个状态 (原 {len(probs)} 个)，丢弃概率 {self.pruned_mass:.3e}")
+        return ArrayFrontier(frontier.states[keep], probs[keep])
+
+    def aggregate(self, frontier: ArrayFrontier) -> Dict[str, Any]:
+        results = super().aggregate(frontier.to_dict())
+        results["engine"] = "numpy"
+        return results
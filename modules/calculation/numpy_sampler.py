@@ -0,0 +1,145 @@
+"""
+NumPy批量蒙特卡洛采样器（可选，需要numpy）
+
+一整块模拟同时进行：所有模拟的状态存储为一个(模拟数 × 宽度)的整数数组，
+列布局与compact引擎的状态元组相同。每个操作对所有行一起执行：
+
+- 摸球/丢球：逐个颜色做条件超几何抽样，第j种颜色摸到的数量服从
+  Hypergeometric(该颜色球数, 之后各颜色球数之和, 剩余摸球数)，
+  各行的参数不同，由Generator.hypergeometric按数组广播（多元超几何分布
+  的逐行等价形式，numpy的multivariate_hypergeometric只接受一组颜色）
+  摸球数少于颜色数时改为逐个球在累计计数上查找，调用次数更少
+- 放回：在手的累计计数上查找每行随机选中的球
+
+每块结束后把各行按混合进制打包为一个整数键（与numpy精确引擎相同），
+用np.unique统计各最终状态出现的次数（键空间过大时退回按行np.unique）。
+"""
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from .numpy_engine import _packed_row_keys
+from .sampler import CountSampler
+
+# 默认每块的模拟数
+DEFAULT_BATCH_SIZE = 1 << 16
+
+
+class NumpyBatchSampler(CountSampler):
+    """
+    按块向量化执行模拟的采样器，操作语义与CountSampler相同
+
+    参数:
+        batch_size: 每块同时进行的模拟数
+    """
+
+    # 精度目标模式下每块的模拟数
+    ADAPTIVE_BLOCK_SIZE = 4 * DEFAULT_BATCH_SIZE
+
+    def __init__(self, bags_config: Dict[Any, Dict[str, int]], operations: List[Any],
+                 batch_size: int = DEFAULT_BATCH_SIZE):
+        super().__init__(bags_config, operations)
+        if batch_size < 1:
+            raise ValueError(f"每块模拟数必须为正数: {batch_size}")
+        self.batch_size = batch_size
+        self._initial_row = np.array(self.initial_state, dtype=np.int32)
+
+    def spawn_seeds(self, seed: Optional[int], count: int) -> List[np.random.SeedSequence]:
+        """由一个种子（或已派生的SeedSequence）用SeedSequence派生count个互相独立的随机流"""
+        base = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        return base.spawn(count)
+
+    def make_rng(self, stream_seed) -> np.random.Generator:
+        return np.random.default_rng(stream_seed)
+
+    def default_rng(self) -> np.random.Generator:
+        return np.random.default_rng()
+
+    def run(self, num_simulations: int, rng: Optional[np.random.Generator] = None,
+            progress_callback: Optional[Callable[[int, int], None]] = None) -> Counter:
+        """
+        执行num_simulations次模拟，返回{最终状态元组: 次数}
+
+        参数:
+            rng: numpy.random.Generator，默认新建一个
+        """
+        rng = rng if rng is not None else self.default_rng()
+        tally: Counter = Counter()
+        done = 0
+        while done < num_simulations:
+            block = min(self.batch_size, num_simulations - done)
+            states = self.simulate_batch(block, rng)
+            self._tally_rows(states, tally)
+            done += block
+            if progress_callback:
+                progress_callback(done, num_simulations)
+            else:
+                print(f"  进度: {done / num_simulations * 100:.1f}%", end='\r')
+        return tally
+
+    def simulate_batch(self, size: int, rng: np.random.Generator) -> np.ndarray:
+        """同时执行size次模拟，返回(size × 宽度)的最终状态数组"""
+        num_colors = self._num_colors
+        # 按列存储，逐颜色的列运算访问连续内存
+        states = np.empty((size, len(self._initial_row)), dtype=np.int32, order="F")
+        states[:] = self._initial_row
+        hand = states[:, :num_colors]
+        for operation_type, offset, count, indices in self.steps:
+            if operation_type == "return":
+                self._pick_balls(states, hand, offset, np.ones(size, dtype=bool), rng, 0, num_colors)
+                continue
+            if offset is None or not indices:
+                continue
+            bag = states[:, offset:offset + num_colors]
+            active = bag.sum(axis=1) >= count  # 球不够的行跳过
+            target = 0 if operation_type == "draw" else None
+            columns = [idx - offset for idx in indices]
+            if count < len(columns):
+                # 摸球数少于颜色数时逐个球查找更快
+                for _ in range(count):
+                    self._pick_balls(states, bag, target, active, rng, columns[0], columns[-1] + 1)
+                continue
+            remaining = np.where(active, count, 0)
+            # 之后各颜色的球数之和，作为条件超几何抽样的"其他球"
+            rest = bag[:, columns].sum(axis=1)
+            for color in columns:
+                if not remaining.any():
+                    break
+                available = bag[:, color]
+                rest = rest - available
+                taken = rng.hypergeometric(available, rest, remaining)
+                bag[:, color] -= taken
+                if target is not None:
+                    hand[:, color] += taken
+                remaining = remaining - taken
+        return states
+
+    def _pick_balls(self, states: np.ndarray, source: np.ndarray, target: Optional[int], active: np.ndarray,
+                    rng: np.random.Generator, first: int, end: int):
+        """
+        active中的每行从source（手或袋子）的first:end列中随机取出一个球，
+        放入从target列开始的计数（None表示丢弃），空的行不变
+        """
+        counts = source[:, first:end]
+        totals = counts.sum(axis=1)
+        rows = np.nonzero(active & (totals > 0))[0]
+        if len(rows) == 0:
+            return
+        picks = rng.integers(0, totals[rows])
+        cumulative = np.cumsum(counts[rows], axis=1)
+        colors = first + (cumulative > picks[:, None]).argmax(axis=1)
+        source[rows, colors] -= 1
+        if target is not None:
+            states[rows, target + colors] += 1
+
+    def _tally_rows(self, states: np.ndarray, tally: Counter):
+        """统计一块中各最终状态出现的次数并累加到tally"""
+        keys = _packed_row_keys(states)
+        if keys is not None:
+            _, first, counts = np.unique(keys, return_index=True, return_counts=True)
+            unique_states = states[first]
+        else:
+            unique_states, counts = np.unique(states, axis=0, return_counts=True)
+        for row, count in zip(unique_states.tolist(), counts.tolist()):
+            tally[tuple(row)] += count
@@ -0,0 +1,160 @@
+"""
+操作序列优化器
+
+位于convert_operations和计算引擎之间，对BallDrawOperation列表做等价改写：
+- 在两次放回之间，对不同袋子的操作互相独立，按袋子分组重排，让袋子尽早用完
+- 删除因球数不足而不会发生的摸球/丢球
+- 删除之后不再使用、也不需要输出的袋子上的丢球
+- 合并同一袋子上连续的摸球（或连续的丢球）
+
+每个袋子的球数和手中球数只取决于操作序列本身，因此所有改写都可以
+在不枚举状态的情况下静态判断。返回的改写记录用于核对等价性。
+"""
+from typing import Dict, List, Tuple, Optional, Any
+
+from .core import BallDrawOperation
+
+# 优化过程中的操作：(操作, 对应的原始操作编号列表)
+_Tracked = Tuple[BallDrawOperation, List[int]]
+
+
+def _bag_key(bags_config: Dict[Any, Dict[str, int]], bag_id) -> Optional[Any]:
+    """兼容字符串和整数类型的键，袋子不存在时返回None"""
+    if bag_id in bags_config:
+        return bag_id
+    if str(bag_id) in bags_config:
+        return str(bag_id)
+    return None
+
+
+def _describe(indices: List[int]) -> str:
+    return "操作" + ",".join(str(i) for i in indices)
+
+
+def _reorder(bags_config, tracked: List[_Tracked], rewrites: List[str]) -> List[_Tracked]:
+    """在放回操作之间按袋子分组，本段之后不再使用的袋子排在前面"""
+    last_use: Dict[Any, int] = {}
+    for position, (op, _) in enumerate(tracked):
+        last_use[_bag_key(bags_config, op.bag_id)] = position
+
+    reordered: List[_Tracked] = []
+    segment: List[Tuple[int, _Tracked]] = []
+
+    def flush():
+        if not segment:
+            return
+        segment_end = segment[-1][0]
+        first_seen: Dict[Any, int] = {}
+        for position, (op, _) in segment:
+            first_seen.setdefault(_bag_key(bags_config, op.bag_id), position)
+        ordered = sorted(
+            segment,
+            key=lambda item: (
+                last_use[_bag_key(bags_config, item[1][0].bag_id)] > segment_end,
+                first_seen[_bag_key(bags_config, item[1][0].bag_id)],
+                item[0],
+            ),
+        )
+        if [position for position, _ in ordered] != [position for position, _ in segment]:
+            before = " ".join(repr(item[0]) for _, item in segment)
+            after = " ".join(repr(item[0]) for _, item in ordered)
+            rewrites.append(f"重排{_describe([i for _, item in segment for i in item[1]])}: {before} -> {after}")
+        reordered.extend(item for _, item in ordered)
+        segment.clear()
+
+    for position, item in enumerate(tracked):
+        if item[0].operation_type == "return":
+            flush()
+            reordered.append(item)
+        else:
+            segment.append((position, item))
+    flush()
+    return reordered
+
+
+def _simulate_totals(bags_config, tracked: List[_Tracked]) -> List[Tuple[int, int]]:
+    """每个操作执行前目标袋子的球数和手中球数"""
+    totals = {bag_id: sum(color_counts.values()) for bag_id, color_counts in bags_config.items()}
+    hand_size = 0
+    before = []
+    for op, _ in tracked:
+        key = _bag_key(bags_config, op.bag_id)
+        bag_total = totals.get(key, 0) if key is not None else 0
+        before.append((bag_total, hand_size))
+        if op.operation_type in ("draw", "discard"):
+            if key is not None and op.draw_count <= bag_total:
+                totals[key] -= op.draw_count
+                if op.operation_type == "draw":
+                    hand_size += op.draw_count
+        elif op.operation_type == "return" and hand_size > 0:
+            hand_size -= 1
+            if key is not None:
+                totals[key] += 1
+    return before
+
+
+def _remove_dead(bags_config, tracked: List[_Tracked], output_keys, rewrites: List[str]) -> List[_Tracked]:
+    """删除不会发生的摸球/丢球，以及之后不再使用且不输出的袋子上的丢球"""
+    before = _simulate_totals(bags_config, tracked)
+    used_later = set()
+    kept: List[_Tracked] = []
+    for (op, indices), (bag_total, _) in zip(reversed(tracked), reversed(before)):
+        key = _bag_key(bags_config, op.bag_id)
+        if op.operation_type in ("draw", "discard") and key is not None and op.draw_count > bag_total:
+            rewrites.append(f"删除{_describe(indices)}: {op!r} 时袋中只有{bag_total}个球，不会发生")
+            continue
+        if (op.operation_type == "discard" and key is not None
+                and key not in used_later and key not in output_keys):
+            rewrites.append(f"删除{_describe(indices)}: {op!r} 之后袋子{op.bag_id}不再使用且不输出")
+            continue
+        used_later.add(key)
+        kept.append((op, indices))
+    kept.reverse()
+    return kept
+
+
+def _fuse(bags_config, tracked: List[_Tracked], rewrites: List[str]) -> List[_Tracked]:
+    """合并同一袋子上连续的摸球或连续的丢球（两次都能发生时才合并）"""
+    fused: List[_Tracked] = []
+    for op, indices in tracked:
+        if fused and op.operation_type in ("draw", "discard"):
+            prev_op, prev_indices = fused[-1]
+            if (prev_op.operation_type == op.operation_type
+                    and _bag_key(bags_config, prev_op.bag_id) == _bag_key(bags_config, op.bag_id)):
+                merged = BallDrawOperation(
+                    bag_id=prev_op.bag_id,
+                    draw_count=prev_op.draw_count + op.draw_count,
+                    operation_type=op.operation_type
+                )
+                rewrites.append(f"合并{_describe(prev_indices + indices)}: {prev_op!r} + {op!r} -> {merged!r}")
+                fused[-1] = (merged, prev_indices + indices)
+                continue
+        fused.append((op, indices))
+    return fused
+
+
+def optimize_operations(bags_config: Dict[Any, Dict[str, int]],
+                        operations: List[BallDrawOperation],
+                        output_bags: Optional[List[Any]] = None) -> Tuple[List[BallDrawOperation], List[str]]:
+    """
+    对操作序列做等价改写
+
+    参数:
+        bags_config: 袋子配置
+        operations: 操作序列
+        output_bags: 需要输出最终状态的袋子ID，默认全部袋子（此时不会删除任何丢球）
+
+    返回:
+        (优化后的操作序列, 改写记录列表)
+    """
+    if output_bags is None:
+        output_keys = set(bags_config)
+    else:
+        output_keys = {_bag_key(bags_config, bag_id) for bag_id in output_bags}
+
+    rewrites: List[str] = []
+    tracked: List[_Tracked] = [(op, [i]) for i, op in enumerate(operations, 1)]
+    tracked = _reorder(bags_config, tracked, rewrites)
+    tracked = _remove_dead(bags_config, tracked, output_keys, rewrites)
+    tracked = _fuse(bags_config, tracked, rewrites)
+    return [op for op, _ in tracked], rewrites
@@ -0,0 +1,354 @@
+"""
+多元超几何摸球结果表
+
+对给定袋子组成（计数向量）和摸球数量，预先计算所有可能的
+摸出计数向量及其概率，并用有界LRU缓存复用。
+"""
+import math
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Any, Iterator, Callable
+
+# 稀疏计数向量：[(颜色下标, 数量), ...]，只包含数量大于0的颜色
+SparseCounts = List[Tuple[int, int]]
+
+# 概率计算内核：
+# - "exact": ∏C(n_j, k_j) / C(N, K) 用Python大整数精确计算后转换为float（正确舍入）
+# - "log": 查log阶乘表在对数空间求和后取exp，不经过大整数
+# - "auto": 袋中球数达到LOG_KERNEL_MIN_BALLS时用"log"，否则用"exact"
+KERNELS = ("auto", "exact", "log")
+# 球数较少时大整数很短，精确内核并不更慢，且结果正确舍入
+LOG_KERNEL_MIN_BALLS = 500
+
+
+def resolve_kernel(kernel: str, total: int) -> str:
+    """把"auto"解析为具体内核"""
+    if kernel not in KERNELS:
+        raise ValueError(f"未知的概率计算内核: {kernel}，可用内核: {KERNELS}")
+    if kernel == "auto":
+        return "log" if total >= LOG_KERNEL_MIN_BALLS else "exact"
+    return kernel
+
+
+def iter_count_vectors(limits: Tuple[int, ...], total: int) -> Iterator[Tuple[int, ...]]:
+    """
+    非递归地按字典序枚举所有满足 0 <= v[j] <= limits[j] 且 sum(v) == total 的计数向量
+
+    只维护一个可变的当前向量，每个结果产出一次元组。
+    """
+    size = len(limits)
+    # capacity[j] = limits[j:] 的总和，即下标j及之后最多还能放多少个球
+    capacity = [0] * (size + 1)
+    for j in range(size - 1, -1, -1):
+        capacity[j] = capacity[j + 1] + limits[j]
+    if total < 0 or total > capacity[0]:
+        return
+    if size == 0:
+        yield ()
+        return
+
+    current = [0] * size
+
+    def fill(start: int, remaining: int):
+        # 从start开始尽量把球往后放，得到该前缀下字典序最小的向量
+        for j in range(start, size):
+            take = remaining - capacity[j + 1]
+            take = take if take > 0 else 0
+            current[j] = take
+            remaining -= take
+
+    fill(0, total)
+    while True:
+        yield tuple(current)
+        # 从右往左找第一个还能加1、且右侧有球可以挪过来的位置
+        tail = current[size - 1]
+        j = size - 2
+        while j >= 0 and (current[j] >= limits[j] or tail == 0):
+            tail += current[j]
+            j -= 1
+        if j < 0:
+            return
+        current[j] += 1
+        fill(j + 1, tail - 1)
+
+
+class LogFactorialTable:
+    """
+    log(n!) 查表，按需扩展
+
+    用lgamma逐项计算而不是累加log(k)，每一项的相对误差都在机器精度量级，
+    不随n累积。
+    """
+
+    def __init__(self, size: int = 0):
+        self.values: List[float] = [0.0]
+        self.ensure(size)
+
+    def ensure(self, n: int):
+        """保证表中包含0..n"""
+        for k in range(len(self.values), n + 1):
+            self.values.append(math.lgamma(k + 1))
+
+    def __getitem__(self, n: int) -> float:
+        return self.values[n]
+
+    def __len__(self):
+        return len(self.values)
+
+
+# 进程内共享的log阶乘表
+LOG_FACTORIAL = LogFactorialTable()
+
+
+class OutcomeTable:
+    """
+    一次摸球的全部结果
+
+    vectors[i] 是摸出的计数向量（与袋子计数向量对齐），
+    概率为 weights[i] / denominator，其中 weights[i] = ∏C(n_j, k_j)，denominator = C(N, K)
+
+    kernel为"log"时不计算大整数权重（weights为空、denominator为None），
+    probabilities由log阶乘表得到，见_enumerate_log的误差说明。
+    """
+    __slots__ = ("counts", "draw_count", "kernel", "vectors", "sparse", "weights", "denominator", "probabilities")
+
+    def __init__(self, counts: Tuple[int, ...], draw_count: int, kernel: str = "exact"):
+        self.counts = counts
+        self.draw_count = draw_count
+        self.vectors: List[Tuple[int, ...]] = []
+        self.sparse: List[SparseCounts] = []
+        self.weights: List[int] = []
+        self.probabilities: List[float] = []
+
+        total = sum(counts)
+        self.kernel = resolve_kernel(kernel, total)
+        if draw_count > total:
+            # 无法摸球：唯一结果是什么也没摸到
+            self.kernel = "exact"
+            self.denominator = 1
+            self._append(tuple(0 for _ in counts), 1)
+        elif self.kernel == "log":
+            self.denominator = None
+            self._enumerate_log()
+            return
+        else:
+            self.denominator = math.comb(total, draw_count)
+            self._enumerate()
+        self.probabilities = [weight / self.denominator for weight in self.weights]
+
+    def _append(self, vector: Tuple[int, ...], weight: int):
+        self.vectors.append(vector)
+        self.sparse.append([(i, take) for i, take in enumerate(vector) if take])
+        self.weights.append(weight)
+
+    def _enumerate_log(self):
+        """
+        对数空间计算概率：log p = Σ logC(n_j, k_j) - logC(N, K)
+
+        按颜色深度优先枚举（顺序与iter_count_vectors相同），前缀的对数和、
+        计数元组和稀疏列表在同一前缀下的所有结果之间共享，每个结果只需一次加法和一次exp。
+
+        每个log阶乘的绝对误差约为 u·log(N!)（u为双精度单位舍入误差），
+        每个概率由 2C+3 个表项相加减得到，因此相对误差不超过约
+        (2C+3)·u·log(N!)：N=1000 时约 1e-12 量级，远小于蒙特卡洛和剪枝的误差。
+        """
+        counts = self.counts
+        draw_count = self.draw_count
+        size = len(counts)
+        total = sum(counts)
+        lf = LOG_FACTORIAL
+        lf.ensure(total)
+        log_denominator = lf[total] - lf[draw_count] - lf[total - draw_count]
+        # log_rows[j][k] = logC(n_j, k)，每种颜色只计算一次
+        log_rows = [[lf[n] - lf[k] - lf[n - k] for k in range(min(n, draw_count) + 1)] for n in counts]
+        # capacity[j] = counts[j:] 的总和
+        capacity = [0] * (size + 1)
+        for j in range(size - 1, -1, -1):
+            capacity[j] = capacity[j + 1] + counts[j]
+
+        vectors, sparse, probabilities = self.vectors, self.sparse, self.probabilities
+        exp = math.exp
+        last = size - 1
+        last_row = log_rows[last]
+
+        def visit(j: int, remaining: int, log_prob: float, prefix: Tuple[int, ...], prefix_sparse: SparseCounts):
+            row = log_rows[j]
+            low = max(0, remaining - capacity[j + 1])
+            high = min(counts[j], remaining)
+            if j == last - 1:
+                # 倒数第二种颜色：最后一种颜色的数量随之确定，直接产出结果
+                for take in range(low, high + 1):
+                    rest = remaining - take
+                    entry = prefix_sparse + [(j, take)] if take else list(prefix_sparse)
+                    if rest:
+                        entry.append((last, rest))
+                    vectors.append(prefix + (take, rest))
+                    sparse.append(entry)
+                    probabilities.append(exp(log_prob + row[take] + last_row[rest]))
+                return
+            for take in range(low, high + 1):
+                visit(j + 1, remaining - take, log_prob + row[take], prefix + (take,),
+                      prefix_sparse + [(j, take)] if take else prefix_sparse)
+
+        if size == 1:
+            vectors.append((draw_count,))
+            sparse.append([(0, draw_count)] if draw_count else [])
+            probabilities.append(1.0)
+        elif size > 1:
+            visit(0, draw_count, -log_denominator, (), [])
+        elif draw_count == 0:
+            vectors.append(())
+            sparse.append([])
+            probabilities.append(1.0)
+
+    def _enumerate(self):
+        counts = self.counts
+        # comb_rows[j][k] = C(n_j, k)，每种颜色只计算一次
+        comb_rows = [[math.comb(n, k) for k in range(min(n, self.draw_count) + 1)] for n in counts]
+        for vector in iter_count_vectors(counts, self.draw_count):
+            weight = 1
+            for j, take in enumerate(vector):
+                if take:
+                    weight *= comb_rows[j][take]
+            self._append(vector, weight)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def __repr__(self):
+        return f"OutcomeTable(counts={self.counts}, draw_count={self.draw_count}, outcomes={len(self)})"
+
+
+class SegmentOutcomeTable:
+    """
+    同一袋子上一段连续摸球和丢球的全部结果
+
+    摸出和丢掉的球不分先后，一段操作等价于一次多元超几何分布：
+    先从袋中摸出draw_count个到手中，再从剩下的球中丢掉discard_count个。
+    结果i为 drawn[i] 到手、discarded[i] 丢掉，概率为
+    weights[i] / denominator，其中
+    weights[i] = ∏C(n_j, a_j)·C(n_j - a_j, b_j)，denominator = C(N, A)·C(N - A, B)；
+    kernel为"log"时只由log阶乘表直接算出浮点概率，不经过大整数。
+    sparse[i] = [(颜色下标, 离开袋子的数量, 进入手中的数量), ...]
+    """
+    __slots__ = ("counts", "draw_count", "discard_count", "kernel", "sparse", "weights", "denominator",
+                 "probabilities")
+
+    def __init__(self, counts: Tuple[int, ...], draw_count: int, discard_count: int, kernel: str = "exact"):
+        self.counts = counts
+        self.draw_count = draw_count
+        self.discard_count = discard_count
+        self.sparse: List[List[Tuple[int, int, int]]] = []
+        self.weights: List[int] = []
+        self.probabilities: List[float] = []
+        self.denominator = None
+
+        total = sum(counts)
+        self.kernel = resolve_kernel(kernel, total)
+        if draw_count + discard_count > total:
+            raise ValueError(f"袋中只有{total}个球，无法摸出{draw_count}个并丢掉{discard_count}个")
+        pairs = [(drawn, discarded)
+                 for drawn in iter_count_vectors(counts, draw_count)
+                 for discarded in iter_count_vectors(tuple(n - a for n, a in zip(counts, drawn)), discard_count)]
+        self.sparse = [[(j, a + b, a) for j, (a, b) in enumerate(zip(drawn, discarded)) if a or b]
+                       for drawn, discarded in pairs]
+        if self.kernel == "exact":
+            self.denominator = math.comb(total, draw_count) * math.comb(total - draw_count, discard_count)
+            for drawn, discarded in pairs:
+                weight = 1
+                for n, a, b in zip(counts, drawn, discarded):
+                    if a or b:
+                        weight *= math.comb(n, a) * math.comb(n - a, b)
+                self.weights.append(weight)
+            self.probabilities = [weight / self.denominator for weight in self.weights]
+        else:
+            lf = LOG_FACTORIAL
+            lf.ensure(total)
+            rest = total - draw_count - discard_count
+            log_denominator = lf[total] - lf[draw_count] - lf[discard_count] - lf[rest]
+            for drawn, discarded in pairs:
+                log_weight = -log_denominator
+                for n, a, b in zip(counts, drawn, discarded):
+                    if a or b:
+                        log_weight += lf[n] - lf[a] - lf[b] - lf[n - a - b]
+                self.probabilities.append(math.exp(log_weight))
+
+    def __len__(self):
+        return len(self.sparse)
+
+    def __repr__(self):
+        return (f"SegmentOutcomeTable(counts={self.counts}, draw_count={self.draw_count}, "
+                f"discard_count={self.discard_count}, outcomes={len(self)})")
+
+
+class OutcomeTableCache:
+    """
+    以(袋子组成, 摸球参数)为键的有界LRU结果表缓存
+
+    超出maxsize时淘汰最久未使用的表，并记录命中、未命中和淘汰次数。
+    factory为结果表的构造函数，参数为袋子组成和摸球参数。
+    """
+
+    def __init__(self, maxsize: int = 4096, factory: Callable[..., Any] = OutcomeTable):
+        if maxsize <= 0:
+            raise ValueError(f"缓存大小必须为正数: {maxsize}")
+        self.maxsize = maxsize
+        self.factory = factory
+        self._tables: "OrderedDict[Tuple[Any, ...], Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, counts: Tuple[int, ...], *params) -> Any:
+        """返回结果表，未命中时计算并放入缓存"""
+        key = (counts,) + params
+        table = self._tables.get(key)
+        if table is not None:
+            self.hits += 1
+            self._tables.move_to_end(key)
+            return table
+
+        self.misses += 1
+        table = self.factory(counts, *params)
+        self._tables[key] = table
+        if len(self._tables) > self.maxsize:
+            self._tables.popitem(last=False)
+            self.evictions += 1
+        return table
+
+    def resize(self, maxsize: int):
+        """调整缓存大小，必要时立即淘汰"""
+        if maxsize <= 0:
+            raise ValueError(f"缓存大小必须为正数: {maxsize}")
+        self.maxsize = maxsize
+        while len(self._tables) > self.maxsize:
+            self._tables.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """清空缓存和统计"""
+        self._tables.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息，用于根据工作负载调整缓存大小"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._tables),
+            "maxsize": self.maxsize,
+            "outcomes": sum(len(table) for table in self._tables.values()),
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def __len__(self):
+        return len(self._tables)
+
+
+# 进程内共享的结果表缓存，键为(袋子组成, 摸球数, 内核)
+OUTCOME_CACHE = OutcomeTableCache()
+# 连续摸球/丢球段的结果表缓存，键为(袋子组成, 摸球数, 丢球数, 内核)
+SEGMENT_CACHE = OutcomeTableCache(factory=SegmentOutcomeTable)
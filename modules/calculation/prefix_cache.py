@@ -0,0 +1,182 @@
+"""
+前缀缓存：修改问题后增量重算
+
+compact引擎每完成一个操作就把前沿放入缓存，键是
+(袋子配置, operations[:i+1], 此时已移出的袋子, 影响前沿的计算选项) 的规范哈希。
+重新计算一个只改动了后面几个操作的问题时，从最长的已缓存前缀继续，
+耗时只与改动的部分成正比。
+
+已移出的袋子由整个操作序列决定（袋子在最后一次使用后移出），
+所以它是键的一部分：前缀相同但之后用法不同的问题不会误用缓存。
+
+缓存分两级：内存中的字典前沿按LRU保存在内存预算内，被淘汰的条目
+写入磁盘目录（格式与检查点相同），磁盘上的条目同样按LRU保存在磁盘预算内。
+"""
+import hashlib
+import json
+import os
+import sys
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .checkpoint import Checkpointer
+
+DEFAULT_MEMORY_BUDGET = 256 << 20
+DEFAULT_DISK_BUDGET = 1 << 30
+# 内存中字典前沿每个状态除状态元组外的估计开销（字节）
+_STATE_OVERHEAD_BYTES = 100
+
+
+def prefix_keys(bags_config: Dict[Any, Dict[str, int]], operations: List[Any],
+                retired_after: List[List[int]], **options) -> List[str]:
+    """
+    每个前缀的键，keys[i]对应完成operations[i]之后的前沿
+
+    参数:
+        retired_after: retired_after[i] 为完成第i个操作后已经移出状态的袋子位置
+        options: 影响前沿内容的计算选项
+    """
+    base = {
+        "bags": [[str(bag_id), sorted(color_counts.items())] for bag_id, color_counts in bags_config.items()],
+        "options": sorted(options.items()),
+    }
+    digest = hashlib.sha256(json.dumps(base, ensure_ascii=False, sort_keys=True, default=repr).encode("utf-8"))
+    keys = []
+    for operation, retired in zip(operations, retired_after):
+        # 增量哈希，避免每个前缀重新哈希整个序列
+        digest.update(json.dumps([str(operation.bag_id), operation.draw_count,
+                                  operation.operation_type]).encode("utf-8"))
+        key = digest.copy()
+        key.update(json.dumps(sorted(retired)).encode("utf-8"))
+        keys.append(key.hexdigest()[:32])
+    return keys
+
+
+class PrefixCache:
+    """
+    前沿的两级LRU缓存
+
+    参数:
+        directory: 磁盘缓存目录，None表示只使用内存
+        memory_budget: 内存中缓存的前沿允许占用的字节数（估计值）
+        disk_budget: 磁盘缓存允许占用的字节数
+    """
+
+    def __init__(self, directory: Optional[str] = None, memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                 disk_budget: int = DEFAULT_DISK_BUDGET):
+        if memory_budget < 0 or disk_budget < 0:
+            raise ValueError("缓存预算不能为负数")
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget if directory is not None else 0
+        # 键 -> (前沿, 状态宽度, 精确分数模式, 引擎累计量, 估计字节数)
+        self._memory: "OrderedDict[str, Tuple[Any, int, bool, Dict[str, Any], int]]" = OrderedDict()
+        self._memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _frontier_bytes(frontier, width: int) -> int:
+        return len(frontier) * (sys.getsizeof((0,) * width) + _STATE_OVERHEAD_BYTES)
+
+    def _checkpointer(self, key: str) -> Checkpointer:
+        return Checkpointer(self.directory, key)
+
+    def put(self, key: str, frontier, width: int, exact_arithmetic: bool, engine_state: Dict[str, Any]):
+        """放入完成某个前缀后的前沿；字典前沿进内存，溢出到磁盘的前沿直接写入磁盘缓存"""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        if isinstance(frontier, dict):
+            size = self._frontier_bytes(frontier, width)
+            if size <= self.memory_budget:
+                self._memory[key] = (frontier, width, exact_arithmetic, engine_state, size)
+                self._memory_bytes += size
+                self._evict_memory()
+                return
+        self._write_disk(key, frontier, width, exact_arithmetic, engine_state)
+
+    def get(self, key: str) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        """返回(前沿, 引擎累计量)；磁盘上的前沿以StoredFrontier流式读出"""
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[3]
+        if self.disk_budget > 0:
+            checkpointer = self._checkpointer(key)
+            restored = checkpointer.load()
+            if restored is not None:
+                os.utime(checkpointer.path)  # 更新访问时间，用于LRU淘汰
+                self.hits += 1
+                return restored[2], restored[1]
+        self.misses += 1
+        return None
+
+    def longest_prefix(self, keys: List[str]) -> Optional[Tuple[int, Any, Dict[str, Any]]]:
+        """从最长的前缀开始查找，返回(完成的操作编号, 前沿, 引擎累计量)"""
+        for index in range(len(keys) - 1, -1, -1):
+            if keys[index] in self._memory or (self.disk_budget > 0 and self._checkpointer(keys[index]).exists()):
+                found = self.get(keys[index])
+                if found is not None:
+                    return index, found[0], found[1]
+        self.misses += 1
+        return None
+
+    def _evict_memory(self):
+        """超出内存预算时淘汰最久未使用的条目，有磁盘缓存时降级写入磁盘"""
+        while self._memory_bytes > self.memory_budget and self._memory:
+            key, (frontier, width, exact_arithmetic, engine_state, size) = self._memory.popitem(last=False)
+            self._memory_bytes -= size
+            self.evictions += 1
+            self._write_disk(key, frontier, width, exact_arithmetic, engine_state)
+
+    def _write_disk(self, key: str, frontier, width: int, exact_arithmetic: bool, engine_state: Dict[str, Any]):
+        if self.disk_budget <= 0:
+            return
+        checkpointer = self._checkpointer(key)
+        if not checkpointer.exists():
+            checkpointer.save(-1, frontier, width, exact_arithmetic, engine_state)
+        self._evict_disk()
+
+    def _disk_entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        if self.directory is None or not os.path.isdir(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            if name.endswith(".ckpt"):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict_disk(self):
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.disk_budget:
+                break
+            os.remove(path)
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """清空内存和磁盘缓存"""
+        self._memory.clear()
+        self._memory_bytes = 0
+        for _, _, path in self._disk_entries():
+            os.remove(path)
+
+    def stats(self) -> Dict[str, Any]:
+        disk = self._disk_entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_entries": len(disk),
+            "disk_bytes": sum(size for _, size, _ in disk),
+        }
+
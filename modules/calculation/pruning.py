@@ -0,0 +1,128 @@
+"""
+前沿剪枝策略
+
+剪枝从不重新归一化：被丢弃状态的概率质量单独累计，作为结果的误差上界。
+报告的每个概率都不大于真实概率，且与真实概率的差不超过该上界。
+
+两种剪枝方式可以组合使用：
+- 概率阈值：每一步丢弃概率低于 min_probability 的状态
+- 前k个：前沿超过 max_states 时只保留概率最高的 keep 个状态，
+  用快速选择找到第k大的概率，不对整个前沿排序
+"""
+import math
+import random
+from fractions import Fraction
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+# 与原先固定剪枝阈值相同的默认值
+DEFAULT_MAX_STATES = 100000
+DEFAULT_KEEP = 50000
+
+T = TypeVar("T")
+
+# 快速选择的枢轴随机数，独立于全局random，不影响蒙特卡洛模拟的随机序列
+_PIVOT_RNG = random.Random(0)
+
+
+def kth_largest(values: List[Any], k: int) -> Any:
+    """快速选择：返回values中第k大的值（1 <= k <= len(values)），期望线性时间"""
+    if not 1 <= k <= len(values):
+        raise ValueError(f"k超出范围: {k}")
+    while True:
+        pivot = _PIVOT_RNG.choice(values)
+        above = [v for v in values if v > pivot]
+        if k <= len(above):
+            values = above
+            continue
+        equal = sum(1 for v in values if v == pivot)
+        if k <= len(above) + equal:
+            return pivot
+        k -= len(above) + equal
+        values = [v for v in values if v < pivot]
+
+
+class PruningPolicy:
+    """
+    剪枝策略
+
+    参数:
+        max_states: 前沿超过该状态数时按概率保留前keep个，None表示不按状态数剪枝
+        keep: 按状态数剪枝时保留的状态数
+        min_probability: 概率低于该值的状态在每一步都被丢弃，0表示不按阈值剪枝
+    """
+
+    def __init__(self, max_states: Optional[int] = DEFAULT_MAX_STATES, keep: int = DEFAULT_KEEP,
+                 min_probability: float = 0.0):
+        if keep <= 0:
+            raise ValueError(f"保留状态数必须为正数: {keep}")
+        if max_states is not None and max_states < keep:
+            raise ValueError(f"剪枝阈值({max_states})不能小于保留状态数({keep})")
+        if not 0.0 <= min_probability < 1.0:
+            raise ValueError(f"概率阈值必须在[0, 1)之间: {min_probability}")
+        self.max_states = max_states
+        self.keep = keep
+        self.min_probability = min_probability
+
+    @classmethod
+    def disabled(cls) -> "PruningPolicy":
+        """不做任何剪枝的策略"""
+        return cls(max_states=None)
+
+    def triggers(self, size: int) -> bool:
+        """当前规模的前沿是否需要剪枝"""
+        return self.min_probability > 0 or (self.max_states is not None and size > self.max_states)
+
+    def exceeds(self, size: int) -> bool:
+        """前沿是否超过了状态数上限"""
+        return self.max_states is not None and size > self.max_states
+
+    def select(self, items: List[T], weight: Callable[[T], Any], scale: Any = 1) -> Tuple[List[T], Any, int]:
+        """
+        按策略选择保留的状态
+
+        参数:
+            items: 前沿中的状态
+            weight: 取得状态概率（或公共分母上的分子）的函数
+            scale: 概率到weight的换算系数，精确分数模式下为公共分母
+
+        返回:
+            (保留的状态, 丢弃的weight总和, 丢弃的状态数)
+        """
+        weights = [weight(item) for item in items]
+        cutoff = None
+        if self.min_probability > 0:
+            if isinstance(scale, int) and scale != 1:
+                # 整数分子与阈值精确比较，避免大分母转换为浮点溢出
+                cutoff = math.ceil(Fraction(self.min_probability) * scale)
+            else:
+                cutoff = self.min_probability * scale
+
+        threshold = None
+        ties = 0
+        if self.max_states is not None:
+            candidates = weights if cutoff is None else [w for w in weights if w >= cutoff]
+            if len(candidates) > self.max_states:
+                threshold = kth_largest(candidates, self.keep)
+                # 与第k大的值相等的状态只保留到凑满keep个
+                ties = self.keep - sum(1 for w in candidates if w > threshold)
+
+        kept: List[T] = []
+        dropped = 0
+        for item, w in zip(items, weights):
+            if cutoff is not None and w < cutoff:
+                dropped += w
+            elif threshold is None or w > threshold:
+                kept.append(item)
+            elif w == threshold and ties > 0:
+                ties -= 1
+                kept.append(item)
+            else:
+                dropped += w
+        return kept, dropped, len(items) - len(kept)
+
+
+def format_error_bound(results: Dict[str, Any]) -> Optional[str]:
+    """剪枝误差上界的显示文本，没有丢弃概率质量时返回None"""
+    if results.get("error_bound", 0) > 0:
+        return f"✂️  剪枝误差上界: {results['error_bound']:.3e} (丢弃 {results.get('pruned_states', 0):,} 个状态)"
+    return None
@@ -0,0 +1,166 @@
+"""
+Rao-Blackwell化的蒙特卡洛估计
+
+最后一次放回之后的操作只有摸球和丢球，它们的结果分布可以精确计算
+（同一袋子上的连续摸球/丢球还可以合并为一次多元超几何分布，见segments.py）。
+这里只对前缀（到最后一次放回为止）做随机模拟，后缀用compact引擎精确展开：
+每次模拟不再贡献一个计数，而是按后缀的精确分布把小数权重分给各个最终状态。
+估计量是普通估计量对前缀状态的条件期望，无偏且方差不更大，后缀的随机性
+完全消除，同样的精度需要的模拟次数少得多。
+
+后缀只从后缀用到的袋子中取出球放入手中，结果只取决于这些袋子在前缀结束时
+的组成，因此按这些袋子的组成缓存后缀分布（以相对前缀状态的增量表示），
+不同的前缀状态共享同一份后缀计算。
+
+置信区间按每次模拟的小数权重的样本方差计算（正态近似）。
+"""
+import math
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .compact import CompactExactEngine
+from .pruning import PruningPolicy
+from .sampler import CountSampler, Tally
+
+
+def suffix_start(operations: List[Any]) -> int:
+    """最后一次放回之后第一个操作的下标（没有放回时为0，整个问题都精确计算）"""
+    for op_idx in range(len(operations) - 1, -1, -1):
+        if operations[op_idx].operation_type == "return":
+            return op_idx + 1
+    return 0
+
+
+class RaoBlackwellSampler:
+    """
+    前缀随机模拟、后缀精确计算的混合估计器
+
+    参数:
+        bags_config: 袋子配置
+        operations: 操作序列
+        prefix_sampler: 前缀采样器类（CountSampler或NumpyBatchSampler）
+        kernel: 后缀精确计算的超几何概率内核
+        sampler_options: 传给前缀采样器的其他参数
+    """
+
+    def __init__(self, bags_config: Dict[Any, Dict[str, int]], operations: List[Any],
+                 prefix_sampler=CountSampler, kernel: str = "auto", **sampler_options):
+        self.split = suffix_start(operations)
+        self.prefix = prefix_sampler(bags_config, operations[:self.split], **sampler_options)
+        self.layout = self.prefix.layout
+        self.engine = CompactExactEngine(bags_config, pruning=PruningPolicy.disabled(), kernel=kernel)
+        self.engine._size_log_factorials(operations)
+
+        # 后缀的操作，同一袋子上的连续摸球/丢球合并为一段；不存在的袋子上的操作被跳过
+        segments = self.engine._find_segments(operations, self.split)
+        self.suffix: List[Any] = []
+        self._suffix_columns: List[int] = []
+        op_idx = self.split
+        while op_idx < len(operations):
+            operation = segments.get(op_idx, operations[op_idx])
+            op_idx = operation.end + 1 if operation.operation_type == "segment" else op_idx + 1
+            pos = self.layout.bag_position(operation.bag_id) if operation.bag_id is not None else None
+            if pos is None or operation.operation_type not in ("draw", "discard", "segment"):
+                continue
+            self.suffix.append(operation)
+            offset = self.layout.bag_offset(pos)
+            self._suffix_columns.extend(range(offset, offset + self.layout.num_colors))
+        self._suffix_columns = sorted(set(self._suffix_columns))
+        # 后缀用到的袋子组成 -> [(状态增量, 概率)]，以及只看手的部分合并后的 [(手的增量, 概率)]
+        self._deltas: Dict[Tuple[int, ...], List[Tuple[Tuple[int, ...], float]]] = {}
+        self._hand_deltas: Dict[Tuple[int, ...], List[Tuple[Tuple[int, ...], float]]] = {}
+
+    def _suffix_key(self, state: Tuple[int, ...]) -> Tuple[int, ...]:
+        return tuple(state[column] for column in self._suffix_columns)
+
+    def suffix_deltas(self, state: Tuple[int, ...]) -> List[Tuple[Tuple[int, ...], float]]:
+        """从前缀状态state出发执行后缀后，最终状态相对state的增量及其精确概率"""
+        key = self._suffix_key(state)
+        deltas = self._deltas.get(key)
+        if deltas is None:
+            start = [0] * self.layout.width
+            for column, count in zip(self._suffix_columns, key):
+                start[column] = count
+            start = tuple(start)
+            frontier = {start: 1.0}
+            for operation in self.suffix:
+                frontier = self.engine.expand(frontier, operation)
+            deltas = [(tuple(a - b for a, b in zip(final, start)), prob) for final, prob in frontier.items()]
+            self._deltas[key] = deltas
+        return deltas
+
+    def suffix_hand_deltas(self, state: Tuple[int, ...]) -> List[Tuple[Tuple[int, ...], float]]:
+        """执行后缀后手的增量及其精确概率"""
+        key = self._suffix_key(state)
+        hand_deltas = self._hand_deltas.get(key)
+        if hand_deltas is None:
+            merged = defaultdict(float)
+            num_colors = self.layout.num_colors
+            for delta, prob in self.suffix_deltas(state):
+                merged[delta[:num_colors]] += prob
+            hand_deltas = list(merged.items())
+            self._hand_deltas[key] = hand_deltas
+        return hand_deltas
+
+    def run(self, num_simulations: int, rng=None, workers: int = 1, seed: Optional[int] = None,
+            progress_callback: Optional[Callable[[int, int], None]] = None) -> Tuple[Counter, Tally]:
+        """
+        模拟前缀并精确展开后缀
+
+        返回:
+            (前缀状态计数, {最终状态: 小数权重之和})，权重之和等于模拟次数
+        """
+        if self.split == 0:
+            # 没有放回，前缀为空，所有模拟都从初始状态开始
+            prefix_tally = Counter({self.prefix.initial_state: num_simulations})
+            if progress_callback:
+                progress_callback(num_simulations, num_simulations)
+        elif workers > 1 or seed is not None:
+            prefix_tally = self.prefix.run_parallel(num_simulations, workers=workers, seed=seed,
+                                                    progress_callback=progress_callback)
+        else:
+            prefix_tally = self.prefix.run(num_simulations, rng=rng, progress_callback=progress_callback)
+
+        tally: Tally = defaultdict(float)
+        for state, count in prefix_tally.items():
+            for delta, prob in self.suffix_deltas(state):
+                tally[tuple(a + b for a, b in zip(state, delta))] += count * prob
+        return prefix_tally, tally
+
+    def hand_intervals(self, prefix_tally: Counter, num_simulations: int, z: float) -> Dict[str, Dict[str, float]]:
+        """
+        每种手牌结果的置信区间
+
+        每次模拟对手牌结果h贡献P(h | 前缀状态)，估计值是这些贡献的均值，
+        标准误由贡献的样本方差得到，区间为估计值 ± z × 标准误（截断到[0, 1]）。
+        """
+        num_colors = self.layout.num_colors
+        first_moment = defaultdict(float)
+        second_moment = defaultdict(float)
+        for state, count in prefix_tally.items():
+            hand = state[:num_colors]
+            for hand_delta, prob in self.suffix_hand_deltas(state):
+                final_hand = tuple(a + b for a, b in zip(hand, hand_delta))
+                first_moment[final_hand] += count * prob
+                second_moment[final_hand] += count * prob * prob
+
+        intervals = {}
+        for final_hand, total in first_moment.items():
+            hand = self.layout.describe_hand(final_hand)
+            estimate = total / num_simulations
+            variance = 0.0
+            if num_simulations > 1:
+                variance = max(0.0, (second_moment[final_hand] - num_simulations * estimate * estimate)
+                               / (num_simulations - 1))
+            std_error = math.sqrt(variance / num_simulations)
+            intervals[hand] = {
+                "estimate": estimate,
+                "std_error": std_error,
+                "low": max(0.0, estimate - z * std_error),
+                "high": min(1.0, estimate + z * std_error),
+                "half_width": z * std_error,
+            }
+        return intervals
+
+    def aggregate(self, tally: Tally, num_simulations: int) -> Dict[str, Any]:
+        return self.prefix.aggregate(tally, num_simulations)
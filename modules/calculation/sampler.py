@@ -0,0 +1,311 @@
+"""
+计数空间的蒙特卡洛采样器
+
+模拟状态与compact引擎相同：一个定长整数列表，前C个元素是手中各颜色的
+球数，之后每C个元素依次对应一个袋子。摸球/丢球不再把袋子展开成每个球
+一个元素的列表，而是逐个球在颜色计数上做累计计数查找：在[0, 袋中球数)
+中取一个随机数，沿颜色计数减去直到落入某个颜色。这等价于不放回地均匀
+摸球（依次的条件超几何抽样），每个操作的耗时是O(颜色数 × 摸球数)，
+与袋中球数无关。放回操作同样在手的计数上查找被放回的球。
+
+每次模拟的最终状态元组直接计数，最后一次性格式化为"2R+1Y"形式的
+手牌和袋子分布，与精确计算的结果格式一致。
+
+并行模式下模拟次数平均分给各工作进程，每个进程使用由同一个种子派生的
+独立随机流，各进程的计数按进程顺序合并。相同的种子和进程数得到逐位相同的结果。
+
+精度目标模式下按块模拟，每块之后计算每种手牌结果的Wilson置信区间，
+所有关心的结果的区间半宽都达到目标时停止。
+"""
+import hashlib
+import math
+import random
+import secrets
+from statistics import NormalDist
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from .compact import StateLayout
+
+# {最终状态元组: 权重}
+Tally = Dict[Tuple[int, ...], Union[int, float]]
+
+
+class CountSampler:
+    """
+    在颜色计数上采样的蒙特卡洛模拟器
+
+    参数:
+        bags_config: 袋子配置
+        operations: 操作序列；不存在的袋子上的摸球/丢球和球数不足的摸球/丢球被跳过，
+                    放回到不存在的袋子时球从手中移除但不进入任何袋子
+    """
+
+    # 精度目标模式下每块的模拟数
+    ADAPTIVE_BLOCK_SIZE = 10000
+
+    def __init__(self, bags_config: Dict[Any, Dict[str, int]], operations: List[Any]):
+        self.layout = StateLayout(bags_config)
+        self.initial_state = self.layout.initial_state(bags_config)
+        layout = self.layout
+        num_colors = layout.num_colors
+        # 每个袋子可能含有的颜色：初始颜色，被放回过球的袋子可能含有任何颜色
+        returned_to = {layout.bag_position(op.bag_id) for op in operations
+                       if op.operation_type == "return" and op.bag_id is not None}
+        # (操作类型, 袋子计数起始下标或None, 摸球数, 袋子可能含有的颜色在状态中的下标)
+        self.steps: List[Tuple[str, Optional[int], int, Tuple[int, ...]]] = []
+        for operation in operations:
+            if operation.operation_type not in ("draw", "discard", "return"):
+                continue
+            pos = layout.bag_position(operation.bag_id) if operation.bag_id is not None else None
+            if pos is None:
+                self.steps.append((operation.operation_type, None, operation.draw_count, ()))
+                continue
+            offset = layout.bag_offset(pos)
+            if pos in returned_to:
+                colors = range(num_colors)
+            else:
+                colors = sorted(layout.color_index.index(color)
+                                for color, count in bags_config[layout.bag_ids[pos]].items() if count > 0)
+            self.steps.append((operation.operation_type, offset, operation.draw_count,
+                               tuple(offset + color for color in colors)))
+        self._num_colors = num_colors
+
+    def simulate(self, rng=random) -> Tuple[int, ...]:
+        """执行一次模拟，返回最终状态元组"""
+        return self._simulate_steps(list(self.initial_state), self.steps, rng)
+
+    def _simulate_steps(self, state: List[int], steps, rng) -> Tuple[int, ...]:
+        num_colors = self._num_colors
+        uniform = rng.random
+        hand_total = sum(state[:num_colors])
+        for operation_type, offset, count, indices in steps:
+            if operation_type == "return":
+                if hand_total == 0:
+                    continue
+                # 在手的计数上查找被放回的球（random() < 1，r总小于球数）
+                r = int(uniform() * hand_total)
+                color = 0
+                while r >= state[color]:
+                    r -= state[color]
+                    color += 1
+                state[color] -= 1
+                hand_total -= 1
+                if offset is not None:
+                    state[offset + color] += 1
+                continue
+
+            if offset is None:
+                continue
+            total = sum(state[offset:offset + num_colors])
+            if total < count:
+                continue  # 球不够，跳过
+            to_hand = operation_type == "draw"
+            for _ in range(count):
+                # 累计计数查找：第r个球所在的颜色
+                r = int(uniform() * total)
+                for idx in indices:
+                    if r < state[idx]:
+                        break
+                    r -= state[idx]
+                state[idx] -= 1
+                total -= 1
+                if to_hand:
+                    state[idx - offset] += 1
+            if to_hand:
+                hand_total += count
+        return tuple(state)
+
+    def spawn_seeds(self, seed: Optional[int], count: int) -> List[int]:
+        """由一个种子派生count个互相独立的随机流种子（种子为None时使用系统熵）"""
+        if seed is None:
+            seed = secrets.randbits(128)
+        return [int.from_bytes(hashlib.sha256(f"{seed}:{index}".encode("ascii")).digest()[:16], "big")
+                for index in range(count)]
+
+    def make_rng(self, stream_seed):
+        """由派生的种子创建该采样器使用的随机数生成器"""
+        return random.Random(stream_seed)
+
+    def default_rng(self):
+        """未指定随机数生成器时使用全局random模块"""
+        return random
+
+    def run(self, num_simulations: int, rng=None,
+            progress_callback: Optional[Callable[[int, int], None]] = None) -> Counter:
+        """
+        执行num_simulations次模拟，返回{最终状态元组: 次数}
+
+        参数:
+            rng: 随机数生成器（random.Random或random模块），默认使用全局random模块
+            progress_callback: 进度回调函数，接收(current, total)参数
+        """
+        rng = rng if rng is not None else self.default_rng()
+        tally: Counter = Counter()
+        progress_step = max(1, num_simulations // 20)
+        initial_state = self.initial_state
+        steps = self.steps
+        simulate = self._simulate_steps
+        done = 0
+        while done < num_simulations:
+            block = min(progress_step, num_simulations - done)
+            for _ in range(block):
+                tally[simulate(list(initial_state), steps, rng)] += 1
+            done += block
+            if progress_callback:
+                progress_callback(done, num_simulations)
+            else:
+                print(f"  进度: {done / num_simulations * 100:.1f}%", end='\r')
+        return tally
+
+    def run_parallel(self, num_simulations: int, workers: int = 1, seed: Optional[int] = None,
+                     progress_callback: Optional[Callable[[int, int], None]] = None) -> Counter:
+        """
+        把模拟次数分给workers个工作进程，各进程使用由seed派生的独立随机流
+
+        workers为1时在当前进程中执行，与单个工作进程的结果相同。
+        """
+        if workers < 1:
+            raise ValueError(f"工作进程数必须为正数: {workers}")
+        seeds = self.spawn_seeds(seed, workers)
+        shares = [num_simulations // workers + (1 if index < num_simulations % workers else 0)
+                  for index in range(workers)]
+        if workers == 1:
+            return self.run(num_simulations, rng=self.make_rng(seeds[0]), progress_callback=progress_callback)
+
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_run_share, self, share, stream_seed): index
+                       for index, (share, stream_seed) in enumerate(zip(shares, seeds)) if share > 0}
+            tallies: Dict[int, Counter] = {}
+            done = 0
+            for future in as_completed(futures):
+                index = futures[future]
+                tallies[index] = future.result()
+                done += shares[index]
+                if progress_callback:
+                    progress_callback(done, num_simulations)
+                else:
+                    print(f"  进度: {done / num_simulations * 100:.1f}%", end='\r')
+        # 按进程顺序合并，结果与完成顺序无关
+        tally: Counter = Counter()
+        for index in sorted(tallies):
+            tally.update(tallies[index])
+        return tally
+
+    def run_adaptive(self, target_half_width: float, confidence: float = 0.95,
+                     hands: Optional[List[str]] = None, probability_floor: float = 0.01,
+                     block_size: Optional[int] = None, max_simulations: int = 10_000_000, rng=None,
+                     workers: int = 1, seed: Optional[int] = None,
+                     progress_callback: Optional[Callable[[int, int], None]] = None) -> Tuple[Counter, bool]:
+        """
+        按块模拟，直到关心的手牌结果的置信区间半宽都不超过target_half_width
+
+        参数:
+            hands: 关心的手牌结果（如"2R+1Y"），默认为估计概率不低于probability_floor的所有结果
+            block_size: 每块的模拟次数，默认ADAPTIVE_BLOCK_SIZE
+            max_simulations: 模拟次数上限，达到上限时即使未达到精度也停止
+            workers, seed: 同run_parallel；指定seed或并行时第i块使用由seed派生的种子
+
+        返回:
+            (状态计数, 是否达到精度目标)
+        """
+        if target_half_width <= 0:
+            raise ValueError(f"目标区间半宽必须为正数: {target_half_width}")
+        if not 0 < confidence < 1:
+            raise ValueError(f"置信水平必须在0和1之间: {confidence}")
+        block_size = block_size or self.ADAPTIVE_BLOCK_SIZE
+        if block_size < 1 or max_simulations < 1:
+            raise ValueError("每块模拟次数和模拟次数上限必须为正数")
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        seeded = workers > 1 or seed is not None
+        if not seeded and rng is None:
+            rng = self.default_rng()
+        tally: Counter = Counter()
+        done = 0
+        block_index = 0
+        while done < max_simulations:
+            block = min(block_size, max_simulations - done)
+            if seeded:
+                block_seed = None if seed is None else self.spawn_seeds(seed, block_index + 1)[block_index]
+                tally.update(self.run_parallel(block, workers=workers, seed=block_seed,
+                                               progress_callback=_no_progress))
+            else:
+                tally.update(self.run(block, rng=rng, progress_callback=_no_progress))
+            done += block
+            block_index += 1
+            if progress_callback:
+                progress_callback(done, max_simulations)
+            else:
+                print(f"  已模拟 {done:,} 次", end='\r')
+
+            intervals = self.hand_intervals(tally, done, z)
+            if hands is not None:
+                watched = [intervals.get(hand) or wilson_interval(0, done, z) for hand in hands]
+            else:
+                watched = [interval for interval in intervals.values() if interval["estimate"] >= probability_floor]
+            if watched and all(interval["half_width"] <= target_half_width for interval in watched):
+                return tally, True
+        return tally, False
+
+    def hand_intervals(self, tally: Tally, num_simulations: int, z: float) -> Dict[str, Dict[str, float]]:
+        """每种手牌结果的Wilson置信区间"""
+        hand_counts = defaultdict(int)
+        for state, count in tally.items():
+            hand_counts[self.layout.describe_hand(state)] += count
+        return {hand: wilson_interval(count, num_simulations, z) for hand, count in hand_counts.items()}
+
+    def aggregate(self, tally: Tally, num_simulations: int) -> Dict[str, Any]:
+        """把状态计数汇总为与精确计算相同格式的手牌分布和袋子分布"""
+        layout = self.layout
+        total_weight = sum(tally.values())
+        hand_totals = defaultdict(int)
+        bag_totals = [defaultdict(int) for _ in layout.bag_ids]
+        for state, weight in tally.items():
+            hand_totals[layout.describe_hand(state)] += weight
+            for pos, totals in enumerate(bag_totals):
+                totals[layout.describe_bag(state, pos)] += weight
+
+        hand_distribution = {hand: weight / total_weight for hand, weight in hand_totals.items()}
+        bag_distributions = {}
+        for pos, bag_id in enumerate(layout.bag_ids):
+            distribution = {bag: weight / total_weight for bag, weight in bag_totals[pos].items() if weight > 0}
+            if distribution:
+                bag_distributions[bag_id] = distribution
+        return {
+            "total_states": len(hand_distribution),
+            "total_probability": sum(hand_distribution.values()),
+            "hand_distribution": hand_distribution,
+            "bag_distributions": bag_distributions,
+            "simulations": num_simulations,
+            "calculation_method": "monte_carlo"
+        }
+
+
+def wilson_interval(successes: int, trials: int, z: float) -> Dict[str, float]:
+    """
+    二项比例的Wilson得分区间
+
+    返回:
+        estimate为样本比例，std_error为其标准误，low/high为区间端点，half_width为区间半宽
+    """
+    p = successes / trials
+    z2 = z * z
+    center = (p + z2 / (2 * trials)) / (1 + z2 / trials)
+    half_width = z * math.sqrt(p * (1 - p) / trials + z2 / (4 * trials * trials)) / (1 + z2 / trials)
+    return {
+        "estimate": p,
+        "std_error": math.sqrt(p * (1 - p) / trials),
+        "low": max(0.0, center - half_width),
+        "high": min(1.0, center + half_width),
+        "half_width": half_width,
+    }
+
+
+def _no_progress(current: int, total: int):
+    pass
+
+
+def _run_share(sampler: CountSampler, num_simulations: int, stream_seed) -> Counter:
+    """工作进程：用派生的随机流执行自己的一份模拟"""
+    return sampler.run(num_simulations, rng=sampler.make_rng(stream_seed), progress_callback=_no_progress)
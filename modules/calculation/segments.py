@@ -0,0 +1,88 @@
+"""
+单袋连续摸球段
+
+同一袋子上连续的摸球和丢球（中间没有放回）等价于一次多元超几何分布：
+摸出和丢掉的球不分先后，只有摸到手中和丢掉的总数有关。这样的一段
+在compact引擎中作为一个整体展开，用SegmentOutcomeTable一次算出所有结果，
+不再逐个操作展开并合并中间前沿。
+
+每个袋子的球数只取决于操作序列，球数不足而不会发生的摸球/丢球
+可以静态判断并从段中去掉。
+"""
+from typing import TYPE_CHECKING, Any, Dict, List
+
+if TYPE_CHECKING:
+    from .compact import StateLayout
+
+
+class DrawSegment:
+    """
+    作为一个整体展开的连续摸球/丢球段
+
+    start和end为段中第一个和最后一个操作的下标（含），
+    draw_count和discard_count为段中实际发生的摸球数和丢球数之和。
+    """
+    operation_type = "segment"
+
+    def __init__(self, bag_id: Any, draw_count: int, discard_count: int, start: int, end: int,
+                 operations: List[Any]):
+        self.bag_id = bag_id
+        self.draw_count = draw_count
+        self.discard_count = discard_count
+        self.start = start
+        self.end = end
+        self.operations = operations
+
+    def __repr__(self):
+        return " + ".join(repr(operation) for operation in self.operations)
+
+
+def find_draw_segments(bags_config: Dict[Any, Dict[str, int]], operations: List[Any],
+                       layout: "StateLayout", start: int = 0) -> Dict[int, DrawSegment]:
+    """
+    找出所有包含至少两个实际发生的操作的单袋连续摸球段
+
+    参数:
+        start: 只在该下标及之后寻找（从检查点或缓存继续时段不能跨过起点）
+
+    返回:
+        {段的起始下标: DrawSegment}
+    """
+    totals = [sum(bags_config[bag_id].values()) for bag_id in layout.bag_ids]
+    hand_size = 0
+    segments: Dict[int, DrawSegment] = {}
+    current = None  # [袋子位置, 起始下标, 摸球数, 丢球数, 实际发生的操作数]
+
+    def close(end: int):
+        if current is not None and current[4] >= 2:
+            pos, first, drawn, discarded, _ = current
+            segments[first] = DrawSegment(layout.bag_ids[pos], drawn, discarded, first, end,
+                                          operations[first:end + 1])
+
+    for op_idx, operation in enumerate(operations):
+        pos = layout.bag_position(operation.bag_id)
+        if operation.operation_type in ("draw", "discard") and pos is not None:
+            occurs = operation.draw_count <= totals[pos]
+            if occurs:
+                totals[pos] -= operation.draw_count
+                if operation.operation_type == "draw":
+                    hand_size += operation.draw_count
+            if op_idx < start:
+                continue
+            if current is None or current[0] != pos:
+                close(op_idx - 1)
+                current = [pos, op_idx, 0, 0, 0]
+            if occurs:
+                current[2 if operation.operation_type == "draw" else 3] += operation.draw_count
+                current[4] += 1
+            continue
+
+        if operation.operation_type == "return" and hand_size > 0:
+            hand_size -= 1
+            if pos is not None:
+                totals[pos] += 1
+        if op_idx >= start:
+            close(op_idx - 1)
+            current = None
+    close(len(operations) - 1)
+    return segments
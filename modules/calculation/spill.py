@@ -0,0 +1,253 @@
+"""
+按内存预算把前沿溢出到磁盘
+
+前沿超过内存预算时，状态按哈希分区写入本地磁盘上的定长数组文件：
+每个分区一个状态文件（int32，每行为一个定长状态）和一个概率文件（float64）。
+下一步逐个分区通过mmap读回、展开，子状态再按哈希写入新的分区，
+最后逐个分区合并相同状态。同一个状态总是落在同一个分区，因此分区内
+合并就是全局合并，结果与内存中计算完全相同，只是内存占用受预算限制。
+
+合并后的前沿重新放得进预算时会自动回到内存中的字典。
+"""
+import math
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import weakref
+from array import array
+from itertools import islice
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+# 内存中字典前沿每个条目除状态元组外的估计开销（浮点概率对象、字典槽位等）
+_DICT_ENTRY_OVERHEAD = 100
+# 每个分区写缓冲的记录数上下限，所有分区的写缓冲合计不超过内存预算
+_MIN_FLUSH_RECORDS = 256
+_MAX_FLUSH_RECORDS = 65536
+# 分区数上限，避免产生过多小文件
+MAX_PARTITIONS = 4096
+
+Frontier = Dict[Tuple[int, ...], float]
+
+
+class SpillPartition:
+    """磁盘上的一个分区：状态文件、概率文件和记录数"""
+    __slots__ = ("states_path", "probs_path", "count")
+
+    def __init__(self, states_path: str, probs_path: str, count: int):
+        self.states_path = states_path
+        self.probs_path = probs_path
+        self.count = count
+
+    def items(self, width: int) -> Iterator[Tuple[Tuple[int, ...], float]]:
+        """通过mmap逐条读出(状态, 概率)"""
+        if self.count == 0:
+            return
+        with open(self.states_path, "rb") as states_file, open(self.probs_path, "rb") as probs_file:
+            with mmap.mmap(states_file.fileno(), 0, access=mmap.ACCESS_READ) as states_map, \
+                    mmap.mmap(probs_file.fileno(), 0, access=mmap.ACCESS_READ) as probs_map:
+                states = memoryview(states_map).cast("i")
+                probs = memoryview(probs_map).cast("d")
+                try:
+                    for row in range(self.count):
+                        yield tuple(states[row * width:(row + 1) * width]), probs[row]
+                finally:
+                    states.release()
+                    probs.release()
+
+    def load(self, width: int) -> Frontier:
+        """读入整个分区并合并相同状态"""
+        merged: Frontier = {}
+        get = merged.get
+        for state, prob in self.items(width):
+            merged[state] = get(state, 0.0) + prob
+        return merged
+
+    def remove(self):
+        for path in (self.states_path, self.probs_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class SpilledFrontier:
+    """溢出到磁盘的前沿，各分区之间没有重复状态"""
+
+    def __init__(self, width: int, directory: str, partitions: List[SpillPartition]):
+        self.width = width
+        self.directory = directory
+        self.partitions = partitions
+
+    def __len__(self):
+        return sum(partition.count for partition in self.partitions)
+
+    def items(self) -> Iterator[Tuple[Tuple[int, ...], float]]:
+        for partition in self.partitions:
+            yield from partition.items(self.width)
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class _PartitionWriter:
+    """按状态哈希把记录分发到分区文件，写缓冲满时追加写入"""
+
+    def __init__(self, directory: str, width: int, num_partitions: int, flush_records: int):
+        self.width = width
+        self.num_partitions = num_partitions
+        self.flush_records = flush_records
+        self.partitions = [
+            SpillPartition(os.path.join(directory, f"part{k}.states"), os.path.join(directory, f"part{k}.probs"), 0)
+            for k in range(num_partitions)
+        ]
+        self._states = [array("i") for _ in range(num_partitions)]
+        self._probs = [array("d") for _ in range(num_partitions)]
+
+    def add_all(self, frontier: Frontier):
+        num_partitions = self.num_partitions
+        flush_records = self.flush_records
+        for state, prob in frontier.items():
+            k = hash(state) % num_partitions
+            self._states[k].extend(state)
+            probs = self._probs[k]
+            probs.append(prob)
+            if len(probs) >= flush_records:
+                self._flush(k)
+
+    def _flush(self, k: int):
+        partition = self.partitions[k]
+        if not self._probs[k]:
+            return
+        with open(partition.states_path, "ab") as f:
+            self._states[k].tofile(f)
+        with open(partition.probs_path, "ab") as f:
+            self._probs[k].tofile(f)
+        partition.count += len(self._probs[k])
+        self._states[k] = array("i")
+        self._probs[k] = array("d")
+
+    def close(self) -> List[SpillPartition]:
+        for k in range(self.num_partitions):
+            self._flush(k)
+        return self.partitions
+
+
+class FrontierSpiller:
+    """
+    按内存预算展开前沿，超过预算时使用磁盘分区
+
+    参数:
+        width: 状态元组的长度
+        memory_budget: 前沿在内存中允许占用的字节数（估计值）
+        directory: 溢出文件所在的目录，不存在时自动创建，默认使用系统临时目录
+    """
+
+    def __init__(self, width: int, memory_budget: int, directory: Optional[str] = None):
+        if memory_budget <= 0:
+            raise ValueError(f"内存预算必须为正数: {memory_budget}")
+        self.width = width
+        self.memory_budget = memory_budget
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix="frontier_spill_", dir=directory)
+        self.state_bytes = sys.getsizeof((0,) * width) + _DICT_ENTRY_OVERHEAD
+        self.spilled_steps = 0
+        self.peak_spilled_states = 0
+        self._step = 0
+        # 对象被回收或进程退出时删除溢出目录
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.directory, True)
+
+    def fits(self, num_states: int) -> bool:
+        """该数量的状态能否放进内存预算"""
+        return num_states * self.state_bytes <= self.memory_budget
+
+    def map(self, frontier: Union[Frontier, SpilledFrontier], step: Callable[[Frontier], Frontier],
+            fanout: int) -> Union[Frontier, SpilledFrontier]:
+        """
+        对前沿执行一步变换
+
+        参数:
+            frontier: 内存中的字典前沿或溢出的前沿
+            step: 对一部分状态执行变换的函数，返回合并后的子状态字典
+            fanout: 每个状态最多产生的子状态数，用于决定分区数
+
+        返回:
+            能放进预算时返回字典，否则返回溢出的前沿
+        """
+        bound = len(frontier) * fanout
+        if isinstance(frontier, dict) and self.fits(bound):
+            return step(frontier)
+
+        self._step += 1
+        self.spilled_steps += 1
+        num_partitions = min(MAX_PARTITIONS, max(2, math.ceil(bound * self.state_bytes / self.memory_budget)))
+        step_dir = os.path.join(self.directory, f"step{self._step}")
+        os.makedirs(step_dir)
+        record_bytes = 4 * self.width + 8
+        flush_records = self.memory_budget // (num_partitions * record_bytes)
+        flush_records = min(_MAX_FLUSH_RECORDS, max(_MIN_FLUSH_RECORDS, flush_records))
+        writer = _PartitionWriter(step_dir, self.width, num_partitions, flush_records)
+
+        # 每次只展开预算允许的状态数
+        chunk_size = max(1, self.memory_budget // (self.state_bytes * fanout))
+        for chunk in self._chunks(frontier, chunk_size):
+            writer.add_all(step(chunk))
+        if isinstance(frontier, SpilledFrontier):
+            frontier.remove()
+        return self._merge(writer.close(), step_dir)
+
+    @staticmethod
+    def _chunks(frontier: Union[Frontier, SpilledFrontier], chunk_size: int) -> Iterator[Frontier]:
+        # 溢出前沿的分区之间没有重复状态，可以直接按顺序分块
+        items = iter(frontier.items())
+        while True:
+            chunk = dict(islice(items, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+    def _merge(self, partitions: List[SpillPartition], step_dir: str) -> Union[Frontier, SpilledFrontier]:
+        """逐个分区合并相同状态；总数放得进预算时回到内存"""
+        held: List[Frontier] = []
+        held_count = 0
+        merged_partitions: List[SpillPartition] = []
+        for partition in partitions:
+            merged = partition.load(self.width)
+            partition.remove()
+            if not merged_partitions and self.fits(held_count + len(merged)):
+                held.append(merged)
+                held_count += len(merged)
+                continue
+            for frontier in held:
+                merged_partitions.append(self._write(frontier, step_dir, len(merged_partitions)))
+            held.clear()
+            merged_partitions.append(self._write(merged, step_dir, len(merged_partitions)))
+
+        if merged_partitions:
+            total = sum(partition.count for partition in merged_partitions)
+            self.peak_spilled_states = max(self.peak_spilled_states, total)
+            return SpilledFrontier(self.width, step_dir, merged_partitions)
+        shutil.rmtree(step_dir, ignore_errors=True)
+        frontier: Frontier = {}
+        for part in held:
+            frontier.update(part)
+        return frontier
+
+    def _write(self, frontier: Frontier, step_dir: str, index: int) -> SpillPartition:
+        """把合并后的分区写入本步的目录"""
+        states = array("i")
+        probs = array("d")
+        for state, prob in frontier.items():
+            states.extend(state)
+            probs.append(prob)
+        partition = SpillPartition(os.path.join(step_dir, f"merged{index}.states"),
+                                   os.path.join(step_dir, f"merged{index}.probs"), len(probs))
+        with open(partition.states_path, "wb") as f:
+            states.tofile(f)
+        with open(partition.probs_path, "wb") as f:
+            probs.tofile(f)
+        return partition
+
+    def cleanup(self):
+        """删除所有溢出文件"""
+        self._finalizer()
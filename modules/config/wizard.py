@@ -520,6 +520,8 @@ class ConfigWizard:
         
         print(f"📊 总状态数: {total_states:,}")
         print(f"✅ 总概率: {total_prob:.8f}")
+        from ui.display import display_error_bound
+        display_error_bound(results)
         
         if 'simulations' in results:
             print(f"🎲 模拟次数: {results['simulations']:,}")
@@ -56,6 +56,14 @@ def display_simulation_progress(current: int, total: int):
         
         if current == total:
             print()  # 换行
+
+def display_error_bound(results: Dict):
+    """剪枝丢弃了概率质量时显示误差上界"""
+    from calculation.pruning import format_error_bound
+    line = format_error_bound(results)
+    if line:
+        print(line)
+
 def display_results(results: Dict, is_monte_carlo: bool = False):
     """显示计算结果"""
     print("\n" + "=" * 60)
@@ -67,9 +75,13 @@ def display_results(results: Dict, is_monte_carlo: bool = False):
     
     print(f"📊 总状态数: {total_states:,}")
     print(f"✅ 总概率: {total_prob:.8f}")
+    display_error_bound(results)
     
     if is_monte_carlo:
         print(f"🎲 模拟方法: Monte Carlo ({results.get('simulations', 0):,}次)")
+        if 'target_half_width' in results:
+            status = "已达到" if results.get('converged') else "未达到"
+            print(f"🎯 精度目标: 置信区间半宽 ≤ {results['target_half_width']} ({status})")
     else:
         print(f"🧮 计算方法: 精确计算")
     
@@ -79,10 +91,12 @@ def display_results(results: Dict, is_monte_carlo: bool = False):
     distribution = results.get('hand_distribution', {})
     sorted_items = sorted(distribution.items(), key=lambda x: x[1], reverse=True)
     
-    # 显示前15种情况
+    # 显示前15种情况（蒙特卡洛结果附带置信区间半宽）
+    intervals = results.get('confidence_intervals', {})
     for i, (hand_desc, prob) in enumerate(sorted_items[:15]):
         percentage = prob * 100
-        print(f"{i+1:2d}. {hand_desc:20s}: {prob:.6f} ({percentage:.2f}%)")
+        margin = f" ±{intervals[hand_desc]['half_width']:.6f}" if hand_desc in intervals else ""
+        print(f"{i+1:2d}. {hand_desc:20s}: {prob:.6f} ({percentage:.2f}%){margin}")
     
     print("-" * 60)
     
@@ -176,6 +190,18 @@ def display_problem_summary(description: str, config: Dict, operations: List):
         action = {"draw": "摸", "discard": "丢", "return": "还"}[op.operation_type]
         print(f"  {i}. {action}袋{op.bag_id} {op.draw_count}个球")
 
+def display_estimate(estimate):
+    """显示状态空间规模预估（estimator.StateSpaceEstimate）"""
+    print("\n🔮 状态空间预估（上界）:")
+    print("-" * 60)
+    for i, step in enumerate(estimate.steps, 1):
+        print(f"  {i:2d}. {step.operation!r:12s} 结果数 {step.outcomes:>8,}  "
+              f"前沿 {step.states:>12,}  内存 {step.memory_bytes / 2**20:>10.1f} MB")
+    print("-" * 60)
+    print(f"  峰值状态数: {estimate.peak_states:,}")
+    print(f"  峰值内存: {estimate.peak_memory_bytes / 2**20:.1f} MB")
+    print(f"  预计耗时: {estimate.exact_seconds():.1f} 秒")
+
 def display_error(message: str, details: str = ""):
     """显示错误信息"""
     print(f"\n❌ 错误: {message}")
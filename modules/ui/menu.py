@@ -11,6 +11,7 @@ from typing import Dict, List, Optional
 FileManager = None  # 默认值，以防导入失败
 try:
     from calculation.core import ProbabilityCalculator, BallDrawOperation
+    from calculation.prefix_cache import PrefixCache
     from config.examples import load_problem_config, EXAMPLE_PROBLEMS, create_custom_config
     from utils.file_manager import FileManager
 except ImportError as e:
@@ -22,6 +23,11 @@ except ImportError as e:
         'clean_old_results': lambda *args, **kwargs: 0
     })
 
+# 精确计算检查点目录
+CHECKPOINT_DIR = "checkpoints"
+# 前缀缓存目录，修改问题后重新计算时复用未改动的前缀
+PREFIX_CACHE_DIR = "prefix_cache"
+
 class MenuController:
     """菜单控制器"""
     
@@ -31,6 +37,7 @@ class MenuController:
         self.current_config = None
         self.current_operations = None
         self.current_description = ""
+        self.prefix_cache = None  # 用户选择启用后才创建
         
     def handle_choice(self, choice: str):
         """处理菜单选择"""
@@ -49,6 +56,8 @@ class MenuController:
                 self.load_configuration()
             elif choice == '7':
                 self.clean_results_files()
+            elif choice == '8':
+                self.run_auto_calculation()
             else:
                 print("❌ 无效选择，请重试。")
         except Exception as e:
@@ -131,17 +140,35 @@ class MenuController:
         print("\n🔢 开始精确计算...")
         self._display_current_problem_summary()
         
+        from calculation.estimator import estimate_state_space
+        from ui.display import display_estimate
+        display_estimate(estimate_state_space(self.current_config, self.current_operations))
+        
         confirm = input("\n确定开始精确计算？这可能消耗大量计算资源 (y/N): ").strip().lower()
         if confirm != 'y':
             print("取消计算")
             return
         
+        # 检查点和前缀缓存写在当前目录下，默认关闭
+        use_checkpoint = input(f"每个操作完成后写检查点到 {CHECKPOINT_DIR}/，中断后可继续？(y/N): ").strip().lower() == 'y'
+        if input(f"缓存操作前缀到 {PREFIX_CACHE_DIR}/，修改问题后重新计算时复用？(y/N): ").strip().lower() == 'y':
+            if self.prefix_cache is None:
+                self.prefix_cache = PrefixCache(directory=PREFIX_CACHE_DIR)
+            prefix_cache = self.prefix_cache
+        else:
+            prefix_cache = None
+        
         try:
             from ui.display import display_calculation_progress
+            # 启用检查点时，中断（如Ctrl-C）后重新计算同一问题会自动继续
             results = self.calculator.calculate_exact(
                 self.current_config, 
                 self.current_operations,
-                progress_callback=display_calculation_progress
+                progress_callback=display_calculation_progress,
+                engine="compact",
+                checkpoint_dir=CHECKPOINT_DIR if use_checkpoint else None,
+                resume=use_checkpoint,
+                prefix_cache=prefix_cache
             )
             from ui.display import display_results
             display_results(results, is_monte_carlo=False)
@@ -153,6 +180,40 @@ class MenuController:
             print(f"❌ 计算失败: {e}")
             print("建议尝试蒙特卡洛模拟")
     
+    def run_auto_calculation(self):
+        """按预估规模自动选择精确计算、剪枝精确计算或蒙特卡洛模拟"""
+        if not self.current_config:
+            print("❌ 请先创建或加载一个问题")
+            return
+            
+        print("\n🤖 自动选择计算方法...")
+        self._display_current_problem_summary()
+        
+        try:
+            time_budget = input("输入时间预算（秒，默认60）: ").strip()
+            time_budget = float(time_budget) if time_budget else None
+            memory_budget = input("输入内存预算（MB，默认1024）: ").strip()
+            memory_budget = int(float(memory_budget) * 2**20) if memory_budget else None
+            
+            from ui.display import display_calculation_progress, display_simulation_progress, display_results
+            results = self.calculator.calculate_auto(
+                self.current_config,
+                self.current_operations,
+                time_budget=time_budget,
+                memory_budget=memory_budget,
+                progress_callback=display_calculation_progress,
+                simulation_progress_callback=display_simulation_progress
+            )
+            display_results(results, is_monte_carlo=results["auto_choice"]["method"] == "monte_carlo")
+            
+            # 保存结果
+            self.file_manager.save_results(results)
+            
+        except ValueError as e:
+            print(f"❌ 输入错误: {e}")
+        except Exception as e:
+            print(f"❌ 计算失败: {e}")
+    
     def run_monte_carlo(self):
         """运行蒙特卡洛模拟"""
         if not self.current_config:
@@ -163,21 +224,37 @@ class MenuController:
         self._display_current_problem_summary()
         
         try:
-            num_simulations = input("输入模拟次数 (默认100000): ").strip()
-            num_simulations = int(num_simulations) if num_simulations else 100000
+            target = input("输入目标置信区间半宽 (如0.001，按精度自动停止；直接回车则指定模拟次数): ").strip()
+            target_half_width = float(target) if target else None
+            if target_half_width is not None and target_half_width <= 0:
+                print("❌ 目标区间半宽必须为正数")
+                return
+            
+            if target_half_width is None:
+                num_simulations = input("输入模拟次数 (默认100000): ").strip()
+                num_simulations = int(num_simulations) if num_simulations else 100000
+            else:
+                num_simulations = input("输入模拟次数上限 (默认10000000): ").strip()
+                num_simulations = int(num_simulations) if num_simulations else 10000000
             
             if num_simulations <= 0:
                 print("❌ 模拟次数必须为正数")
                 return
-                
-            print(f"开始 {num_simulations:,} 次模拟...")
+            
+            if target_half_width is None:
+                print(f"开始 {num_simulations:,} 次模拟...")
+            else:
+                print(f"开始模拟，直到概率不低于1%的结果的95%置信区间半宽都不超过 {target_half_width}...")
             
             from ui.display import display_simulation_progress
+            from calculation.core import NUMPY_AVAILABLE
             results = self.calculator.monte_carlo_simulation(
                 self.current_config, 
                 self.current_operations, 
                 num_simulations,
-                progress_callback=display_simulation_progress
+                progress_callback=display_simulation_progress,
+                engine="numpy" if NUMPY_AVAILABLE else "python",
+                target_half_width=target_half_width
             )
             from ui.display import display_results
             display_results(results, is_monte_carlo=True)
@@ -0,0 +1,608 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'modules'))
+
+from calculation.core import ProbabilityCalculator, BallDrawOperation
+from calculation.compact import ColorIndex, StateLayout
+from config.examples import EXAMPLE_PROBLEMS
+
+
+def _silent(*args):
+    pass
+
+
+def _operations(problem):
+    return [BallDrawOperation(**op) for op in problem["operations"]]
+
+
+def test_color_index_interning():
+    index = ColorIndex(["R", "B"])
+    assert index.intern("R") == 0
+    assert index.intern("G") == 2
+    assert len(index) == 3
+
+
+def test_state_layout_round_trip():
+    layout = StateLayout({"1": {"R": 2, "B": 1}, "2": {"G": 3}})
+    state = layout.initial_state({"1": {"R": 2, "B": 1}, "2": {"G": 3}})
+    assert len(state) == layout.width == 9
+    assert layout.bag_position(1) == 0
+    assert layout.describe_hand(state) == "空手"
+    assert layout.describe_bag(state, 0) == "1B+2R"
+
+
+def test_compact_engine_matches_dict_engine():
+    problem = EXAMPLE_PROBLEMS["simple_two_bag"]
+    calculator = ProbabilityCalculator()
+    expected = calculator.calculate_exact(problem["bags_config"], _operations(problem), progress_callback=_silent)
+    results = calculator.calculate_exact(problem["bags_config"], _operations(problem),
+                                         progress_callback=_silent, engine="compact")
+    assert results["total_probability"] == pytest.approx(1.0)
+    assert results["hand_distribution"].keys() == expected["hand_distribution"].keys()
+    for hand, prob in expected["hand_distribution"].items():
+        assert results["hand_distribution"][hand] == pytest.approx(prob)
+    # 摸到两个红球，再把袋子2摸到的球放回: C(3,2)/C(5,2) * 1/3
+    assert results["hand_distribution"]["2R"] == pytest.approx(3 / 10 / 3)
+
+
+def test_unknown_engine_rejected():
+    with pytest.raises(ValueError):
+        ProbabilityCalculator().calculate_exact({1: {"R": 1}}, [], progress_callback=_silent, engine="gpu")
+
+
+def test_merge_states_keeps_distinct_bag_compositions():
+    from collections import Counter
+    from calculation.core import BagState
+    calculator = ProbabilityCalculator()
+    states = [
+        {"hand": Counter({"R": 1}), "bags": {1: BagState({"R": 1, "B": 1})}, "prob": 0.25, "path": []},
+        {"hand": Counter({"R": 1}), "bags": {1: BagState({"R": 2, "B": 0})}, "prob": 0.25, "path": []},
+        {"hand": Counter({"R": 1}), "bags": {1: BagState({"B": 1, "R": 1})}, "prob": 0.5, "path": []},
+    ]
+    merged = calculator._merge_states(states)
+    assert sorted(state["prob"] for state in merged) == [0.25, 0.75]
+
+
+def test_dict_engine_matches_compact_engine_on_returns():
+    problem = EXAMPLE_PROBLEMS["original_problem"]
+    calculator = ProbabilityCalculator()
+    expected = calculator.calculate_exact(problem["bags_config"], _operations(problem),
+                                          progress_callback=_silent, engine="compact")
+    results = calculator.calculate_exact(problem["bags_config"], _operations(problem), progress_callback=_silent)
+    for hand, prob in expected["hand_distribution"].items():
+        assert results["hand_distribution"][hand] == pytest.approx(prob)
+
+
+def test_outcome_table_cache_hits_and_evictions():
+    from calculation.outcomes import OutcomeTableCache
+    cache = OutcomeTableCache(maxsize=2)
+    table = cache.get((3, 2), 2)
+    assert sum(table.probabilities) == pytest.approx(1.0)
+    assert table.denominator == 10
+    assert cache.get((3, 2), 2) is table
+    cache.get((1, 1), 1)
+    cache.get((2, 2), 1)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["size"]) == (1, 3, 1, 2)
+
+
+def test_draw_balls_uses_outcome_table():
+    from calculation.core import BagState
+    results = BagState({"R": 3, "B": 2}).draw_balls(2)
+    by_hand = {tuple(sorted(balls)): prob for balls, prob in results}
+    assert by_hand[("R", "R")] == pytest.approx(0.3)
+    assert by_hand[("B", "R")] == pytest.approx(0.6)
+    assert BagState({"R": 1}).draw_balls(2) == [([], 1.0)]
+
+
+def test_iter_count_vectors_enumerates_bounded_compositions():
+    import itertools
+    from calculation.outcomes import iter_count_vectors
+    limits = (2, 0, 3, 1)
+    expected = [v for v in itertools.product(*(range(n + 1) for n in limits)) if sum(v) == 3]
+    assert list(iter_count_vectors(limits, 3)) == expected
+    assert list(iter_count_vectors((1, 1), 3)) == []
+    assert list(iter_count_vectors((), 0)) == [()]
+
+
+def test_bag_bulk_vector_operations():
+    from calculation.core import BagState
+    bag = BagState({"R": 3, "B": 2})
+    bag.remove_counts({"R": 2, "B": 1})
+    bag.add_counts({"G": 2, "B": 1})
+    assert bag.total_balls == 5
+    assert bag.composition_key() == (("B", 2), ("G", 2), ("R", 1))
+
+
+def test_bag_collection_copies_only_the_changed_bag():
+    from calculation.core import BagState, BagCollection
+    parent = BagCollection({1: BagState({"R": 3, "B": 2}), "2": BagState({"Y": 4})})
+    child = parent.with_changed(1, lambda bag: bag.remove_counts({"R": 1}))
+    assert child["2"] is parent["2"]
+    assert child[1] is not parent[1]
+    assert parent[1].composition_key() == (("B", 2), ("R", 3))
+    assert child[1].composition_key() == (("B", 2), ("R", 2))
+    # 兼容字符串/整数键，不存在的袋子原样共享
+    assert parent.get(2) is parent["2"]
+    assert parent.with_changed(9, lambda bag: bag.add_ball("R")) is parent
+
+
+def test_trace_mode_records_shared_prefix_paths():
+    problem = EXAMPLE_PROBLEMS["simple_two_bag"]
+    calculator = ProbabilityCalculator()
+    plain = calculator.calculate_exact(problem["bags_config"], _operations(problem), progress_callback=_silent)
+    assert "paths" not in plain
+    traced = calculator.calculate_exact(problem["bags_config"], _operations(problem),
+                                        progress_callback=_silent, trace=True)
+    assert len(traced["paths"]) == traced["total_states"]
+    for entry in traced["paths"]:
+        assert [step.split(":")[0] for step in entry["path"]] == ["draw1", "draw2", "return1"]
+
+
+def test_exact_arithmetic_mode_returns_fractions():
+    from fractions import Fraction
+    problem = EXAMPLE_PROBLEMS["simple_two_bag"]
+    calculator = ProbabilityCalculator()
+    results = calculator.calculate_exact(problem["bags_config"], _operations(problem), progress_callback=_silent,
+                                         engine="compact", exact_arithmetic=True)
+    assert results["exact_total_probability"] == "1"
+    assert results["total_probability"] == 1.0
+    assert Fraction(results["exact_hand_distribution"]["2R"]) == Fraction(1, 10)
+    with pytest.raises(ValueError):
+        calculator.calculate_exact(problem["bags_config"], _operations(problem),
+                                   progress_callback=_silent, exact_arithmetic=True)
+
+
+def test_dead_bags_are_retired_with_exact_marginals():
+    problem = EXAMPLE_PROBLEMS["three_bag_sequence"]
+    calculator = ProbabilityCalculator()
+    expected = calculator.calculate_exact(problem["bags_config"], _operations(problem), progress_callback=_silent)
+    results = calculator.calculate_exact(problem["bags_config"], _operations(problem),
+                                         progress_callback=_silent, engine="compact")
+    # 袋子2和袋子3在最后一次使用后移出状态空间
+    assert results["total_states"] < expected["total_states"]
+    for bag_id, distribution in expected["bag_distributions"].items():
+        for bag_state, prob in distribution.items():
+            assert results["bag_distributions"][bag_id][bag_state] == pytest.approx(prob)
+
+    only_bag_1 = calculator.calculate_exact(problem["bags_config"], _operations(problem), progress_callback=_silent,
+                                            engine="compact", output_bags=[1])
+    assert list(only_bag_1["bag_distributions"]) == [1]
+
+
+def test_focus_colors_lumps_other_colors_exactly():
+    from calculation.core import lump_colors
+    bags_config = {1: {"R": 3, "G": 2, "B": 4}, 2: {"G": 1, "Y": 1}}
+    assert lump_colors(bags_config, ["R"]) == {1: {"R": 3, "其他": 6}, 2: {"其他": 2}}
+    operations = [BallDrawOperation(1, 3, "draw"), BallDrawOperation(2, 1, "draw"), BallDrawOperation(1, 1, "return")]
+    calculator = ProbabilityCalculator()
+    full = calculator.calculate_exact(bags_config, operations, progress_callback=_silent, engine="compact")
+    lumped = calculator.calculate_exact(bags_config, operations, progress_callback=_silent,
+                                        engine="compact", focus_colors=["R"])
+    red_full = {}
+    for hand, prob in full["hand_distribution"].items():
+        reds = sum(int(part[:-1]) for part in hand.split("+") if part.endswith("R"))
+        red_full[reds] = red_full.get(reds, 0) + prob
+    for hand, prob in lumped["hand_distribution"].items():
+        reds = sum(int(part[:-1]) for part in hand.split("+") if part.endswith("R"))
+        assert prob == pytest.approx(red_full[reds])
+    assert len(lumped["hand_distribution"]) < len(full["hand_distribution"])
+
+
+def test_optimize_operations_fuses_and_drops_dead_discards():
+    from calculation.optimizer import optimize_operations
+    bags_config = {"1": {"R": 4, "B": 4}, "2": {"G": 2, "Y": 3}}
+    operations = [BallDrawOperation(1, 2, "draw"), BallDrawOperation(2, 1, "discard"),
+                  BallDrawOperation(1, 1, "draw"), BallDrawOperation(2, 9, "draw")]
+    optimized, rewrites = optimize_operations(bags_config, operations, output_bags=[1])
+    assert [(op.bag_id, op.draw_count, op.operation_type) for op in optimized] == [(1, 3, "draw")]
+    assert len(rewrites) == 4
+
+    calculator = ProbabilityCalculator()
+    expected = calculator.calculate_exact(bags_config, operations, progress_callback=_silent, engine="compact",
+                                          exact_arithmetic=True, output_bags=[1])
+    results = calculator.calculate_exact(bags_config, optimized, progress_callback=_silent, engine="compact",
+                                         exact_arithmetic=True, output_bags=[1])
+    assert results["exact_hand_distribution"] == expected["exact_hand_distribution"]
+    assert results["bag_distributions"] == expected["bag_distributions"]
+
+
+def test_parallel_expansion_matches_serial_engine():
+    from calculation.compact import CompactExactEngine
+    problem = EXAMPLE_PROBLEMS["original_problem"]
+    serial = CompactExactEngine(problem["bags_config"], exact_arithmetic=True)
+    expected = serial.aggregate(serial.run(_operations(problem), progress_callback=_silent))
+    parallel = CompactExactEngine(problem["bags_config"], exact_arithmetic=True, workers=2)
+    parallel.PARALLEL_MIN_STATES = 0
+    results = parallel.aggregate(parallel.run(_operations(problem), progress_callback=_silent))
+    assert results == expected
+
+
+def test_numpy_engine_matches_compact_engine():
+    pytest.importorskip("numpy")
+    calculator = ProbabilityCalculator()
+    for problem in EXAMPLE_PROBLEMS.values():
+        expected = calculator.calculate_exact(problem["bags_config"], _operations(problem),
+                                              progress_callback=_silent, engine="compact")
+        results = calculator.calculate_exact(problem["bags_config"], _operations(problem),
+                                             progress_callback=_silent, engine="numpy")
+        assert results["engine"] == "numpy"
+        assert results["hand_distribution"].keys() == expected["hand_distribution"].keys()
+        for hand, prob in expected["hand_distribution"].items():
+            assert results["hand_distribution"][hand] == pytest.approx(prob)
+        for bag_id, distribution in expected["bag_distributions"].items():
+            for bag, prob in distribution.items():
+                assert results["bag_distributions"][bag_id][bag] == pytest.approx(prob)
+
+
+def test_numpy_engine_handles_binomials_beyond_float_range():
+    pytest.importorskip("numpy")
+    # C(1400, 600) 超出float64范围
+    bags_config = {1: {"红": 700, "蓝": 700}}
+    operations = [BallDrawOperation(1, 600, "draw"), BallDrawOperation(1, 1, "return")]
+    calculator = ProbabilityCalculator()
+    expected = calculator.calculate_exact(bags_config, operations, progress_callback=_silent, engine="compact")
+    results = calculator.calculate_exact(bags_config, operations, progress_callback=_silent, engine="numpy")
+    assert results["total_probability"] == pytest.approx(1.0)
+    assert results["hand_distribution"].keys() == expected["hand_distribution"].keys()
+    for hand, prob in expected["hand_distribution"].items():
+        assert results["hand_distribution"][hand] == pytest.approx(prob, rel=1e-9, abs=1e-300)
+
+
+def test_pruning_reports_discarded_mass_without_renormalising():
+    from calculation.pruning import PruningPolicy
+    problem = EXAMPLE_PROBLEMS["original_problem"]
+    calculator = ProbabilityCalculator()
+    full = calculator.calculate_exact(problem["bags_config"], _operations(problem), progress_callback=_silent,
+                                      engine="compact", exact_arithmetic=True)
+    assert full["error_bound"] == 0.0
+    policy = PruningPolicy(max_states=10, keep=10, min_probability=1e-4)
+    cases = [("dict", False), ("compact", False), ("compact", True)]
+    try:
+        import numpy  # noqa: F401
+        cases.append(("numpy", False))
+    except ImportError:
+        pass
+    for engine, exact in cases:
+        results = calculator.calculate_exact(problem["bags_config"], _operations(problem), progress_callback=_silent,
+                                             engine=engine, exact_arithmetic=exact, pruning=policy)
+        assert results["pruned_states"] > 0
+        assert results["total_states"] <= policy.max_states
+        assert results["total_probability"] + results["error_bound"] == pytest.approx(1.0)
+        for hand, prob in results["hand_distribution"].items():
+            assert prob <= full["hand_distribution"][hand] + 1e-12
+            assert full["hand_distribution"][hand] - prob <= results["error_bound"] + 1e-12
+
+
+def test_pruning_policy_top_k_uses_partial_selection():
+    from calculation.pruning import PruningPolicy, kth_largest
+    assert kth_largest([5, 1, 4, 1, 3], 2) == 4
+    assert kth_largest([2, 2, 2], 3) == 2
+    policy = PruningPolicy(max_states=3, keep=3)
+    kept, dropped, count = policy.select([0.1, 0.3, 0.2, 0.2, 0.2], lambda w: w)
+    assert sorted(kept) == [0.2, 0.2, 0.3]
+    assert dropped == pytest.approx(0.3)
+    assert count == 2
+
+
+def test_memory_budget_spills_frontier_without_losing_accuracy(tmp_path):
+    problem = EXAMPLE_PROBLEMS["original_problem"]
+    calculator = ProbabilityCalculator()
+    expected = calculator.calculate_exact(problem["bags_config"], _operations(problem), progress_callback=_silent,
+                                          engine="compact")
+    results = calculator.calculate_exact(problem["bags_config"], _operations(problem), progress_callback=_silent,
+                                         engine="compact", memory_budget=20000, spill_dir=str(tmp_path / "spill"))
+    assert results["spilled_steps"] > 0
+    assert results["total_states"] == expected["total_states"]
+    for hand, prob in expected["hand_distribution"].items():
+        assert results["hand_distribution"][hand] == pytest.approx(prob)
+    # 不存在的溢出目录自动创建，计算结束后其中不留下溢出文件
+    assert list((tmp_path / "spill").iterdir()) == []
+    with pytest.raises(ValueError):
+        calculator.calculate_exact(problem["bags_config"], _operations(problem), progress_callback=_silent,
+                                   engine="compact", exact_arithmetic=True, memory_budget=20000)
+
+
+def test_estimator_bounds_actual_frontier_sizes():
+    from calculation.compact import CompactExactEngine
+    from calculation.estimator import count_vectors, estimate_state_space
+    assert count_vectors([2, 1], 2) == 2
+    assert count_vectors([3, 3, 3], 3) == 10
+
+    class RecordingEngine(CompactExactEngine):
+        def expand(self, frontier, operation):
+            new_frontier = super().expand(frontier, operation)
+            self.sizes.append(len(new_frontier))
+            return new_frontier
+
+    for problem in EXAMPLE_PROBLEMS.values():
+        engine = RecordingEngine(problem["bags_config"], fuse_segments=False)
+        engine.sizes = []
+        engine.run(_operations(problem), progress_callback=_silent)
+        estimate = estimate_state_space(problem["bags_config"], _operations(problem))
+        for step, actual in zip(estimate.steps, engine.sizes):
+            assert step.states >= actual
+
+
+def test_auto_method_follows_budgets():
+    from calculation.estimator import choose_method
+    problem = EXAMPLE_PROBLEMS["original_problem"]
+    calculator = ProbabilityCalculator()
+    results = calculator.calculate_auto(problem["bags_config"], _operations(problem), progress_callback=_silent)
+    assert results["auto_choice"]["method"] == "exact"
+    assert results["error_bound"] == 0.0
+    choice = choose_method(problem["bags_config"], _operations(problem), time_budget=1e-9, memory_budget=1)
+    assert choice.method == "monte_carlo"
+    assert choice.num_simulations > 0
+
+
+def test_checkpoint_resume_after_interruption(tmp_path):
+    from calculation.compact import CompactExactEngine
+    problem = EXAMPLE_PROBLEMS["original_problem"]
+    operations = _operations(problem)
+    calculator = ProbabilityCalculator()
+    expected = calculator.calculate_exact(problem["bags_config"], operations, progress_callback=_silent,
+                                          engine="compact", exact_arithmetic=True)
+
+    class InterruptedEngine(CompactExactEngine):
+        def expand(self, frontier, operation):
+            self.calls += 1
+            if self.calls == 5:
+                raise KeyboardInterrupt
+            return super().expand(frontier, operation)
+
+    engine = InterruptedEngine(problem["bags_config"], exact_arithmetic=True, checkpoint_dir=str(tmp_path),
+                               fuse_segments=False)
+    engine.calls = 0
+    with pytest.raises(KeyboardInterrupt):
+        engine.run(operations, progress_callback=_silent)
+    assert len(list(tmp_path.glob("*.ckpt"))) == 1
+
+    resumed = CompactExactEngine(problem["bags_config"], exact_arithmetic=True,
+                                 checkpoint_dir=str(tmp_path), resume=True, fuse_segments=False)
+    results = resumed.aggregate(resumed.run(operations, progress_callback=_silent))
+    assert resumed.resumed_from == 4
+    assert results["exact_hand_distribution"] == expected["exact_hand_distribution"]
+    assert results["bag_distributions"] == expected["bag_distributions"]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_prefix_cache_reuses_unchanged_prefix(tmp_path):
+    from calculation.prefix_cache import PrefixCache
+    problem = EXAMPLE_PROBLEMS["original_problem"]
+    operations = _operations(problem)
+    edited = operations[:-1] + [BallDrawOperation(operations[-1].bag_id, 2, operations[-1].operation_type)]
+    calculator = ProbabilityCalculator()
+    expected = calculator.calculate_exact(problem["bags_config"], edited, progress_callback=_silent,
+                                          engine="compact", exact_arithmetic=True)
+
+    cache = PrefixCache()
+    calculator.calculate_exact(problem["bags_config"], operations, progress_callback=_silent,
+                               engine="compact", exact_arithmetic=True, prefix_cache=cache)
+    results = calculator.calculate_exact(problem["bags_config"], edited, progress_callback=_silent,
+                                         engine="compact", exact_arithmetic=True, prefix_cache=cache)
+    assert results["prefix_cache"]["reused_operations"] == len(operations) - 1
+    assert results["exact_hand_distribution"] == expected["exact_hand_distribution"]
+    assert results["bag_distributions"] == expected["bag_distributions"]
+
+    # 不同内核算出的前沿不能互相复用
+    kernel_cache = PrefixCache()
+    calculator.calculate_exact(problem["bags_config"], operations, progress_callback=_silent,
+                               engine="compact", kernel="log", prefix_cache=kernel_cache)
+    results = calculator.calculate_exact(problem["bags_config"], edited, progress_callback=_silent,
+                                         engine="compact", kernel="exact", prefix_cache=kernel_cache)
+    assert results["prefix_cache"]["reused_operations"] == 0
+
+    # 内存预算为0时所有前沿都写入磁盘，并按磁盘预算淘汰
+    disk_cache = PrefixCache(directory=str(tmp_path), memory_budget=0)
+    calculator.calculate_exact(problem["bags_config"], operations, progress_callback=_silent,
+                               engine="compact", prefix_cache=disk_cache)
+    assert disk_cache.stats()["memory_entries"] == 0
+    # 前三个操作是同一袋子上的连续摸球/丢球段，整体展开后只缓存一次
+    assert disk_cache.stats()["disk_entries"] == len(operations) - 2
+    results = calculator.calculate_exact(problem["bags_config"], edited, progress_callback=_silent,
+                                         engine="compact", prefix_cache=disk_cache)
+    assert results["prefix_cache"]["reused_operations"] == len(operations) - 1
+    assert results["hand_distribution"] == pytest.approx(expected["hand_distribution"])
+
+    disk_cache.disk_budget = 1
+    disk_cache.put("small", {(0,): 1.0}, 1, False, {})
+    assert disk_cache.stats()["disk_entries"] == 0
+
+
+def test_independent_bags_are_solved_separately_and_convolved():
+    calculator = ProbabilityCalculator()
+    for name in ("three_bag_sequence", "discard_only"):
+        problem = EXAMPLE_PROBLEMS[name]
+        expected = calculator.calculate_exact(problem["bags_config"], _operations(problem), progress_callback=_silent,
+                                              engine="compact", exact_arithmetic=True, decompose=False)
+        results = calculator.calculate_exact(problem["bags_config"], _operations(problem), progress_callback=_silent,
+                                             engine="compact", exact_arithmetic=True)
+        assert results["exact_hand_distribution"] == expected["exact_hand_distribution"]
+        assert results["bag_distributions"] == expected["bag_distributions"]
+
+    # 交替摸球、没有放回：四个分量各自展开，状态数相加而不是相乘
+    bags_config = {bag_id: {"R": 4, "B": 4, "G": 4} for bag_id in range(1, 5)}
+    operations = [BallDrawOperation(bag_id, 1, "draw") for _ in range(3) for bag_id in range(1, 5)]
+    results = calculator.calculate_exact(bags_config, operations, progress_callback=_silent, engine="compact")
+    assert results["decomposition"]["components"] == [[1], [2], [3], [4]]
+    assert results["decomposition"]["peak_component_states"] <= 4 * 10 * 10
+    assert results["total_probability"] == pytest.approx(1.0)
+
+
+def test_single_bag_draw_segments_expand_in_one_shot():
+    from calculation.compact import CompactExactEngine
+    from calculation.outcomes import SegmentOutcomeTable
+    table = SegmentOutcomeTable((3, 5), 2, 1, "log")
+    assert sum(table.probabilities) == pytest.approx(1.0)
+    exact_table = SegmentOutcomeTable((3, 5), 2, 1, "exact")
+    assert sum(exact_table.weights) == exact_table.denominator == 28 * 6
+
+    bags_config = {1: {"R": 30, "Y": 20, "B": 40}, 2: {"P": 5, "K": 5}}
+    operations = [BallDrawOperation(1, 3, "draw"), BallDrawOperation(1, 2, "discard"), BallDrawOperation(1, 200, "draw"),
+                  BallDrawOperation(1, 2, "draw"), BallDrawOperation(2, 1, "draw"), BallDrawOperation(2, 1, "return"),
+                  BallDrawOperation(1, 1, "draw"), BallDrawOperation(1, 1, "discard")]
+    expected_engine = CompactExactEngine(bags_config, exact_arithmetic=True, fuse_segments=False)
+    expected = expected_engine.aggregate(expected_engine.run(operations, progress_callback=_silent))
+    engine = CompactExactEngine(bags_config, exact_arithmetic=True)
+    results = engine.aggregate(engine.run(operations, progress_callback=_silent))
+    # 球数不足的摸球不会发生，但不打断所在的段
+    assert [(start, segment.end) for start, segment in engine._segments.items()] == [(0, 3), (6, 7)]
+    assert results["exact_hand_distribution"] == expected["exact_hand_distribution"]
+    assert results["bag_distributions"] == expected["bag_distributions"]
+
+
+def test_log_kernel_matches_exact_kernel_on_large_bags():
+    from calculation.outcomes import OutcomeTable, LOG_KERNEL_MIN_BALLS, resolve_kernel
+    exact = OutcomeTable((600, 300, 150), 30, "exact")
+    approx = OutcomeTable((600, 300, 150), 30, "log")
+    assert approx.vectors == exact.vectors and approx.sparse == exact.sparse
+    assert approx.denominator is None
+    for p, q in zip(approx.probabilities, exact.probabilities):
+        assert p == pytest.approx(q, rel=1e-10)
+    assert resolve_kernel("auto", LOG_KERNEL_MIN_BALLS) == "log"
+    assert resolve_kernel("auto", LOG_KERNEL_MIN_BALLS - 1) == "exact"
+
+    bags_config = {1: {"R": 700, "Y": 500}, 2: {"B": 900, "G": 300}}
+    operations = [BallDrawOperation(1, 3, "draw"), BallDrawOperation(2, 2, "draw"), BallDrawOperation(1, 1, "return"),
+                  BallDrawOperation(1, 2, "draw")]
+    calculator = ProbabilityCalculator()
+    expected = calculator.calculate_exact(bags_config, operations, progress_callback=_silent, engine="compact",
+                                          kernel="exact")
+    for engine in ("dict", "compact"):
+        results = calculator.calculate_exact(bags_config, operations, progress_callback=_silent, engine=engine,
+                                             kernel="log")
+        for hand, prob in expected["hand_distribution"].items():
+            assert results["hand_distribution"][hand] == pytest.approx(prob, rel=1e-10)
+    with pytest.raises(ValueError):
+        calculator.calculate_exact(bags_config, operations, progress_callback=_silent, engine="compact",
+                                   exact_arithmetic=True, kernel="log")
+
+
+def test_count_sampler_matches_exact_distribution():
+    import random
+    problem = EXAMPLE_PROBLEMS["original_problem"]
+    calculator = ProbabilityCalculator()
+    exact = calculator.calculate_exact(problem["bags_config"], _operations(problem),
+                                       progress_callback=_silent, engine="compact")
+    results = calculator.monte_carlo_simulation(problem["bags_config"], _operations(problem), 20000,
+                                                progress_callback=_silent, rng=random.Random(7))
+    assert results["total_probability"] == pytest.approx(1.0)
+    assert set(results["bag_distributions"]) == set(exact["bag_distributions"])
+    for hand, prob in exact["hand_distribution"].items():
+        assert results["hand_distribution"].get(hand, 0.0) == pytest.approx(prob, abs=0.02)
+    again = calculator.monte_carlo_simulation(problem["bags_config"], _operations(problem), 20000,
+                                              progress_callback=_silent, rng=random.Random(7))
+    assert again["hand_distribution"] == results["hand_distribution"]
+
+
+def test_numpy_batch_sampler_matches_exact_distribution():
+    np = pytest.importorskip("numpy")
+    calculator = ProbabilityCalculator()
+    for problem in EXAMPLE_PROBLEMS.values():
+        exact = calculator.calculate_exact(problem["bags_config"], _operations(problem),
+                                           progress_callback=_silent, engine="compact")
+        results = calculator.monte_carlo_simulation(problem["bags_config"], _operations(problem), 50000,
+                                                    progress_callback=_silent, engine="numpy", batch_size=7000,
+                                                    rng=np.random.default_rng(3))
+        assert results["engine"] == "numpy"
+        assert results["simulations"] == 50000
+        assert results["total_probability"] == pytest.approx(1.0)
+        for hand, prob in exact["hand_distribution"].items():
+            assert results["hand_distribution"].get(hand, 0.0) == pytest.approx(prob, abs=0.01)
+        for bag_id, distribution in exact["bag_distributions"].items():
+            for bag, prob in distribution.items():
+                assert results["bag_distributions"][bag_id].get(bag, 0.0) == pytest.approx(prob, abs=0.01)
+
+
+def test_parallel_simulation_is_reproducible_from_one_seed():
+    problem = EXAMPLE_PROBLEMS["original_problem"]
+    calculator = ProbabilityCalculator()
+    exact = calculator.calculate_exact(problem["bags_config"], _operations(problem),
+                                       progress_callback=_silent, engine="compact")
+    engines = ["python"]
+    try:
+        import numpy  # noqa: F401
+        engines.append("numpy")
+    except ImportError:
+        pass
+    for engine in engines:
+        runs = [calculator.monte_carlo_simulation(problem["bags_config"], _operations(problem), 9001,
+                                                  progress_callback=_silent, engine=engine, workers=2, seed=42)
+                for _ in range(2)]
+        assert runs[0]["hand_distribution"] == runs[1]["hand_distribution"]
+        assert runs[0]["bag_distributions"] == runs[1]["bag_distributions"]
+        assert (runs[0]["workers"], runs[0]["seed"]) == (2, 42)
+        for hand, prob in exact["hand_distribution"].items():
+            assert runs[0]["hand_distribution"].get(hand, 0.0) == pytest.approx(prob, abs=0.03)
+        other_seed = calculator.monte_carlo_simulation(problem["bags_config"], _operations(problem), 9001,
+                                                       progress_callback=_silent, engine=engine, workers=2, seed=43)
+        assert other_seed["hand_distribution"] != runs[0]["hand_distribution"]
+    with pytest.raises(ValueError):
+        calculator.monte_carlo_simulation(problem["bags_config"], _operations(problem), 10,
+                                          progress_callback=_silent, workers=0)
+
+
+def test_adaptive_simulation_stops_at_target_interval_width():
+    import random
+    from calculation.sampler import wilson_interval
+    interval = wilson_interval(30, 100, 1.96)
+    assert interval["low"] < 0.3 < interval["high"]
+    assert interval["half_width"] == pytest.approx((interval["high"] - interval["low"]) / 2)
+
+    problem = EXAMPLE_PROBLEMS["original_problem"]
+    calculator = ProbabilityCalculator()
+    exact = calculator.calculate_exact(problem["bags_config"], _operations(problem),
+                                       progress_callback=_silent, engine="compact")
+    results = calculator.monte_carlo_simulation(problem["bags_config"], _operations(problem), 1_000_000,
+                                                progress_callback=_silent, rng=random.Random(5),
+                                                target_half_width=0.01)
+    assert results["converged"]
+    assert results["simulations"] < 1_000_000
+    watched = [i for i in results["confidence_intervals"].values() if i["estimate"] >= 0.01]
+    assert watched and all(i["half_width"] <= 0.01 for i in watched)
+    for hand, prob in exact["hand_distribution"].items():
+        assert results["hand_distribution"].get(hand, 0.0) == pytest.approx(prob, abs=0.03)
+
+    capped = calculator.monte_carlo_simulation(problem["bags_config"], _operations(problem), 2000,
+                                               progress_callback=_silent, rng=random.Random(5),
+                                               target_half_width=0.0001)
+    assert not capped["converged"]
+    assert capped["simulations"] == 2000
+
+
+def test_rao_blackwell_simulation_computes_draw_only_suffix_exactly():
+    import random
+    calculator = ProbabilityCalculator()
+    problem = EXAMPLE_PROBLEMS["original_problem"]
+    exact = calculator.calculate_exact(problem["bags_config"], _operations(problem),
+                                       progress_callback=_silent, engine="compact")
+    plain = calculator.monte_carlo_simulation(problem["bags_config"], _operations(problem), 5000,
+                                              progress_callback=_silent, rng=random.Random(11))
+    blended = calculator.monte_carlo_simulation(problem["bags_config"], _operations(problem), 5000,
+                                                progress_callback=_silent, rng=random.Random(11),
+                                                rao_blackwell=True)
+    assert blended["rao_blackwell"]["exact_operations"] > 0
+    assert blended["total_probability"] == pytest.approx(1.0)
+    for hand, prob in exact["hand_distribution"].items():
+        assert blended["hand_distribution"].get(hand, 0.0) == pytest.approx(prob, abs=0.02)
+        if hand in plain["confidence_intervals"] and hand in blended["confidence_intervals"]:
+            assert (blended["confidence_intervals"][hand]["std_error"]
+                    <= plain["confidence_intervals"][hand]["std_error"] * 1.05)
+
+    # 没有放回时整个操作序列都是后缀，结果与精确计算一致
+    bags_config = {1: {"R": 4, "B": 3}, 2: {"Y": 2, "G": 2}}
+    operations = [BallDrawOperation(bag_id=1, draw_count=2, operation_type="draw"),
+                  BallDrawOperation(bag_id=2, draw_count=1, operation_type="discard"),
+                  BallDrawOperation(bag_id=2, draw_count=2, operation_type="draw")]
+    exact = calculator.calculate_exact(bags_config, operations, progress_callback=_silent, engine="compact")
+    blended = calculator.monte_carlo_simulation(bags_config, operations, 10, progress_callback=_silent,
+                                                rao_blackwell=True)
+    assert blended["rao_blackwell"]["sampled_operations"] == 0
+    for hand, prob in exact["hand_distribution"].items():
+        assert blended["hand_distribution"][hand] == pytest.approx(prob)
+    assert all(interval["half_width"] == pytest.approx(0.0, abs=1e-12)
+               for interval in blended["confidence_intervals"].values())